@@ -0,0 +1,180 @@
+import bisect
+import threading
+import numpy as np
+import pandas as pd
+import inventory_query
+from inventory import parse_times, latest_times
+
+# Rows kept per user; the dashboard shows 20
+ACTIVITY_DEPTH = 100
+# Pseudo-user whose list holds everyone's activity (what the admin sees)
+ALL_USERS = "*"
+
+_ROW_COLUMNS = [c for c in inventory_query.DISPLAY_COLUMNS if c != "days_since_stored"]
+
+def _row_keys(df, stored_ts, latest_ts):
+    # Sort key per row: rows with activity before rows without, then newest, then highest id
+    ids = pd.to_numeric(df['id'], errors='coerce').fillna(0).astype('int64').values if 'id' in df.columns \
+        else np.zeros(len(df), dtype='int64')
+    missing = np.isnat(latest_ts)
+    ts = np.where(missing, 0, latest_ts.astype('int64'))
+    return list(zip((~missing).astype(int).tolist(), ts.tolist(), ids.tolist()))
+
+def _row_users(df):
+    # Who a row counts as activity for: whoever checked it in or out, and the all-users list
+    users = [[ALL_USERS] for _ in range(len(df))]
+    for col in ['checkin_user_id', 'checkout_user_id']:
+        if col in df.columns:
+            for i, email in enumerate(df[col].tolist()):
+                if isinstance(email, str) and email and email not in users[i]:
+                    users[i].append(email)
+    return users
+
+def _records(df):
+    cols = [c for c in _ROW_COLUMNS if c in df.columns]
+    return df[cols].to_dict('records')
+
+class _UserList:
+    __slots__ = ("keys", "complete")
+
+    def __init__(self, keys, complete):
+        # Ascending, so the newest row is at the end
+        self.keys = keys
+        # False once rows older than keys[0] have been dropped to stay within the depth
+        self.complete = complete
+
+class ActivityIndex:
+    """
+    Every user's most recent aliquots (those they checked in or out), newest first, for the
+    dashboard's Recent Activity view. Built from one aliquots snapshot, then moved forward by
+    our own writes through advance(), so the view is a bounded lookup however big the
+    inventory gets. A snapshot it hasn't seen (another server's write, a reload) means
+    a rebuild on the next read.
+    Each user keeps at most `depth` rows: the newest ones, so whatever is dropped is older
+    than everything kept.
+    """
+
+    def __init__(self, depth=ACTIVITY_DEPTH):
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.version = None
+        self.lists = {}
+        # aliquot id -> (sort key, users whose list holds it, display values)
+        self.rows = {}
+
+    def rebuild(self, inv):
+        """Recomputes every list from an inventory snapshot (one vectorized pass)."""
+        df = inv.aliquots
+        version = df.attrs.get("snapshot_version")
+        lists, rows = {}, {}
+        if not df.empty:
+            order = inventory_query.get_browse_index(inv).order("Latest Activity")
+            ranks = np.arange(len(order))
+            parts = [pd.DataFrame({"user": ALL_USERS, "rank": ranks, "pos": order})]
+            for col in ['checkin_user_id', 'checkout_user_id']:
+                if col in df.columns:
+                    parts.append(pd.DataFrame({"user": df[col].values[order], "rank": ranks, "pos": order}))
+            hits = pd.concat(parts, ignore_index=True)
+            hits = hits[hits["user"].fillna("").astype(str) != ""]
+            hits = hits.drop_duplicates(["user", "pos"]).sort_values("rank", kind="stable")
+            sizes = hits.groupby("user", sort=False).size()
+            kept = hits.groupby("user", sort=False).head(self.depth)
+
+            positions = np.unique(kept["pos"].values)
+            subset = df.iloc[positions]
+            keys = _row_keys(subset, inv.stored_ts[positions], inv.latest_ts[positions])
+            by_pos = dict(zip(positions.tolist(), zip(keys, _records(subset), inv.stored_ts[positions])))
+            for user, group in kept.groupby("user", sort=False):
+                user_keys = []
+                for pos in group["pos"].tolist():
+                    key, record, stored = by_pos[pos]
+                    rows.setdefault(key[2], [key, set(), record, stored])[1].add(user)
+                    user_keys.append(key)
+                user_keys.reverse()
+                lists[user] = _UserList(user_keys, int(sizes[user]) <= self.depth)
+        with self.lock:
+            self.lists, self.rows, self.version = lists, rows, version
+
+    def _drop(self, aliquot_id, user):
+        entry = self.rows.get(aliquot_id)
+        if entry is None or user not in entry[1]:
+            return
+        ulist = self.lists[user]
+        i = bisect.bisect_left(ulist.keys, entry[0])
+        if i < len(ulist.keys) and ulist.keys[i] == entry[0]:
+            del ulist.keys[i]
+        entry[1].discard(user)
+
+    def _add(self, key, user):
+        ulist = self.lists.setdefault(user, _UserList([], True))
+        # A row older than everything kept may sit behind rows that were already dropped
+        if not ulist.complete and (not ulist.keys or key < ulist.keys[0]):
+            return False
+        bisect.insort(ulist.keys, key)
+        if len(ulist.keys) > self.depth:
+            oldest = ulist.keys.pop(0)
+            self.rows[oldest[2]][1].discard(user)
+            ulist.complete = False
+        return key in ulist.keys
+
+    def advance(self, base_version, new_version, delta):
+        """
+        Applies a committed aliquots delta (see storage.compute_delta) made against the snapshot
+        base_version, which became new_version. Anything it can't follow (another base, a
+        whole-sheet write, deleted rows) is left for the next read to rebuild.
+        """
+        with self.lock:
+            if self.version is None or self.version != base_version or delta is None or delta["deletes"]:
+                return
+            changed = [values for _, values in delta["updates"]] + list(delta["inserts"])
+            if changed:
+                df = pd.DataFrame(changed, columns=delta["columns"])
+                stored_ts = parse_times(df, 'stored_time')
+                latest_ts = latest_times(stored_ts, parse_times(df, 'checkout_time'))
+                for key, users, record, stored in zip(_row_keys(df, stored_ts, latest_ts), _row_users(df),
+                                                      _records(df), stored_ts):
+                    old = self.rows.get(key[2])
+                    if old is not None:
+                        for user in list(old[1]):
+                            self._drop(key[2], user)
+                    entry = [key, set(), record, stored]
+                    self.rows[key[2]] = entry
+                    for user in users:
+                        if self._add(key, user):
+                            entry[1].add(user)
+                # Rows pushed out of every list
+                for aliquot_id in [a for a, e in self.rows.items() if not e[1]]:
+                    del self.rows[aliquot_id]
+            self.version = new_version
+
+    def recent(self, user_email, limit, version):
+        """
+        The newest `limit` rows for a user as display records, or None when the index can't
+        answer from what it holds (a different snapshot, or too few rows left after drops).
+        """
+        with self.lock:
+            if version is None or version != self.version:
+                return None
+            ulist = self.lists.get(user_email)
+            if ulist is None:
+                return []
+            if not ulist.complete and len(ulist.keys) < limit:
+                return None
+            out = []
+            for key in reversed(ulist.keys[-limit:]):
+                _, _, record, stored = self.rows[key[2]]
+                out.append((record, stored))
+            return out
+
+    def to_frame(self, rows, now):
+        """Display frame for what recent() returned, with Days Stored as of now."""
+        df = pd.DataFrame([record for record, _ in rows])
+        if 'stored_time' in df.columns:
+            stored = np.array([ts for _, ts in rows], dtype='datetime64[ns]')
+            df['days_since_stored'] = inventory_query.days_stored(stored, now)
+        cols = [c for c in inventory_query.DISPLAY_COLUMNS if c in df.columns]
+        return df[cols].rename(columns=inventory_query.DISPLAY_COLUMNS)
+
+    def stats(self):
+        with self.lock:
+            return {"version": self.version, "users": len(self.lists), "rows": len(self.rows)}
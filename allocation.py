@@ -0,0 +1,134 @@
+from inventory import extract_patient_id
+from occupancy import BOX_CAPACITY
+
+# Ergonomic rack routing: Pass 1 goes to the type's own rack, Pass 2 to the overflow rack,
+# Pass 3 anywhere in the freezer.
+PREFERRED_RACKS = {"Plasma": 1, "Serum": 2, "Urine": 3}
+OVERFLOW_RACK = 4
+
+def normalize_type(value):
+    s_type = str(value).strip()
+    if s_type == "" or s_type == "nan" or s_type == "None":
+        return None
+    return s_type
+
+class CapacityIndex:
+    """
+    Boxes bucketed by (rack, specimen type) and then by free spots, each bucket kept
+    in freezer (sheet) order. Finding the first box with room for `count` tubes only
+    looks at the head of at most 82 buckets per rack instead of every box.
+    """
+
+    def __init__(self, df_boxes):
+        self.box_ids = []
+        self.position = {}
+        self.state = {}
+        self.bins = {}
+        for pos, (b_id, rack, s_type, used) in enumerate(zip(
+                df_boxes['id'], df_boxes['rack_num'], df_boxes['specimen_type'], df_boxes['spots_used'])):
+            self.box_ids.append(b_id)
+            self.position[b_id] = pos
+            free = min(max(BOX_CAPACITY - int(used), 0), BOX_CAPACITY)
+            self.state[b_id] = (rack, normalize_type(s_type), free)
+            buckets = self.bins.setdefault((rack, normalize_type(s_type)), [[] for _ in range(BOX_CAPACITY + 1)])
+            # Positions are appended in increasing order, so every bucket is already sorted
+            buckets[free].append(pos)
+        self.racks = list(dict.fromkeys(rack for rack, _ in self.bins))
+
+    def first_fit(self, racks, specimen_type, count, skip):
+        """Position of the first box in `racks` that fits, ignoring box ids in `skip`."""
+        best = None
+        for rack in racks:
+            for key in (specimen_type, None):
+                buckets = self.bins.get((rack, key))
+                if not buckets:
+                    continue
+                for free in range(max(count, 0), BOX_CAPACITY + 1):
+                    for pos in buckets[free]:
+                        if best is not None and pos >= best:
+                            break
+                        if self.box_ids[pos] not in skip:
+                            best = pos
+                            break
+        return best
+
+class AllocationEngine:
+    """
+    Plans placements against one inventory snapshot. The shared CapacityIndex is never
+    modified; boxes touched while planning are tracked in a small overlay instead.
+    """
+
+    def __init__(self, inv):
+        self.inv = inv
+        self.capacity = get_capacity_index(inv)
+        self.changed = {}
+        self.visit_boxes = {}
+        self.patient_boxes = {}
+
+    def box_state(self, box_id):
+        return self.changed.get(box_id, self.capacity.state.get(box_id))
+
+    def spots_used(self, box_id):
+        return BOX_CAPACITY - self.box_state(box_id)[2]
+
+    def forbidden_boxes(self, patientvisit_id):
+        # Constraint 1: never share a box with another visit of the same patient
+        pat_id = extract_patient_id(patientvisit_id)
+        forbidden = set()
+        for source in (self.inv.patient_boxes.get(pat_id, {}), self.patient_boxes.get(pat_id, {})):
+            for pv, boxes in source.items():
+                if pv != patientvisit_id:
+                    forbidden |= boxes
+        return forbidden
+
+    def find_box(self, racks, aliquot_type, count, forbidden):
+        skip = forbidden | set(self.changed)
+        best = self.capacity.first_fit(racks, aliquot_type, count, skip)
+        best_id = self.capacity.box_ids[best] if best is not None else None
+        # Boxes already touched by this plan live in the overlay, not in the buckets
+        for b_id, (rack, s_type, free) in self.changed.items():
+            if b_id in forbidden or rack not in racks:
+                continue
+            if (s_type is None or s_type == aliquot_type) and free >= count:
+                pos = self.capacity.position[b_id]
+                if best is None or pos < best:
+                    best, best_id = pos, b_id
+        return best_id
+
+    def choose_box(self, patientvisit_id, aliquot_type, count):
+        """Returns the box id for `count` tubes of one type from one visit, or None."""
+        # Constraint 3: keep a visit's tubes of one type together when the box still has room
+        possible_box = self.inv.visit_type_boxes.get((patientvisit_id, aliquot_type))
+        if possible_box is None:
+            possible_box = self.visit_boxes.get((patientvisit_id, aliquot_type))
+        if possible_box is not None and self.box_state(possible_box) is not None:
+            if self.box_state(possible_box)[2] >= count:
+                return possible_box
+
+        forbidden = self.forbidden_boxes(patientvisit_id)
+        preferred_rack = PREFERRED_RACKS.get(aliquot_type)
+        target_box_id = None
+
+        # Pass 1: Try preferred rack exclusively
+        if preferred_rack is not None:
+            target_box_id = self.find_box([preferred_rack], aliquot_type, count, forbidden)
+        # Pass 2: Fallback to Overflow Rack 4
+        if target_box_id is None:
+            target_box_id = self.find_box([OVERFLOW_RACK], aliquot_type, count, forbidden)
+        # Pass 3: Emergency Fallback to any rack anywhere in the freezer
+        if target_box_id is None:
+            target_box_id = self.find_box(self.capacity.racks, aliquot_type, count, forbidden)
+        return target_box_id
+
+    def reserve(self, patientvisit_id, aliquot_type, box_id, count):
+        rack, _, free = self.box_state(box_id)
+        self.changed[box_id] = (rack, aliquot_type, free - count)
+        self.visit_boxes.setdefault((patientvisit_id, aliquot_type), box_id)
+        pat_id = extract_patient_id(patientvisit_id)
+        self.patient_boxes.setdefault(pat_id, {}).setdefault(patientvisit_id, set()).add(box_id)
+
+def get_capacity_index(inv):
+    # Built once per inventory refresh and then shared read-only by every allocation
+    if inv.capacity is None:
+        inv.capacity = CapacityIndex(inv.boxes)
+    return inv.capacity
@@ -1,16 +1,21 @@
 import streamlit as st
 import pandas as pd
-import qrcode
 from PIL import Image
-from io import BytesIO
 import database
+import journal
+import csv_import
+import inventory_query
+import exporter
 import auth
 from streamlit_cookies_manager import EncryptedCookieManager
 import io
+import re
 import label_generator
-import cv2
-import numpy as np
-from pyzbar.pyzbar import decode
+import qr_service
+import qr_decode
+import box_audit
+import storage
+import metrics
 
 st.set_page_config(page_title="Freezer Inventory Management", layout="wide")
 
@@ -19,6 +24,13 @@ if not cookies.ready():
     st.stop()
 
 database.init_db()
+if storage.get_secret("QR_PRECOMPUTE", False):
+    # Optionally render every location's QR matrix up front, in the background
+    qr_service.precompute_in_background(database.get_all_location_ids())
+metrics_port = storage.get_secret("METRICS_PORT", None)
+if metrics_port:
+    # Optionally serve the timings to Prometheus at http://METRICS_HOST:METRICS_PORT/metrics
+    metrics.serve_prometheus(metrics_port, storage.get_secret("METRICS_HOST", "127.0.0.1"))
 
 if "user" not in st.session_state:
     st.session_state["user"] = None
@@ -33,19 +45,8 @@ if "user" not in st.session_state:
             cookies.save()
 
 def generate_qr(data):
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return buf.getvalue()
+    # Rendered once per location and cached for every rerun and session
+    return qr_service.qr_png(data)
 
 def login_screen():
     st.title("Freezer Inventory Login")
@@ -132,16 +133,17 @@ def main():
 
     page = st.sidebar.radio("Navigation", nav_options)
 
-    if page == "Dashboard":
-        show_dashboard(user_role)
-    elif page == "Store Aliquots":
-        show_store_aliquots()
-    elif page == "Scan/Toggle Aliquots":
-        show_scan_aliquots()
-    elif page == "User Guide":
-        show_user_guide()
-    elif page == "Admin Panel" and user_role == 'master':
-        show_admin_panel()
+    with metrics.timer(f"page.{page}"):
+        if page == "Dashboard":
+            show_dashboard(user_role)
+        elif page == "Store Aliquots":
+            show_store_aliquots()
+        elif page == "Scan/Toggle Aliquots":
+            show_scan_aliquots()
+        elif page == "User Guide":
+            show_user_guide()
+        elif page == "Admin Panel" and user_role == 'master':
+            show_admin_panel()
 
 def show_user_guide():
     st.header("Documentation")
@@ -228,6 +230,90 @@ def show_admin_panel():
                 else:
                     st.error("Provide email.")
 
+    st.markdown("---")
+    with st.expander("Dashboard Statistics Check", expanded=False):
+        st.write("The dashboard counters are kept up to date on every change. "
+                 "This recounts them from the full inventory and can repair any drift.")
+        c1, c2 = st.columns(2)
+        check = c1.button("Verify Statistics")
+        repair = c2.button("Repair Statistics")
+        if check or repair:
+            diffs = database.verify_freezer_stats(repair=repair)
+            if not diffs:
+                st.success("Statistics match the inventory.")
+            else:
+                df_diff = pd.DataFrame(
+                    [(k, stored, actual) for k, (stored, actual) in diffs.items()],
+                    columns=["Counter", "Stored", "Recounted"]
+                )
+                st.dataframe(df_diff, use_container_width=True)
+                if repair:
+                    st.success(f"Repaired {len(diffs)} counter(s).")
+                else:
+                    st.warning(f"{len(diffs)} counter(s) differ. Click Repair Statistics to fix them.")
+
+    with st.expander("Chain of Custody", expanded=False):
+        st.write("Every check-in, check-out and upload change is logged. Look up the full history of a location.")
+        hist_loc = st.text_input("Location ID", key="history_location").strip()
+        if hist_loc:
+            df_hist = database.get_aliquot_history(hist_loc)
+            if df_hist.empty:
+                st.info("No events logged for this location.")
+            else:
+                df_hist.index = range(1, len(df_hist) + 1)
+                st.dataframe(df_hist, use_container_width=True)
+        if st.button("Check Event Log"):
+            mismatches = database.verify_event_log()
+            if mismatches.empty:
+                st.success("The event log agrees with the current inventory.")
+            else:
+                st.warning(f"{len(mismatches)} aliquot(s) differ from their last logged event:")
+                st.dataframe(mismatches, use_container_width=True)
+
+    with st.expander("Scan Journal", expanded=False):
+        st.write("Single scans are saved to the inventory in batches. A scan that can't be applied "
+                 "(e.g. its record is broken) is set aside here so the scans after it still go through.")
+        scan_journal = journal.get_journal()
+        st.write(f"**{scan_journal.pending_count()}** scan(s) waiting to be saved.")
+        dead = scan_journal.dead_letters()
+        if not dead:
+            st.success("No failed scans.")
+        else:
+            df_dead = pd.DataFrame(dead).rename(columns={
+                "seq": "Seq", "location_id": "Location ID", "status": "Requested Status", "user": "User",
+                "sent_to": "Sent To", "time": "Scanned", "error": "Error", "failed_at": "Failed At"
+            })
+            st.dataframe(df_dead, use_container_width=True, hide_index=True)
+            c1, c2 = st.columns(2)
+            if c1.button("Retry Failed Scans"):
+                n = scan_journal.retry_dead_letters()
+                st.success(f"Queued {n} scan(s) again.")
+                st.rerun()
+            if c2.button("Discard Failed Scans"):
+                scan_journal.clear_dead_letters()
+                st.rerun()
+
+    with st.expander("Performance", expanded=False):
+        st.write("Time spent in each page render, database call, sheet read and write, label PDF and "
+                 "QR decode since the server started (percentiles over the last "
+                 f"{metrics.WINDOW} calls of each).")
+        df_perf = metrics.summary()
+        if df_perf.empty:
+            st.info("Nothing recorded yet.")
+        else:
+            st.dataframe(df_perf.round(2), use_container_width=True, hide_index=True)
+        df_caches = pd.DataFrame(
+            [(name, stat, value) for name, values in metrics.cache_stats().items() for stat, value in values.items()],
+            columns=["Cache", "Stat", "Value"]
+        )
+        st.dataframe(df_caches, use_container_width=True, hide_index=True)
+        c1, c2 = st.columns(2)
+        c1.download_button("Download (Prometheus format)", metrics.to_prometheus(),
+                           file_name="freezer_metrics.txt", mime="text/plain")
+        if c2.button("Reset Timings"):
+            metrics.reset()
+            st.rerun()
+
 def show_dashboard(user_role):
     st.header("Freezer Overview")
     stats = database.get_freezer_stats()
@@ -249,59 +335,128 @@ def show_dashboard(user_role):
         st.write("No aliquots stored yet.")
     
     st.markdown("---")
-    if user_role == 'master':
-        st.subheader("Complete Inventory Database (Admin View)")
-    else:
+    if user_role != 'master':
         st.subheader("Recent Activity (User View)")
-        
-    full_df = database.get_all_aliquots_df()
-    
-    if full_df.empty:
+        user_email = st.session_state["user"]["email"]
+        # get_recent_aliquots returns a dataframe. 
+        recent_df = database.get_recent_aliquots(user_email, 20)
+        if recent_df.empty:
+            st.info("No aliquots found in the database.")
+            return
+        # Use a simple sequential row number as the index
+        recent_df.index = range(1, len(recent_df) + 1)
+        st.dataframe(recent_df, use_container_width=True)
+        return
+
+    st.subheader("Complete Inventory Database (Admin View)")
+    show_inventory_browser()
+
+    st.markdown("---")
+    st.subheader("Upload/Merge Inventory Data")
+    st.markdown("Uploading a CSV with identical `Location ID` values will overwrite their details. New distinct locations are inserted securely.")
+    uploaded_file = st.file_uploader("Upload CSV", type=['csv'])
+    if uploaded_file is not None:
+        try:
+            # Only a preview is parsed here; the merge streams the file in chunks
+            df_up = pd.read_csv(uploaded_file, nrows=5)
+            uploaded_file.seek(0)
+            st.write("Preview of Upload:")
+            st.dataframe(df_up)
+            if st.button("Merge into Database"):
+                bar = st.progress(0.0, text="Importing...")
+                succ, msg, rejects = csv_import.import_aliquots_csv(
+                    uploaded_file,
+                    progress=lambda frac, rows: bar.progress(frac, text=f"Imported {rows:,} rows..."),
+                    user_email=st.session_state["user"]["email"]
+                )
+                if succ:
+                    st.success(msg)
+                    if rejects.empty:
+                        st.rerun()
+                    st.warning(f"{len(rejects)} row(s) were skipped:")
+                    st.dataframe(rejects, use_container_width=True)
+                    st.download_button(
+                        label="📥 Download Rejected Rows CSV",
+                        data=rejects.to_csv(index=False).encode('utf-8'),
+                        file_name='upload_rejects.csv',
+                        mime='text/csv',
+                    )
+                else:
+                    st.error(msg)
+        except Exception as e:
+            st.error(f"Error reading file: {e}")
+
+def show_inventory_browser():
+    options = database.get_browse_options()
+    if not options["status"]:
         st.info("No aliquots found in the database.")
-    else:
-        if user_role == 'master':
-            if not full_df.empty:
-                full_df.index = range(1, len(full_df) + 1)
-            st.dataframe(full_df, use_container_width=True)
-            
-            csv = full_df.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="📥 Download Full Inventory CSV",
-                data=csv,
-                file_name='freezer_inventory.csv',
-                mime='text/csv',
-            )
-            
-            st.markdown("---")
-            st.subheader("Upload/Merge Inventory Data")
-            st.markdown("Uploading a CSV with identical `Location ID` values will overwrite their details. New distinct locations are inserted securely.")
-            uploaded_file = st.file_uploader("Upload CSV", type=['csv'])
-            if uploaded_file is not None:
-                try:
-                    df_up = pd.read_csv(uploaded_file)
-                    st.write("Preview of Upload:")
-                    st.dataframe(df_up.head())
-                    if st.button("Merge into Database"):
-                        df_up = df_up.fillna('')
-                        succ, msg = database.upload_aliquots_data(df_up)
-                        if succ:
-                            st.success(msg)
-                            st.rerun()
-                        else:
-                            st.error(msg)
-                except Exception as e:
-                    st.error(f"Error reading file: {e}")
-        else:
-            user_email = st.session_state["user"]["email"]
-            # get_recent_aliquots returns a dataframe. 
-            recent_df = database.get_recent_aliquots(user_email, 20)
-            if not recent_df.empty:
-                # Use a simple sequential row number as the index
-                recent_df.index = range(1, len(recent_df) + 1)
-            st.dataframe(recent_df, use_container_width=True)
+        return
+
+    # Filters, sort and paging are applied server-side; only the visible page is sent to the browser
+    c1, c2, c3, c4 = st.columns(4)
+    status = c1.selectbox("Status", ["All"] + options["status"])
+    specimen_type = c2.selectbox("Specimen Type", ["All"] + options["specimen_type"])
+    rack = c3.selectbox("Rack", ["All"] + options["rack"])
+    patient_id = c4.text_input("Patient ID").strip()
+
+    c1, c2, c3, c4 = st.columns(4)
+    date_range = c1.date_input("Stored between", value=[], help="Leave empty for all dates")
+    sort_key = c2.selectbox("Sort by", inventory_query.SORT_KEYS)
+    descending = c3.selectbox("Order", ["Newest / Z-A first", "Oldest / A-Z first"]) == "Newest / Z-A first"
+    page_size = c4.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+
+    stored_from = date_range[0] if len(date_range) > 0 else None
+    stored_to = date_range[1] if len(date_range) > 1 else stored_from
+    filters = dict(
+        status=None if status == "All" else status,
+        specimen_type=None if specimen_type == "All" else specimen_type,
+        rack=None if rack == "All" else rack,
+        patient_id=patient_id or None,
+        stored_from=stored_from,
+        stored_to=stored_to,
+    )
+
+    # Clamp the page against the current result size before querying it
+    _, total = database.query_aliquots(page_size=1, **filters)
+    pages = max((total + page_size - 1) // page_size, 1)
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1)
+
+    page_df, total = database.query_aliquots(
+        sort_key=sort_key, descending=descending, page=int(page), page_size=page_size, **filters
+    )
+    start = (int(page) - 1) * page_size
+    if total == 0:
+        st.info("No aliquots match these filters.")
+        return
+    page_df.index = range(start + 1, start + len(page_df) + 1)
+    st.caption(f"Showing {start + 1}-{start + len(page_df)} of {total:,} aliquots")
+    st.dataframe(page_df, use_container_width=True)
+
+    with st.expander("Export Inventory", expanded=False):
+        c1, c2 = st.columns([1, 3])
+        fmt = c1.selectbox("Format", exporter.available_formats())
+        columns = c2.multiselect("Columns", exporter.export_columns(), default=exporter.export_columns())
+        only_filtered = st.checkbox("Only rows matching the filters above", value=False)
+        ext, mime = exporter.EXPORT_FORMATS[fmt]
+        # Passing a callable defers building the file until the button is actually clicked
+        st.download_button(
+            label=f"📥 Download Inventory ({fmt})",
+            data=lambda: database.export_aliquots(fmt, columns, filters if only_filtered else None),
+            file_name=f"freezer_inventory.{ext}",
+            mime=mime,
+            disabled=not columns,
+        )
 
 def show_store_aliquots():
     st.header("Store New Aliquots")
+    mode = st.radio("Intake Mode", ["Single Visit", "Batch CSV Intake"], horizontal=True)
+    c1, c2 = st.columns(2)
+    label_stock = c1.selectbox("Label Stock", list(label_generator.TEMPLATES))
+    label_header = c2.text_input("Label Header", value=label_generator.DEFAULT_HEADER)
+    if mode == "Batch CSV Intake":
+        show_batch_intake(label_stock, label_header)
+        return
+
     st.markdown("Enter a unique **Patient-Visit ID** string (e.g., `P001-V1`, `12345_1`). This identifies both the patient and the visit.")
     
     patientvisit_id = st.text_input("Patient-Visit ID")
@@ -340,7 +495,7 @@ def show_store_aliquots():
             st.success(f"Successfully allocated {len(allocations)} aliquots!")
             
             # --- LABEL DOWNLOADING ---
-            pdf_bytes = label_generator.generate_pdf_labels(allocations)
+            pdf_bytes = label_generator.generate_pdf_labels(allocations, label_stock, label_header)
             st.download_button(
                 label="🖨️ Download 4x1 PDF Printer Labels",
                 data=pdf_bytes,
@@ -369,8 +524,60 @@ def show_store_aliquots():
         except Exception as e:
             st.error(f"Allocation Error: {e}")
 
+def show_batch_intake(label_stock, label_header):
+    st.markdown("Upload a CSV with one row per visit: a `Patient-Visit ID` column plus `Plasma`, `Serum` and `Urine` count columns (max 10 per type). "
+                "Every visit is placed in one pass and committed together, with a single label PDF for the whole batch.")
+    uploaded_file = st.file_uploader("Upload Intake CSV", type=['csv'], key="batch_intake_file")
+    if uploaded_file is None:
+        return
+
+    try:
+        df_in = csv_import.read_batch_intake(uploaded_file)
+    except Exception as e:
+        st.error(f"Error reading file: {e}")
+        return
+
+    visits, err = csv_import.parse_batch_intake(df_in)
+    if err:
+        st.error(err)
+        return
+
+    total = sum(count for _, requests in visits for _, count in requests)
+    st.write(f"Preview: **{len(visits)}** visits, **{total}** aliquots.")
+    st.dataframe(df_in.head(20), use_container_width=True)
+
+    if st.button("Allocate Batch & Generate Labels"):
+        try:
+            user_email = st.session_state["user"]["email"]
+            allocations = database.allocate_batch(visits, user_email)
+            st.success(f"Successfully allocated {len(allocations)} aliquots across {len(visits)} visits!")
+
+            pdf_bytes = label_generator.generate_pdf_labels(allocations, label_stock, label_header)
+            st.download_button(
+                label="🖨️ Download Batch PDF Printer Labels",
+                data=pdf_bytes,
+                file_name="labels_batch.pdf",
+                mime="application/pdf",
+                type="primary"
+            )
+
+            alloc_df = pd.DataFrame(allocations)[['patientvisit_id', 'specimen_type', 'location_id']]
+            alloc_df.columns = ["Patient-Visit ID", "Specimen Type", "Location ID"]
+            alloc_df.index = range(1, len(alloc_df) + 1)
+            st.dataframe(alloc_df, use_container_width=True)
+        except Exception as e:
+            st.error(f"Allocation Error: {e}")
+
 def show_scan_aliquots():
     st.header("Scan/Toggle Aliquots")
+    mode = st.radio("Scan Mode", ["Single Scan", "Scan Session", "Box Audit"], horizontal=True)
+    if mode == "Scan Session":
+        show_scan_session()
+        return
+    if mode == "Box Audit":
+        show_box_audit()
+        return
+
     st.markdown("Use a QR Scanner, manually type the Aliquot Location ID below, or use the camera to scan a QR code.")
     st.markdown("Scanning an item that is `Stored` will mark it as `Checked Out`. Scanning it again will check it back into storage.")
     
@@ -383,15 +590,28 @@ def show_scan_aliquots():
     
     if image_to_process is not None:
         try:
-            # Convert the uploaded image to an OpenCV image
-            file_bytes = np.asarray(bytearray(image_to_process.read()), dtype=np.uint8)
-            opencv_image = cv2.imdecode(file_bytes, 1)
-            
-            # Decode the QR code
-            decoded_objects = decode(opencv_image)
-            if decoded_objects:
-                scanned_loc_id = decoded_objects[0].data.decode("utf-8")
+            codes = qr_decode.decode_image(image_to_process.getvalue())
+            if len(codes) == 1:
+                scanned_loc_id = codes[0]
                 st.success(f"Successfully scanned QR Code: **{scanned_loc_id}**")
+            elif codes:
+                # A photo of an open box: every tube in it can be checked out at once
+                codes = [c.upper() for c in codes]
+                st.success(f"Successfully scanned {len(codes)} QR Codes: {', '.join(codes)}")
+                # The widget keeps returning the same photo on every rerun; submit each one once
+                if st.session_state.get("scan_bulk_image") == image_to_process.file_id:
+                    st.info("The tubes in this photo were submitted. Take or upload a new photo to scan more.")
+                elif st.button(f"Submit / Checkout All {len(codes)}"):
+                    user_email = st.session_state["user"]["email"]
+                    # Save any journaled single scans first so they can't overwrite this checkout
+                    journal.get_journal().flush()
+                    applied, not_found, unchanged = database.bulk_toggle_aliquot_status(codes, user_email, "", "Checked Out")
+                    st.session_state["scan_bulk_image"] = image_to_process.file_id
+                    st.success(f"{len(applied)} tube(s) marked **Checked Out**.")
+                    if unchanged:
+                        st.info(f"{len(unchanged)} tube(s) were already Checked Out, or consumed, and were left as they were.")
+                    if not_found:
+                        st.warning(f"Skipped {len(not_found)} unknown ID(s): {', '.join(not_found[:20])}")
             else:
                 st.warning("No QR code detected in the image. Please try again or ensure the QR code is clearly visible.")
         except Exception as e:
@@ -406,7 +626,8 @@ def show_scan_aliquots():
         if submitted:
             if loc_id:
                 user_email = st.session_state["user"]["email"]
-                success, msg, new_status = database.toggle_aliquot_status(loc_id.strip().upper(), user_email, sent_to.strip())
+                # Journaled: acknowledged right away, written to the sheets in the next batch
+                success, msg, new_status = journal.queue_toggle(loc_id.strip().upper(), user_email, sent_to.strip())
                 if success:
                     st.success(msg)
                 else:
@@ -414,5 +635,139 @@ def show_scan_aliquots():
             else:
                 st.error("Please enter or scan an ID.")
 
+    scan_journal = journal.get_journal()
+    pending = scan_journal.pending_count()
+    if pending:
+        st.caption(f"{pending} scan(s) waiting to be saved to the inventory sheets.")
+    dead = len(scan_journal.dead_letters())
+    if dead:
+        st.warning(f"{dead} scan(s) could not be saved to the inventory. An admin can review them under "
+                   "Admin Panel → Scan Journal.")
+
+def parse_location_list(text):
+    # One ID per line, or separated by commas/semicolons/spaces
+    return [t.strip().upper() for t in re.split(r"[\s,;]+", text) if t.strip()]
+
+def add_to_scan_session(location_ids):
+    session = st.session_state.setdefault("scan_session", [])
+    new_ids = [loc for loc in dict.fromkeys(location_ids) if loc not in session]
+    session.extend(new_ids)
+    return len(new_ids)
+
+def show_scan_session():
+    st.markdown("Collect many tubes first, e.g. a whole box for shipment, then check them all out (or back in) "
+                "with one shared destination and a single save.")
+
+    camera_image = st.camera_input("📷 Scan QR Codes with Live Camera", key="session_camera")
+    uploaded_image = st.file_uploader("📁 Or upload a photo of one or more QR Codes", type=['png', 'jpg', 'jpeg'], key="session_upload")
+    image_to_process = camera_image if camera_image else uploaded_image
+    # The widget keeps returning the same photo on every rerun; only read each one once
+    if image_to_process is not None and st.session_state.get("session_last_image") != image_to_process.file_id:
+        st.session_state["session_last_image"] = image_to_process.file_id
+        try:
+            # Every code in the photo is added, not just the first
+            codes = [c.upper() for c in qr_decode.decode_image(image_to_process.getvalue())]
+            if codes:
+                added = add_to_scan_session(codes)
+                st.success(f"Read {len(codes)} QR code(s), {added} new.")
+            else:
+                st.warning("No QR code detected in the image. Please try again or ensure the QR code is clearly visible.")
+        except Exception as e:
+            st.error(f"Error processing image for QR code: {e}")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        with st.form("session_paste_form", clear_on_submit=True):
+            pasted = st.text_area("Paste or type Location IDs (one per line)")
+            if st.form_submit_button("Add to Session") and pasted.strip():
+                added = add_to_scan_session(parse_location_list(pasted))
+                st.success(f"Added {added} ID(s).")
+    with col2:
+        with st.form("session_box_form", clear_on_submit=True):
+            box_ref = st.text_input("Box ID or position (e.g. 17 or D1R2L3B4)")
+            box_status = st.selectbox("Tubes to add", ["Stored", "Checked Out"])
+            if st.form_submit_button("Add Entire Box") and box_ref.strip():
+                box_ids = database.get_box_location_ids(box_ref, box_status)
+                if box_ids is None:
+                    st.error(f"Box '{box_ref}' not found.")
+                else:
+                    added = add_to_scan_session(box_ids)
+                    st.success(f"Added {added} tube(s) from box {box_ref.strip().upper()}.")
+
+    session = st.session_state.get("scan_session", [])
+    if not session:
+        st.info("No tubes in this session yet.")
+        return
+
+    # Validate everything against the inventory index before anything is written
+    df_session = database.get_aliquot_statuses(session)
+    df_session.index = range(1, len(df_session) + 1)
+    missing = int((df_session["Status"] == "Not found").sum())
+    st.write(f"**{len(session)}** tube(s) in session" + (f", **{missing}** not found" if missing else "") + ".")
+    st.dataframe(df_session, use_container_width=True)
+
+    action = st.radio("Action", ["Check Out", "Check In", "Mark Consumed"], horizontal=True)
+    sent_to = st.text_input("Destination (applies to every tube checked out)") if action == "Check Out" else ""
+    if action == "Mark Consumed":
+        st.caption("For tubes that won't come back (used up or discarded): their slots are released for new "
+                   "tubes, and they can no longer be checked back in.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button(f"{action} All", type="primary"):
+            try:
+                user_email = st.session_state["user"]["email"]
+                # Save any journaled single scans first so they can't overwrite this session
+                journal.get_journal().flush()
+                new_status = {"Check Out": "Checked Out", "Check In": "Stored", "Mark Consumed": "Consumed"}[action]
+                applied, not_found, unchanged = database.bulk_toggle_aliquot_status(session, user_email, sent_to.strip(), new_status)
+                st.success(f"{len(applied)} tube(s) marked **{new_status}**.")
+                if unchanged:
+                    st.info(f"{len(unchanged)} tube(s) were already {new_status}, or consumed, and were left as they were.")
+                if not_found:
+                    st.warning(f"Skipped {len(not_found)} unknown ID(s): {', '.join(not_found[:20])}")
+                st.session_state["scan_session"] = []
+            except Exception as e:
+                st.error(f"Error saving scan session: {e}")
+    with col2:
+        if st.button("Clear Session"):
+            st.session_state["scan_session"] = []
+            st.rerun()
+
+def show_box_audit():
+    st.markdown("Check a whole box against the inventory from one photo: take it from straight above with the "
+                "box lid off, so every tube's label is visible.")
+    box_ref = st.text_input("Box ID or position (e.g. 17 or D1R2L3B4)", key="audit_box")
+    camera_image = st.camera_input("📷 Photograph the Box", key="audit_camera")
+    uploaded_image = st.file_uploader("📁 Or upload a photo of the box", type=['png', 'jpg', 'jpeg'], key="audit_upload")
+    image_to_process = camera_image if camera_image else uploaded_image
+    if not box_ref.strip() or image_to_process is None:
+        return
+
+    position = database.get_box_position(box_ref)
+    if position is None:
+        st.error(f"Box '{box_ref}' not found.")
+        return
+    try:
+        codes = box_audit.read_photo(image_to_process.getvalue(), position)
+    except Exception as e:
+        st.error(f"Error processing image for QR code: {e}")
+        return
+    records = database.get_current_aliquots(box_audit.box_location_ids(position) + [text for text, _, _ in codes])
+    report, fitted = box_audit.audit(position, codes, records)
+    counts = report["Result"].value_counts()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("In Place", int(counts.get(box_audit.OK, 0)))
+    col2.metric("Misplaced", int(counts.get(box_audit.MISPLACED, 0)))
+    col3.metric("Unexpected", int(counts.get(box_audit.UNEXPECTED, 0)))
+    col4.metric("Missing", int(counts.get(box_audit.MISSING, 0)))
+    if not fitted:
+        st.warning(f"Too few of box {position}'s own labels were read to work out the grid, so tube positions "
+                   "weren't checked. Retake the photo from straight above with every label visible.")
+    elif len(report) and (report["Result"] == box_audit.OK).all():
+        st.success(f"Box {position} matches the inventory.")
+    report.index = range(1, len(report) + 1)
+    st.dataframe(report, use_container_width=True)
+
 if __name__ == "__main__":
     main()
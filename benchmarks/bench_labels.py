@@ -0,0 +1,65 @@
+"""
+Label PDF benchmark: render time and file size for growing batches on every label stock.
+
+QR codes are encoded once up front (that cost is reported separately), so the table shows
+the layout and PDF writing itself. Time and size per label should stay flat as batches grow.
+
+    python benchmarks/bench_labels.py --counts 100 1000 5000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.WARNING)
+warnings.filterwarnings("ignore")
+
+import label_generator
+import qr_service
+
+TYPES = ["Plasma", "Serum", "Urine"]
+
+def make_allocations(n):
+    allocations = []
+    for i in range(n):
+        box, spot = divmod(i, 81)
+        door, rest = divmod(box, 100)
+        rack, rest = divmod(rest, 25)
+        level, b = divmod(rest, 5)
+        x, y = divmod(spot, 9)
+        allocations.append({
+            "location_id": f"D{door % 5 + 1}R{rack + 1}L{level + 1}B{b + 1}X{x + 1}Y{y + 1}",
+            "patientvisit_id": f"P{i // 9:05d}-V1",
+            "specimen_type": TYPES[(i // 3) % 3],
+        })
+    return allocations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--templates", nargs="+", default=list(label_generator.TEMPLATES),
+                        help="label stocks to run (default: all)")
+    args = parser.parse_args()
+
+    allocations = make_allocations(max(args.counts))
+    start = time.perf_counter()
+    qr_service.render_matrices(a["location_id"] for a in allocations)
+    print(f"QR encoding: {len(allocations)} codes in {time.perf_counter() - start:.2f}s\n")
+
+    print(f"{'template':<36} {'labels':>7} {'pages':>6} {'seconds':>8} {'ms/label':>9} {'KB':>8} {'KB/label':>9}")
+    for name in args.templates:
+        tpl = label_generator.TEMPLATES[name]
+        for n in args.counts:
+            batch = allocations[:n]
+            start = time.perf_counter()
+            pdf = label_generator.generate_pdf_labels(batch, template=name)
+            elapsed = time.perf_counter() - start
+            pages = -(-n // tpl.per_page)
+            print(f"{name:<36} {n:>7} {pages:>6} {elapsed:>8.2f} {elapsed / n * 1000:>9.2f} "
+                  f"{len(pdf) / 1024:>8.0f} {len(pdf) / 1024 / n:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Synthetic freezer datasets for the benchmarks, shaped like the real sheets.
+
+A dataset has the standard 500 boxes (5 doors x 4 racks x 5 levels x 5 boxes of 81 spots)
+and any number of aliquot rows. Only the newest row at a location can be Stored, so past a
+freezer's worth of tubes the rest are checked-out history at reused locations, the way the
+aliquots sheet grows in practice.
+
+Layouts:
+  full        95% of spots Stored, packed box by box, so the free spots are in the last boxes
+  fragmented  60% of spots Stored, scattered over every box, so the free spots are holes
+"""
+import numpy as np
+import pandas as pd
+import storage
+
+DOORS, RACKS, LEVELS, BOXES, GRID = 5, 4, 5, 5, 9
+TYPES = ["Plasma", "Serum", "Urine", "Buffy Coat"]
+USERS = 20
+LAYOUTS = {"full": 0.95, "fragmented": 0.60}
+START = np.datetime64("2023-01-01T00:00:00")
+SPAN_SECONDS = 3 * 365 * 24 * 3600
+
+def make_users():
+    emails = ["admin@example.com"] + [f"tech{i:02d}@example.com" for i in range(1, USERS)]
+    return pd.DataFrame({
+        "email": emails,
+        "password": ["master123"] + [""] * (USERS - 1),
+        "role": ["master"] + ["user"] * (USERS - 1),
+        "status": "approved",
+        "checkin_count": 0,
+        "checkout_count": 0,
+    })
+
+def make_boxes(rng):
+    d, r, l, b = np.meshgrid(np.arange(1, DOORS + 1), np.arange(1, RACKS + 1), np.arange(1, LEVELS + 1),
+                             np.arange(1, BOXES + 1), indexing="ij")
+    n = d.size
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "door_num": d.ravel(),
+        "rack_num": r.ravel(),
+        "level_num": l.ravel(),
+        "box_num": b.ravel(),
+        "specimen_type": rng.choice(TYPES, n),
+        "spots_used": 0,
+    })
+
+def _timestamps(seconds):
+    # Same "YYYY-MM-DD HH:MM:SS" text the app writes
+    text = np.datetime_as_string(START + seconds.astype("timedelta64[s]"), unit="s")
+    return np.char.replace(text, "T", " ").astype(object)
+
+def make_aliquots(rng, boxes, n, layout):
+    spots = len(boxes) * GRID * GRID
+    n_stored = min(n, int(spots * LAYOUTS[layout]))
+    if layout == "full":
+        stored_slots = np.arange(n_stored)
+    else:
+        stored_slots = np.sort(rng.choice(spots, n_stored, replace=False))
+    # History first (lower ids), so the Stored row is always the newest at its location
+    history_slots = rng.integers(0, spots, n - n_stored)
+    slots = np.concatenate([history_slots, stored_slots])
+    box_pos, cell = np.divmod(slots, GRID * GRID)
+    x, y = np.divmod(cell, GRID)
+    x, y = x + 1, y + 1
+    box = boxes.iloc[box_pos]
+    location_id = ("D" + box["door_num"].astype(str).values + "R" + box["rack_num"].astype(str).values
+                   + "L" + box["level_num"].astype(str).values + "B" + box["box_num"].astype(str).values
+                   + "X" + x.astype(str) + "Y" + y.astype(str))
+    users = make_users()["email"].values
+
+    seconds = rng.integers(0, SPAN_SECONDS, n)
+    status = np.where(np.arange(n) < n - n_stored, "Checked Out", "Stored").astype(object)
+    out = status == "Checked Out"
+    checkout_seconds = np.minimum(seconds + rng.integers(3600, 180 * 24 * 3600, n), SPAN_SECONDS)
+    visit = rng.integers(1, max(n // 6, 1) + 1, n)
+
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "location_id": location_id,
+        "box_id": box["id"].values,
+        "x_coord": x,
+        "y_coord": y,
+        "patientvisit_id": np.char.add(np.char.add("P", np.char.zfill(visit.astype(str), 6)), "-V1").astype(object),
+        "specimen_type": box["specimen_type"].values,
+        "stored_time": _timestamps(seconds),
+        "checkin_user_id": rng.choice(users, n),
+        "days_since_stored": "",
+        "status": status,
+        "sent_to": np.where(out, "Core Lab", "").astype(object),
+        "checkout_time": np.where(out, _timestamps(checkout_seconds), "").astype(object),
+        "checkout_user_id": np.where(out, rng.choice(users, n), "").astype(object),
+    }, columns=storage.SHEET_COLUMNS["aliquots"])
+
+def make_dataset(n_aliquots, layout="fragmented", seed=0):
+    """Every sheet of a synthetic freezer with n_aliquots aliquot rows, as {sheet name: frame}."""
+    rng = np.random.default_rng(seed)
+    boxes = make_boxes(rng)
+    aliquots = make_aliquots(rng, boxes, n_aliquots, layout)
+    stored = aliquots[aliquots["status"] == "Stored"]
+    boxes["spots_used"] = stored.groupby("box_id").size().reindex(boxes["id"], fill_value=0).values
+    # Empty boxes take whatever type is stored next
+    boxes.loc[boxes["spots_used"] == 0, "specimen_type"] = ""
+    return {
+        "users": make_users(),
+        "boxes": boxes,
+        "aliquots": aliquots,
+        "stats": pd.DataFrame(columns=storage.SHEET_COLUMNS["stats"]),
+        "events": pd.DataFrame(columns=storage.SHEET_COLUMNS["events"]),
+    }
+
+def load(backend, frames):
+    """Writes a dataset into a storage backend (e.g. storage.MemoryBackend or storage.SQLiteBackend)."""
+    for sheet_name, df in frames.items():
+        backend.write(sheet_name, df)
@@ -0,0 +1,190 @@
+"""
+Benchmarks for the hot paths, on synthetic freezers of growing size (see datasets.py).
+
+Each dataset is loaded into a local backend (in memory, or a SQLite file) and every operation
+is timed on it in turn, the way the app calls them, after an untimed warm-up run:
+
+  load_inventory         first read of every sheet and the indexed model built from them
+  get_all_aliquots_df    the dashboard's full inventory table
+  get_recent_aliquots    the dashboard's recent activity for one user
+  allocate               allocate_multiple_aliquots for one patient-visit (6 tubes)
+  toggle                 toggle_aliquot_status on a random Stored tube
+  upload                 upload_aliquots_data with 1,000 rows (half updates, half new locations)
+  labels                 generate_pdf_labels for 100 tubes
+
+Results go to a JSON file, one record per dataset and operation. Pass an earlier file with
+--compare to see each timing against it.
+
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 --layouts full fragmented
+    python benchmarks/run_benchmarks.py --sizes 1000000 --backend sqlite --compare results/base.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+logging.disable(logging.WARNING)
+warnings.filterwarnings("ignore")
+
+import numpy as np
+import pandas as pd
+import storage
+import database
+import label_generator
+import datasets
+
+UPLOAD_ROWS = 1000
+LABELS = 100
+
+def use_backend(kind, frames, workdir):
+    if kind == "sqlite":
+        path = os.path.join(workdir, f"bench-{time.time_ns()}.db")
+        backend = storage.SQLiteBackend(path)
+    else:
+        backend = storage.MemoryBackend()
+    datasets.load(backend, frames)
+    storage.set_backend(backend)
+    database._snapshots.invalidate()
+    return backend
+
+def stored_locations(rng, k):
+    df = database.get_inventory().aliquots
+    stored = df.loc[df["status"] == "Stored", "location_id"].tolist()
+    return rng.sample(stored, min(k, len(stored)))
+
+def upload_frame(rng, n):
+    # Half overwrite existing locations, half are locations that have never been used
+    df = database.get_inventory().aliquots
+    existing = rng.sample(df["location_id"].tolist(), n // 2)
+    used = set(df["location_id"])
+    fresh = [loc for loc in database.get_all_location_ids() if loc not in used][:n - len(existing)]
+    locations = existing + fresh
+    return pd.DataFrame({
+        "Location ID": locations,
+        "Patient-Visit ID": [f"U{i:06d}-V1" for i in range(len(locations))],
+        "Specimen Type": [rng.choice(datasets.TYPES) for _ in locations],
+        "Status": "Stored",
+    })
+
+def operations(rng):
+    """(name, setup, run) per operation; setup's result is passed to run and isn't timed."""
+    admin = database.ADMIN_USER
+    visits = iter(range(10 ** 9))
+    return [
+        ("load_inventory", lambda: database._snapshots.invalidate(), lambda _: database.get_inventory()),
+        ("get_all_aliquots_df", lambda: None, lambda _: database.get_all_aliquots_df()),
+        ("get_recent_aliquots", lambda: None, lambda _: database.get_recent_aliquots(admin, 20)),
+        ("allocate", lambda: f"B{next(visits):06d}-V1",
+         lambda pv: database.allocate_multiple_aliquots(pv, [("Plasma", 3), ("Serum", 3)], admin)),
+        ("toggle", lambda: stored_locations(rng, 1)[0],
+         lambda loc: database.toggle_aliquot_status(loc, admin, "Core Lab")),
+        ("upload", lambda: upload_frame(rng, UPLOAD_ROWS), lambda df: database.upload_aliquots_data(df, admin)),
+        ("labels", lambda: [{"location_id": loc, "patientvisit_id": "P000001-V1", "specimen_type": "Plasma"}
+                            for loc in stored_locations(rng, LABELS)],
+         lambda allocations: label_generator.generate_pdf_labels(allocations)),
+    ]
+
+def time_operation(setup, run, repeat, warmup):
+    # The first `warmup` runs fill whatever the operation caches and aren't counted
+    seconds = []
+    for i in range(warmup + repeat):
+        arg = setup()
+        start = time.perf_counter()
+        try:
+            run(arg)
+        except Exception as e:
+            return seconds, f"{type(e).__name__}: {e}"
+        if i >= warmup:
+            seconds.append(time.perf_counter() - start)
+    return seconds, None
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                                text=True, timeout=10).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def load_baseline(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    return {(r["size"], r["layout"], r["backend"], r["operation"]): r["median"] for r in data["results"]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="aliquot rows per dataset")
+    parser.add_argument("--layouts", nargs="+", default=list(datasets.LAYOUTS), choices=list(datasets.LAYOUTS))
+    parser.add_argument("--backend", default="memory", choices=["memory", "sqlite"])
+    parser.add_argument("--operations", nargs="+", help="subset to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per operation")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before them")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.compare)
+    results = []
+    print(f"{'dataset':<20} {'operation':<20} {'median s':>9} {'min s':>8} {'max s':>8} {'vs base':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            for layout in args.layouts:
+                start = time.perf_counter()
+                use_backend(args.backend, datasets.make_dataset(size, layout, args.seed), workdir)
+                database.write_sheet_data("stats", database.get_inventory().stats.to_frame())
+                prepared = time.perf_counter() - start
+
+                rng = random.Random(args.seed)
+                name = f"{size}/{layout}"
+                for op, setup, run in operations(rng):
+                    if args.operations and op not in args.operations:
+                        continue
+                    seconds, error = time_operation(setup, run, args.repeat, args.warmup)
+                    record = {
+                        "size": size, "layout": layout, "backend": args.backend, "operation": op,
+                        "runs": len(seconds), "seconds": seconds, "error": error,
+                        "median": statistics.median(seconds) if seconds else None,
+                        "min": min(seconds) if seconds else None,
+                        "max": max(seconds) if seconds else None,
+                        "setup_seconds": prepared,
+                    }
+                    results.append(record)
+                    if error:
+                        print(f"{name:<20} {op:<20} failed: {error}")
+                        continue
+                    base = baseline.get((size, layout, args.backend, op))
+                    ratio = f"{record['median'] / base:>7.2f}x" if base else ""
+                    print(f"{name:<20} {op:<20} {record['median']:>9.4f} {record['min']:>8.4f} "
+                          f"{record['max']:>8.4f} {ratio:>8}")
+
+    output = args.output or os.path.join(HERE, "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"environment": environment(), "repeat": args.repeat, "warmup": args.warmup, "results": results}, f, indent=1)
+    print(f"\nResults written to {output}")
+    sys.exit(1 if any(r["error"] for r in results) else 0)
+
+if __name__ == "__main__":
+    main()
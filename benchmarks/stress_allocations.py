@@ -0,0 +1,121 @@
+"""
+Multi-threaded stress test for concurrent allocations.
+
+Runs many allocator threads against an in-memory backend while a "foreign writer"
+thread keeps committing to the users sheet, the way a second server would. Every
+allocation has to survive revision conflicts and retries, and the final freezer
+state must have no duplicate locations and consistent box counters.
+
+    python benchmarks/stress_allocations.py --threads 8 --visits 25
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.WARNING)
+warnings.filterwarnings("ignore")
+
+import pandas as pd
+import storage
+import database
+
+TYPES = ["Plasma", "Serum", "Urine", "Buffy Coat"]
+
+class CountingBackend(storage.MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.conflicts = 0
+
+    def commit(self, changes):
+        try:
+            return super().commit(changes)
+        except storage.ConflictError:
+            self.conflicts += 1
+            raise
+
+def allocator(worker, visits, results, errors):
+    rng = random.Random(worker)
+    for v in range(visits):
+        pv = f"W{worker:02d}P{v:03d}-V{rng.randint(1, 3)}"
+        requests = [(t, rng.randint(1, 4)) for t in rng.sample(TYPES, rng.randint(1, 3))]
+        try:
+            results.extend(database.allocate_multiple_aliquots(pv, requests, database.ADMIN_USER))
+        except Exception as e:
+            errors.append(f"{pv}: {e}")
+
+def foreign_writer(backend, stop, interval):
+    # Re-commits the users sheet unchanged; only its revision moves
+    while not stop.is_set():
+        df = backend.read("users")
+        try:
+            backend.commit([("users", df, None, df.attrs["revision"])])
+        except storage.ConflictError:
+            pass
+        stop.wait(interval)
+
+def check(backend, allocated):
+    problems = []
+    df_a = backend.read("aliquots")
+    df_b = backend.read("boxes")
+    df_u = backend.read("users")
+    stored = df_a[df_a["status"] == "Stored"]
+    dupes = stored["location_id"][stored["location_id"].duplicated()]
+    if not dupes.empty:
+        problems.append(f"{len(dupes)} duplicate Stored locations, e.g. {dupes.iloc[0]}")
+    if len(df_a) != len(allocated):
+        problems.append(f"{len(df_a)} aliquot rows but {len(allocated)} tubes allocated")
+    counts = stored.groupby(pd.to_numeric(stored["box_id"])).size()
+    used = pd.to_numeric(df_b["spots_used"]).set_axis(pd.to_numeric(df_b["id"]))
+    mismatched = (used - counts.reindex(used.index, fill_value=0)) != 0
+    if mismatched.any():
+        problems.append(f"{int(mismatched.sum())} boxes with spots_used out of step")
+    checkins = int(pd.to_numeric(df_u.loc[df_u["email"] == database.ADMIN_USER, "checkin_count"]).iloc[0])
+    if checkins != len(allocated):
+        problems.append(f"checkin_count is {checkins}, expected {len(allocated)}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--visits", type=int, default=25, help="visits per thread")
+    parser.add_argument("--foreign-interval", type=float, default=0.5, help="seconds between foreign writes")
+    args = parser.parse_args()
+
+    backend = CountingBackend()
+    storage.set_backend(backend)
+    database.init_db()
+
+    results, errors = [], []
+    stop = threading.Event()
+    foreign = threading.Thread(target=foreign_writer, args=(backend, stop, args.foreign_interval))
+    workers = [threading.Thread(target=allocator, args=(w, args.visits, results, errors)) for w in range(args.threads)]
+
+    start = time.perf_counter()
+    foreign.start()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    stop.set()
+    foreign.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.threads * args.visits} visits, {len(results)} tubes in {elapsed:.1f}s, "
+          f"{backend.conflicts} conflicts retried, {len(errors)} failed")
+    for e in errors[:5]:
+        print("  failed:", e)
+    problems = check(backend, results)
+    for p in problems:
+        print("FAIL:", p)
+    if not problems:
+        print("OK: no duplicate locations, box and user counters consistent")
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import re
+import numpy as np
+import pandas as pd
+import qr_decode
+from occupancy import GRID_SIZE
+
+# Audit results, per tube
+OK = "OK"
+MISSING = "Missing"
+UNEXPECTED = "Unexpected"
+MISPLACED = "Misplaced"
+
+REPORT_COLUMNS = ["Location ID", "Result", "Found At", "Status", "Patient-Visit ID", "Specimen Type"]
+
+# Random triples of labels tried when fitting the grid; plenty for a box of 81
+FIT_TRIALS = 200
+# How far (in grid spacings) a code may sit from where the fit puts its slot and still count as there
+SLOT_TOLERANCE = 0.35
+# A box filling the photo puts about one label in each tile of the first pass (see qr_decode.locate_codes_tiled)
+PHOTO_TILES = 12
+# Slots nothing was read in are cut out this many grid spacings across, centred on the slot
+CROP_SIZE = 1.2
+
+_LOCATION = re.compile(r"(D\d+R\d+L\d+B\d+)X(\d+)Y(\d+)")
+
+def parse_location(location_id):
+    """('D1R2L3B4', x, y) for a location ID such as D1R2L3B4X5Y6, or None."""
+    m = _LOCATION.fullmatch(str(location_id).strip().upper())
+    return (m.group(1), int(m.group(2)), int(m.group(3))) if m else None
+
+def _in_box(location_id, box_position):
+    parsed = parse_location(location_id)
+    return parsed is not None and parsed[0] == box_position
+
+def box_location_ids(box_position):
+    return [f"{box_position}X{x}Y{y}" for x in range(1, GRID_SIZE + 1) for y in range(1, GRID_SIZE + 1)]
+
+def _apply(transform, points):
+    return points @ transform[:2] + transform[2]
+
+def _pitch(transform):
+    # Pixels per grid spacing
+    return np.sqrt(abs(np.linalg.det(transform[:2])))
+
+def fit_grid(slots, centres):
+    """
+    Affine map from X/Y slots to photo pixels, fitted to labels found in the photo:
+    slots[i] is where label i says its tube belongs, centres[i] where it was seen.
+    Robust to misplaced tubes (RANSAC over triples of labels, then least squares on the
+    ones that agree). Returns (3 x 2 transform, inlier mask), or (None, None) with fewer
+    than three labels that aren't all in one line.
+    """
+    slots = np.asarray(slots, dtype=float)
+    centres = np.asarray(centres, dtype=float)
+    n = len(slots)
+    if n < 3:
+        return None, None
+    src = np.column_stack([slots, np.ones(n)])
+
+    # Every hypothesis at once: solve the 3-point affine for each triple, then score it on all labels
+    rng = np.random.default_rng(0)
+    triples = rng.random((FIT_TRIALS, n)).argsort(axis=1)[:, :3]
+    a, b = src[triples], centres[triples]
+    solvable = np.abs(np.linalg.det(a)) > 1e-9
+    if not solvable.any():
+        return None, None
+    transforms = np.linalg.solve(a[solvable], b[solvable])
+    pitch = np.sqrt(np.abs(np.linalg.det(transforms[:, :2])))
+    errors = np.linalg.norm(src @ transforms - centres, axis=2)
+    inliers = errors < SLOT_TOLERANCE * pitch[:, None]
+    best = inliers.sum(axis=1).argmax()
+    if inliers[best].sum() < 3:
+        return None, None
+
+    mask = inliers[best]
+    for _ in range(3):
+        transform = np.linalg.lstsq(src[mask], centres[mask], rcond=None)[0]
+        refit = np.linalg.norm(_apply(transform, slots) - centres, axis=1) < SLOT_TOLERANCE * _pitch(transform)
+        if (refit == mask).all() or refit.sum() < 3:
+            break
+        mask = refit
+    if _pitch(transform) < 1e-6:
+        return None, None
+    return transform, mask
+
+def slots_at(transform, centres):
+    """The X/Y slot nearest each centre under a fitted transform; (0, 0) outside the box."""
+    linear = transform[:2]
+    grid = (np.asarray(centres, dtype=float) - transform[2]) @ np.linalg.inv(linear)
+    slots = np.rint(grid).astype(int)
+    outside = ((slots < 1) | (slots > GRID_SIZE)).any(axis=1)
+    slots[outside] = 0
+    return slots
+
+def _box_fit(box_position, codes):
+    # Labels from this box say where they belong, which is what anchors the grid
+    anchors = [(parse_location(text)[1:], (x, y)) for text, x, y in codes if _in_box(text, box_position)]
+    if not anchors:
+        return None
+    slots, centres = zip(*anchors)
+    return fit_grid(slots, centres)[0]
+
+def read_photo(image_bytes, box_position):
+    """
+    Every QR code in a top-down photo of a box, as (text, x, y) like qr_decode.locate_codes.
+    The photo is read in tiles first. Once the grid is fitted to the labels found there, every
+    slot nothing was read in is cut out and read on its own at full resolution.
+    """
+    codes = qr_decode.locate_codes_tiled(image_bytes, PHOTO_TILES)
+    transform = _box_fit(box_position, codes)
+    if transform is None:
+        # Labels too big for the tiles (a close-up), or too few of them: read the photo as a whole
+        codes = qr_decode.locate_codes(image_bytes)
+        transform = _box_fit(box_position, codes)
+    if transform is None:
+        return codes
+    seen = {tuple(slot) for slot in slots_at(transform, [(x, y) for _, x, y in codes])}
+    unread = np.array([(x, y) for x in range(1, GRID_SIZE + 1) for y in range(1, GRID_SIZE + 1)
+                       if (x, y) not in seen], dtype=float).reshape(-1, 2)
+    if not len(unread):
+        return codes
+    centres = _apply(transform, unread)
+    half = CROP_SIZE / 2 * _pitch(transform)
+    known = {text for text, _, _ in codes}
+    extra = qr_decode.locate_codes_in(image_bytes, np.column_stack([centres - half, centres + half]))
+    return codes + [code for code in extra if code[0] not in known]
+
+def _slot_name(x, y):
+    return f"X{x}Y{y}" if x else "Outside box"
+
+def audit(box_position, codes, records):
+    """
+    Compares a photo of a box with its records.
+    box_position: e.g. 'D1R2L3B4'
+    codes: (text, x, y) per QR code in the photo, as read_photo() returns them
+    records: the current aliquot row (location_id, status, patientvisit_id, specimen_type) for
+      every slot of the box and every location found in the photo
+    Tubes Stored in the box should all be in the photo, each in the slot its label names.
+    Returns (report frame with REPORT_COLUMNS, whether the grid could be fitted).
+    """
+    found = {}
+    for text, x, y in codes:
+        loc = str(text).strip().upper()
+        if parse_location(loc):
+            found.setdefault(loc, (x, y))
+    locs = list(found)
+    centres = np.array([found[loc] for loc in locs], dtype=float).reshape(-1, 2)
+
+    transform = _box_fit(box_position, [(loc, x, y) for loc, (x, y) in found.items()])
+    seen_at = {}
+    if transform is not None:
+        seen_at = {loc: (int(x), int(y)) for loc, (x, y) in zip(locs, slots_at(transform, centres))}
+
+    details = records.drop_duplicates("location_id", keep="last").set_index("location_id")
+    status = details["status"].to_dict() if not details.empty else {}
+    expected = {loc for loc, st in status.items() if st == "Stored" and _in_box(loc, box_position)}
+
+    rows = []
+    for loc in locs:
+        slot = seen_at.get(loc)
+        if loc not in expected:
+            result = UNEXPECTED
+        elif slot is not None and slot != parse_location(loc)[1:]:
+            result = MISPLACED
+        else:
+            result = OK
+        rows.append((loc, result, _slot_name(*slot) if slot else ""))
+    rows.extend((loc, MISSING, "") for loc in sorted(expected - set(found)))
+
+    report = pd.DataFrame(rows, columns=["Location ID", "Result", "Found At"])
+    ids = report["Location ID"]
+    report["Status"] = ids.map(status).fillna("Not found")
+    for col, source in [("Patient-Visit ID", "patientvisit_id"), ("Specimen Type", "specimen_type")]:
+        report[col] = ids.map(details[source].to_dict() if source in details.columns else {}).fillna("")
+    # Problems first, then by location
+    order = report["Result"].map({MISPLACED: 0, UNEXPECTED: 1, MISSING: 2, OK: 3})
+    report = report.assign(_order=order).sort_values(["_order", "Location ID"], kind="stable")
+    return report[REPORT_COLUMNS].reset_index(drop=True), transform is not None
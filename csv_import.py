@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import pandas as pd
+import database
+import storage
+
+CHUNK_ROWS = 50000
+REQUIRED_COLUMNS = ["Location ID", "Patient-Visit ID", "Specimen Type", "Status"]
+
+def file_fingerprint(f, block_size=1 << 20):
+    # Content hash, streamed, so a re-uploaded copy of the same file resumes where it left off
+    digest = hashlib.sha1()
+    f.seek(0)
+    for block in iter(lambda: f.read(block_size), b""):
+        digest.update(block)
+    f.seek(0)
+    return digest.hexdigest()
+
+def _file_size(f):
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    return size
+
+def _save_checkpoint(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        json.dump(state, out)
+    os.replace(tmp_path, path)
+
+def import_aliquots_csv(f, chunk_rows=CHUNK_ROWS, progress=None, checkpoint_dir=None, user_email=""):
+    """
+    Streams an inventory CSV (a binary file object) into database.upsert_aliquots chunk_rows at a time,
+    committing each chunk on its own so only one chunk of the upload is in memory at once.
+    After every committed chunk a checkpoint is saved; running the import again with the same
+    file skips the records already committed (counted as parsed records, not lines, since a
+    quoted field may span lines). Re-running a chunk is harmless, since rows are upserted by
+    Location ID.
+    progress(fraction, rows_done) is called after each chunk. Changes are logged under user_email.
+    Returns (success, message, rejects) like database.upload_aliquots_data, with rejected row
+    numbers counted from the start of the file.
+    """
+    checkpoint_dir = checkpoint_dir or storage.get_secret("IMPORT_CHECKPOINT_DIR", "import_checkpoints")
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    fingerprint = file_fingerprint(f)
+    checkpoint_path = os.path.join(checkpoint_dir, f"{fingerprint}.json")
+    rejects_path = os.path.join(checkpoint_dir, f"{fingerprint}.rejects.csv")
+
+    state = {"rows_done": 0, "chunks_done": 0, "inserted": 0, "updated": 0, "rejected": 0}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, encoding="utf-8") as cp:
+            state = json.load(cp)
+    elif os.path.exists(rejects_path):
+        os.remove(rejects_path)
+    resumed_from = state["rows_done"]
+
+    total_bytes = _file_size(f) or 1
+    try:
+        # Everything as text, blanks as "", like the old read_csv(...).fillna('')
+        reader = pd.read_csv(f, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+        to_skip = state["rows_done"]
+        for chunk in reader:
+            missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+            if missing:
+                return False, f"Missing required column: {missing[0]}", None
+            if to_skip:
+                # Parsed again but already committed
+                skipped = min(to_skip, len(chunk))
+                to_skip -= skipped
+                chunk = chunk.iloc[skipped:]
+                if chunk.empty:
+                    continue
+
+            inserts, updates, rejects = database.upsert_aliquots(chunk, user_email)
+            if not rejects.empty:
+                rejects = rejects.assign(Row=rejects["Row"] + state["rows_done"])
+                rejects.to_csv(rejects_path, mode="a", header=not os.path.exists(rejects_path), index=False)
+
+            state["rows_done"] += len(chunk)
+            state["chunks_done"] += 1
+            state["rejected"] += len(rejects)
+            state["inserted"] += inserts
+            state["updated"] += updates
+            _save_checkpoint(checkpoint_path, state)
+            if progress is not None:
+                progress(min(f.tell() / total_bytes, 1.0), state["rows_done"])
+    except Exception as e:
+        return False, (f"Import stopped after row {state['rows_done']}: {e}. "
+                       "Upload the same file again to resume from there."), None
+
+    rejects = pd.DataFrame(columns=["Row", "Location ID", "Reason"])
+    if os.path.exists(rejects_path):
+        rejects = pd.read_csv(rejects_path, dtype={"Location ID": str}, keep_default_na=False)
+        os.remove(rejects_path)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    msg = (f"Successfully processed spreadsheet! Inserted: {state['inserted']}, "
+           f"Updated: {state['updated']}, Rejected: {state['rejected']}")
+    if resumed_from:
+        msg += f" (resumed after row {resumed_from})"
+    return True, msg, rejects
+
+# Batch intake: one row per visit, a Patient-Visit ID plus a count column per specimen type
+SPECIMEN_TYPES = ["Plasma", "Serum", "Urine"]
+# What a blank ID cell turns into on its way through pandas; never a real visit
+BLANK_IDS = ("", "nan", "none", "0")
+
+def read_batch_intake(f):
+    """Intake CSV as a frame: IDs kept as stripped text, blank counts read as 0."""
+    df = pd.read_csv(f, dtype={"Patient-Visit ID": str})
+    if "Patient-Visit ID" in df.columns:
+        df["Patient-Visit ID"] = df["Patient-Visit ID"].str.strip()
+    counts = [t for t in SPECIMEN_TYPES if t in df.columns]
+    df[counts] = df[counts].fillna(0)
+    return df
+
+def parse_batch_intake(df_in):
+    """
+    Turns an intake CSV (see read_batch_intake) into the
+    [(patientvisit_id, [(type, count), ...]), ...] list allocate_batch expects.
+    Returns (visits, None), or (None, error message naming the first bad row).
+    """
+    if "Patient-Visit ID" not in df_in.columns:
+        return None, "Missing required column: Patient-Visit ID"
+    type_cols = [t for t in SPECIMEN_TYPES if t in df_in.columns]
+    if not type_cols:
+        return None, f"Provide at least one count column: {', '.join(SPECIMEN_TYPES)}"
+
+    visits = []
+    for i, row in enumerate(df_in.itertuples(index=False, name=None)):
+        values = dict(zip(df_in.columns, row))
+        pv_id = values["Patient-Visit ID"]
+        pv_id = "" if pd.isna(pv_id) else str(pv_id).strip()
+        if pv_id.lower() in BLANK_IDS:
+            return None, f"Row {i + 1}: missing Patient-Visit ID."
+        requests = []
+        for t in type_cols:
+            try:
+                count = int(float(values[t]))
+            except (TypeError, ValueError):
+                return None, f"Row {i + 1}: {t} count must be a number."
+            if count < 0 or count > 10:
+                return None, f"Row {i + 1}: {t} count must be between 0 and 10."
+            if count > 0:
+                requests.append((t, count))
+        if requests:
+            visits.append((pv_id, requests))
+    if not visits:
+        return None, "The file does not request any aliquots."
+    return visits, None
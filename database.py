@@ -1,40 +1,227 @@
 import streamlit as st
-from streamlit_gsheets import GSheetsConnection
 import pandas as pd
+import numpy as np
 import re
+import time
+import random
+import functools
+import threading
 from datetime import datetime
 import pytz
+import storage
+from inventory import Inventory, extract_patient_id
+from allocation import AllocationEngine
+from occupancy import OccupancyGrid, GRID_SIZE, RELEASED_STATUSES, holds_slot
+from snapshot_cache import SnapshotCache
+from freezer_stats import FreezerStats
+import inventory_query
+import exporter
+import events
+import metrics
+from activity import ActivityIndex, ALL_USERS
 
 CST_TZ = pytz.timezone("America/Chicago")
 
 def get_current_cst_time():
     return datetime.now(CST_TZ).replace(tzinfo=None)
 
-ADMIN_USER = st.secrets.get("ADMIN_USER", "admin@example.com")
+ADMIN_USER = storage.get_secret("ADMIN_USER", "admin@example.com")
 
 # IMPORTANT: You must setup your .streamlit/secrets.toml with your Google Service Account
 # and provide `spreadsheet` URL inside the `[connections.gsheets]` block.
+# To run against a local file instead, set STORAGE_BACKEND = "sqlite" (and optionally SQLITE_PATH).
 
-def get_connection():
-    return st.connection("gsheets", type=GSheetsConnection)
+# One shared snapshot per sheet for the whole process (see snapshot_cache.py)
+_snapshots = SnapshotCache(
+    max_bytes=int(storage.get_secret("CACHE_MAX_MB", 512)) * 1024 * 1024,
+    max_age=float(storage.get_secret("CACHE_MAX_AGE", 120))
+)
+
+def _read_sheet(backend, sheet_name):
+    # A snapshot cache miss: the one place a whole sheet comes from the backend
+    start = time.perf_counter()
+    df = backend.read(sheet_name)
+    metrics.observe("storage.read", time.perf_counter() - start, len(df), metrics.frame_bytes(df))
+    return df
 
-@st.cache_data(ttl=120, show_spinner=False)
 def get_sheet_data(sheet_name):
-    conn = get_connection()
+    """
+    Copy-on-write view of the cached sheet snapshot: cheap to get, and safe to modify
+    since changes never reach the shared snapshot.
+    """
+    backend = storage.get_backend()
+    current_revision = (lambda: backend.revision(sheet_name)) if backend.cheap_revisions else None
     try:
-        # ttl=0 forces the GSheetsConnection to bypass its own cache, 
-        # so that our explicit @st.cache_data decorator manages it completely.
-        df = conn.read(worksheet=sheet_name, ttl=0) 
-        return pd.DataFrame(df)
+        return _snapshots.get(sheet_name, lambda: _read_sheet(backend, sheet_name), current_revision)
     except Exception as e:
         return pd.DataFrame()
 
+# Each user's recent activity, moved forward by write_sheets (see activity.py)
+_activity = ActivityIndex()
+
+def get_cache_stats():
+    return _snapshots.stats()
+
+metrics.register_cache("snapshots", get_cache_stats)
+metrics.register_cache("activity", _activity.stats)
+
+def write_sheets(frames, revisions=None, appends=None):
+    """
+    Commits {sheet_name: df} in one go, sending only the rows that changed since the cached snapshot.
+    `revisions` holds the sheet revisions the caller planned against (e.g. inv.revisions);
+    if any sheet has moved on since then, storage.ConflictError is raised and nothing is written.
+    `appends` ({sheet_name: new rows}) are added to append-only sheets such as events in the
+    same commit, without reading or diffing those sheets.
+    """
+    backend = storage.get_backend()
+    changes = []
+    base_versions = {}
+    try:
+        for sheet_name, df in frames.items():
+            # Diff against the cached snapshot; a schema change (or anything the backend
+            # can't express as a delta) replaces the whole sheet.
+            snapshot = get_sheet_data(sheet_name)
+            expected = snapshot.attrs.get("revision")
+            base_versions[sheet_name] = snapshot.attrs.get("snapshot_version")
+            if revisions is not None and revisions.get(sheet_name) != expected:
+                raise storage.ConflictError(f"Sheet '{sheet_name}' changed while the write was being planned.")
+            delta = storage.compute_delta(snapshot, df, storage.SHEET_KEYS.get(sheet_name))
+            changes.append((sheet_name, df, delta, expected))
+        for sheet_name, rows in (appends or {}).items():
+            if not rows.empty:
+                delta = {"columns": [str(c) for c in rows.columns], "key": storage.SHEET_KEYS.get(sheet_name),
+                         "updates": [], "inserts": storage.to_db_rows(rows), "deletes": []}
+                changes.append((sheet_name, None, delta, None))
+        start = time.perf_counter()
+        committed = backend.commit(changes)
+        metrics.observe("storage.commit", time.perf_counter() - start, *_delta_size(changes))
+    except Exception:
+        # Drop the written sheets' snapshots so the retry plans against fresh data
+        for sheet_name in list(frames) + list(appends or {}):
+            _snapshots.invalidate(sheet_name)
+        raise
+    # What we just wrote is the new snapshot when the backend reports its revision;
+    # otherwise it's re-read on next use. The other sheets stay cached either way.
+    entries = {}
+    for (sheet_name, df, delta, _) in changes:
+        revision = committed.get(sheet_name)
+        if revision is None or df is None:
+            # Appended sheets are re-read on next use
+            _snapshots.invalidate(sheet_name)
+        else:
+            snapshot = df.reset_index(drop=True)
+            snapshot.attrs = {"revision": revision}
+            entry = _snapshots.put(sheet_name, snapshot)
+            if entry.revision == revision:
+                entries[sheet_name] = entry
+            if sheet_name == "aliquots" and entry.revision == revision:
+                _activity.advance(base_versions[sheet_name], entry.version, delta)
+    _advance_inventory(changes, base_versions, entries)
+
+def _advance_inventory(changes, base_versions, entries):
+    """
+    After our own commit, moves the shared Inventory forward by the rows just written instead
+    of leaving get_inventory to rebuild it from scratch. Only done when the commit was planned
+    against exactly that Inventory's snapshots and no other sheet has changed since; otherwise
+    (e.g. a newer revision read from another server) get_inventory sees new snapshot versions
+    and rebuilds as usual.
+    """
+    global _inventory, _inventory_key
+    written = [sheet_name for sheet_name, df, _, _ in changes if sheet_name in INVENTORY_SHEETS and df is not None]
+    if not written:
+        return
+    deltas = {sheet_name: delta for sheet_name, _, delta, _ in changes}
+    start = time.perf_counter()
+    with _inventory_lock:
+        if _inventory is None or _inventory_key is None:
+            return
+        key = []
+        for sheet_name, version in zip(INVENTORY_SHEETS, _inventory_key):
+            if sheet_name in written:
+                if base_versions.get(sheet_name) != version or sheet_name not in entries:
+                    return
+                key.append(entries[sheet_name].version)
+            elif _snapshots.version(sheet_name) != version:
+                return
+            else:
+                key.append(version)
+        frames = {}
+        for sheet_name in written:
+            # Tagged like a get_sheet_data view, since other caches key on the inventory's frames
+            frames[sheet_name] = entries[sheet_name].df.copy(deep=False)
+            frames[sheet_name].attrs["snapshot_version"] = entries[sheet_name].version
+        try:
+            inv = _inventory.updated(frames, deltas.get("aliquots"))
+        except Exception:
+            # The write itself is committed; a full rebuild on next use is always correct
+            inv = None
+        if inv is not None:
+            _inventory, _inventory_key = inv, tuple(key)
+    metrics.observe("database.advance_inventory", time.perf_counter() - start, error=inv is None)
+
+def _delta_size(changes):
+    # Rows sent and a rough byte count for them (their text), for the commit metrics
+    rows = nbytes = 0
+    for _, df, delta, _ in changes:
+        if delta is None:
+            rows += len(df)
+            nbytes += metrics.frame_bytes(df)
+            continue
+        sent = delta["updates"] + delta["inserts"]
+        rows += len(sent) + len(delta["deletes"])
+        nbytes += sum(len(str(row)) for row in sent)
+    return rows, nbytes
+
 def write_sheet_data(sheet_name, df):
-    conn = get_connection()
-    # Write the dataframe back, completely replacing the current sheet data
-    conn.update(worksheet=sheet_name, data=df)
-    # Clear ONLY the cache for this specific sheet, saving API calls on the other sheets
-    get_sheet_data.clear(sheet_name)
+    write_sheets({sheet_name: df})
+
+def _reserve_event_ids(stats, n):
+    """First of n event ids, taken from the counter committed with the stats sheet."""
+    start = 1
+    if not stats.has_sequence("events"):
+        # No counter yet (stats never seeded or rebuilt): carry on after whatever is logged
+        df_events = get_sheet_data("events")
+        if not df_events.empty and 'id' in df_events.columns:
+            start = int(pd.to_numeric(df_events['id'], errors='coerce').fillna(0).max()) + 1
+    return stats.reserve_ids("events", n, start)
+
+# Serializes read-plan-write operations inside this server process
+_write_lock = threading.RLock()
+WRITE_RETRIES = 5
+
+def serialized_write(func):
+    """
+    Runs a read-plan-write operation under the process write lock. When the commit hits
+    a ConflictError (another server wrote first), the operation is re-planned from fresh data.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(WRITE_RETRIES):
+            try:
+                with _write_lock:
+                    return func(*args, **kwargs)
+            except storage.ConflictError:
+                if attempt == WRITE_RETRIES - 1:
+                    raise
+            # Back off outside the lock so other writers can proceed
+            time.sleep(random.uniform(0.05, 0.2) * (attempt + 1))
+    return wrapper
+
+INVENTORY_SHEETS = ("users", "boxes", "aliquots", "stats")
+_inventory = None
+_inventory_key = None
+_inventory_lock = threading.Lock()
+
+def get_inventory():
+    # One typed, indexed model per set of snapshot versions, shared by every session (not copied per hit)
+    global _inventory, _inventory_key
+    frames = [get_sheet_data(sheet_name) for sheet_name in INVENTORY_SHEETS]
+    key = tuple(df.attrs.get("snapshot_version") for df in frames)
+    with _inventory_lock:
+        if _inventory is None or key != _inventory_key or None in key:
+            _inventory = Inventory(*frames)
+            _inventory_key = key
+        return _inventory
 
 def init_db():
     if 'db_initialized' in st.session_state:
@@ -91,20 +278,26 @@ def init_db():
         ])
         write_sheet_data("aliquots", df_aliquots)
 
+    # 4. Seed the dashboard counters from the data (see freezer_stats.py)
+    if FreezerStats.from_sheet(get_sheet_data("stats")) is None:
+        write_sheet_data("stats", get_inventory().stats.to_frame())
+
 # --- Auth Methods ---
 
 def get_user(email):
-    df = get_sheet_data("users")
-    user_row = df[df['email'] == email]
-    if not user_row.empty:
-        u = user_row.iloc[0]
+    inv = get_inventory()
+    idx = inv.find_user(email)
+    if idx is not None:
+        u = inv.users.loc[idx]
         return {'email': u['email'], 'password': u['password'], 'role': u['role'], 'status': u['status']}
     return None
 
+@serialized_write
 def add_pending_user(email):
-    df = get_sheet_data("users")
-    if email in df['email'].values:
+    inv = get_inventory()
+    if inv.find_user(email) is not None:
         return False, "Email already registered or pending."
+    df = inv.users
         
     new_user = pd.DataFrame({
         "email": [email],
@@ -115,21 +308,25 @@ def add_pending_user(email):
         "checkout_count": [0]
     })
     df = pd.concat([df, new_user], ignore_index=True)
-    write_sheet_data("users", df)
+    write_sheets({"users": df}, inv.revisions)
     return True, "Registration requested. Pending admin approval."
 
+@serialized_write
 def approve_user(email, password):
-    df = get_sheet_data("users")
-    idx = df[df['email'] == email].index
-    if not idx.empty:
+    inv = get_inventory()
+    idx = inv.find_user(email)
+    if idx is not None:
+        df = inv.users.copy()
         df.loc[idx, 'status'] = 'approved'
         df.loc[idx, 'password'] = password
-        write_sheet_data("users", df)
+        write_sheets({"users": df}, inv.revisions)
 
+@serialized_write
 def add_approved_user(email, password):
-    df = get_sheet_data("users")
-    if email in df['email'].values:
+    inv = get_inventory()
+    if inv.find_user(email) is not None:
         return False, "Email already exists."
+    df = inv.users
         
     new_user = pd.DataFrame({
         "email": [email],
@@ -140,16 +337,19 @@ def add_approved_user(email, password):
         "checkout_count": [0]
     })
     df = pd.concat([df, new_user], ignore_index=True)
-    write_sheet_data("users", df)
+    write_sheets({"users": df}, inv.revisions)
     return True, "User added directly."
 
+@serialized_write
 def change_password(email, new_password):
-    df = get_sheet_data("users")
-    idx = df[df['email'] == email].index
-    if not idx.empty:
+    inv = get_inventory()
+    idx = inv.find_user(email)
+    if idx is not None:
+        df = inv.users.copy()
         df.loc[idx, 'password'] = new_password
-        write_sheet_data("users", df)
+        write_sheets({"users": df}, inv.revisions)
 
+@serialized_write
 def remove_user(email):
     if email == ADMIN_USER:
         return False, "Cannot delete master user."
@@ -185,444 +385,609 @@ def get_all_users():
 
 # --- Inventory Methods ---
 
-def extract_patient_id(pv_id):
-    for delim in ['-', '_', ' ']:
-        if delim in pv_id:
-            return pv_id.rsplit(delim, 1)[0]
-    m = re.match(r"^(.*?)(\d+)$", pv_id)
-    if m:
-        return m.group(1)
-    return pv_id
-
 def allocate_multiple_aliquots(patientvisit_id, requests, user_email):
     """
     requests should be a list of tuples: [(aliquot_type_1, count_1), (aliquot_type_2, count_2), ...]
     """
-    df_boxes = get_sheet_data("boxes")
-    df_boxes['id'] = pd.to_numeric(df_boxes['id'])
-    df_boxes['spots_used'] = pd.to_numeric(df_boxes['spots_used'])
-    
-    df_aliquots = get_sheet_data("aliquots")
-    if not df_aliquots.empty:
-        df_aliquots['box_id'] = pd.to_numeric(df_aliquots['box_id'])
-        
-    df_users = get_sheet_data("users")
-    u_idx = df_users[df_users['email'] == user_email].index
-    if not u_idx.empty:
-        if 'checkin_count' not in df_users.columns:
-            df_users['checkin_count'] = 0
-        df_users['checkin_count'] = pd.to_numeric(df_users['checkin_count'], errors='coerce').fillna(0)
+    return allocate_batch([(patientvisit_id, requests)], user_email)
+
+@serialized_write
+def allocate_batch(visits, user_email):
+    """
+    Plans every placement for many patient-visits against one snapshot and commits them together.
+    visits should be a list of tuples: [(patientvisit_id, [(aliquot_type, count), ...]), ...]
+    Returns one combined allocation list (in visit order) for a single merged label PDF.
+    Nothing is written if any request can't be placed.
+    """
+    inv = get_inventory()
+    df_boxes = inv.boxes.copy()
+
+    df_users = inv.users.copy()
+    u_idx = inv.find_user(user_email)
+    if u_idx is not None and 'checkin_count' not in df_users.columns:
+        df_users['checkin_count'] = 0
     
     all_allocated = []
     total_count = 0
+    new_rows = []
     
-    next_id = 1
-    if not df_aliquots.empty:
-        df_aliquots['id'] = pd.to_numeric(df_aliquots['id'])
-        next_id = int(df_aliquots['id'].max()) + 1
+    next_id = inv.next_aliquot_id
+
+    # One engine and one grid for the whole batch, so later visits see earlier placements
+    engine = AllocationEngine(inv)
+    grid = inv.grid.copy()
+    stats = inv.stats.copy()
+    log = events.EventBatch()
 
     curr_time = get_current_cst_time().strftime("%Y-%m-%d %H:%M:%S")
 
-    for aliquot_type, count in requests:
-        if count <= 0:
-            continue
-            
-        total_count += count
-        
-        # 1. Find a box (Constraint 3)
-        target_box_id = None
-        spots_used_in_target = 0
-        
-        if not df_aliquots.empty:
-            # Check if already using a box for this specific PV and type
-            matching = df_aliquots[(df_aliquots['patientvisit_id'] == patientvisit_id) & (df_aliquots['specimen_type'] == aliquot_type)]
-            if not matching.empty:
-                possible_box = matching.iloc[0]['box_id']
-                b_row = df_boxes[df_boxes['id'] == possible_box]
-                if not b_row.empty:
-                    used = b_row.iloc[0]['spots_used']
-                    if (81 - used) >= count:
-                        target_box_id = possible_box
-                        spots_used_in_target = used
-
-        # Constraints 1 and 2
-        if target_box_id is None:
-            pat_id = extract_patient_id(patientvisit_id)
-            
-            forbidden_boxes = set()
-            if not df_aliquots.empty:
-                for _, row in df_aliquots.iterrows():
-                    pvid = row['patientvisit_id']
-                    if pvid != patientvisit_id and extract_patient_id(pvid) == pat_id:
-                        forbidden_boxes.add(row['box_id'])
-                        
-            preferred_rack = None
-            if aliquot_type == "Plasma":
-                preferred_rack = 1
-            elif aliquot_type == "Serum":
-                preferred_rack = 2
-            elif aliquot_type == "Urine":
-                preferred_rack = 3
-                
-            def find_box(iterator):
-                for _, row in iterator:
-                    b_id = row['id']
-                    if b_id in forbidden_boxes:
-                        continue
-                        
-                    s_type = str(row['specimen_type']).strip()
-                    if s_type == "" or s_type == "nan" or s_type == "None":
-                        s_type = None
-                        
-                    used = row['spots_used']
-                    
-                    if (s_type is None or s_type == aliquot_type) and (81 - used) >= count:
-                        return b_id, used
-                return None, 0
-                
-            # Pass 1: Try preferred rack exclusively
-            if preferred_rack is not None:
-                target_box_id, spots_used_in_target = find_box(
-                    df_boxes[(df_boxes['rack_num'] == preferred_rack) | (df_boxes['rack_num'] == str(preferred_rack))].iterrows()
-                )
+    for patientvisit_id, requests in visits:
+        for aliquot_type, count in requests:
+            if count <= 0:
+                continue
                 
-            # Pass 2: Fallback to Overflow Rack 4
+            total_count += count
+            
+            # 1. Find a box (Constraints 1, 2 and 3 plus the 3-pass rack routing)
+            target_box_id = engine.choose_box(patientvisit_id, aliquot_type, count)
             if target_box_id is None:
-                target_box_id, spots_used_in_target = find_box(
-                    df_boxes[(df_boxes['rack_num'] == 4) | (df_boxes['rack_num'] == '4')].iterrows()
-                )
+                raise Exception(f"No suitable box found for allocation of {count} {aliquot_type} aliquots for {patientvisit_id}!")
+            engine.reserve(patientvisit_id, aliquot_type, target_box_id, count)
                 
-            # Pass 3: Emergency Fallback to any rack anywhere in the freezer
-            if target_box_id is None:
-                target_box_id, spots_used_in_target = find_box(df_boxes.iterrows())
-                    
-        if target_box_id is None:
-            raise Exception(f"No suitable box found for allocation of {count} {aliquot_type} aliquots!")
+            # 2. Find empty spots straight from the box's occupancy grid
+            spots_to_use = grid.free_spots(target_box_id, count)
             
-        # 2. Find empty spots
-        used_spots = set()
-        if not df_aliquots.empty:
-            box_aliq = df_aliquots[df_aliquots['box_id'] == target_box_id]
-            for _, row in box_aliq.iterrows():
-                used_spots.add((int(row['x_coord']), int(row['y_coord'])))
+            # 3. Make IDs
+            b_idx = inv.find_box(target_box_id)
+            box_row = df_boxes.loc[b_idx]
+            d, r, l, b = int(box_row['door_num']), int(box_row['rack_num']), int(box_row['level_num']), int(box_row['box_num'])
+                
+            for (x, y) in spots_to_use:
+                location_id = f"D{d}R{r}L{l}B{b}X{x}Y{y}"
+                new_rows.append({
+                    "id": next_id,
+                    "location_id": location_id,
+                    "box_id": target_box_id,
+                    "x_coord": x,
+                    "y_coord": y,
+                    "patientvisit_id": patientvisit_id,
+                    "specimen_type": aliquot_type,
+                    "stored_time": curr_time,
+                    "checkin_user_id": user_email,
+                    "days_since_stored": 0,  # kept for the sheet layout; displays compute it from stored_time
+                    "status": "Stored",
+                    "sent_to": "",
+                    "checkout_time": "",
+                    "checkout_user_id": ""
+                })
+                all_allocated.append({
+                    'location_id': location_id,
+                    'x': x,
+                    'y': y,
+                    'patientvisit_id': patientvisit_id,
+                    'specimen_type': aliquot_type
+                })
+                log.add(curr_time, events.STORED, new_rows[-1], user_email)
+                grid.occupy(target_box_id, x, y)
+                next_id += 1
                 
-        empty_spots = []
-        for x in range(1, 10):
-            for y in range(1, 10):
-                if (x, y) not in used_spots:
-                    empty_spots.append((x, y))
-                    
-        spots_to_use = empty_spots[:count]
+            # 4. Update box metadata
+            df_boxes.loc[b_idx, 'spots_used'] = grid.spots_used(target_box_id)
+            df_boxes.loc[b_idx, 'specimen_type'] = aliquot_type
+            stats.add_aliquots('Stored', aliquot_type, len(spots_to_use))
         
-        # 3. Make IDs
-        box_row = df_boxes[df_boxes['id'] == target_box_id].iloc[0]
-        d, r, l, b = box_row['door_num'], box_row['rack_num'], box_row['level_num'], box_row['box_num']
-            
-        new_rows = []
-        for (x, y) in spots_to_use:
-            location_id = f"D{d}R{r}L{l}B{b}X{x}Y{y}"
-            new_rows.append({
-                "id": next_id,
-                "location_id": location_id,
-                "box_id": target_box_id,
-                "x_coord": x,
-                "y_coord": y,
-                "patientvisit_id": patientvisit_id,
-                "specimen_type": aliquot_type,
-                "stored_time": curr_time,
-                "checkin_user_id": user_email,
-                "days_since_stored": 0,
-                "status": "Stored",
-                "sent_to": "",
-                "checkout_time": "",
-                "checkout_user_id": ""
-            })
-            all_allocated.append({
-                'location_id': location_id,
-                'x': x,
-                'y': y,
-                'patientvisit_id': patientvisit_id,
-                'specimen_type': aliquot_type
-            })
-            next_id += 1
-            
-        if not df_aliquots.empty:
-            df_aliquots = pd.concat([df_aliquots, pd.DataFrame(new_rows)], ignore_index=True)
+    # 5. Write back exactly ONCE per sheet for the whole batch, all against the snapshot it was planned on
+    if total_count > 0:
+        if not inv.aliquots.empty:
+            df_aliquots = pd.concat([inv.aliquots, pd.DataFrame(new_rows)], ignore_index=True)
         else:
             df_aliquots = pd.DataFrame(new_rows)
-            
-        # 4. Update box metadata
-        idx = df_boxes[df_boxes['id'] == target_box_id].index
-        df_boxes.loc[idx, 'spots_used'] = spots_used_in_target + count
-        df_boxes.loc[idx, 'specimen_type'] = aliquot_type
-        
-    # 5. Write back to Google Sheets exactly ONCE per session
-    if total_count > 0:
-        write_sheet_data("aliquots", df_aliquots)
-        write_sheet_data("boxes", df_boxes)
-        if not u_idx.empty:
+        stats.set_active_boxes(grid)
+        df_events = log.to_frame(_reserve_event_ids(stats, len(log)))
+        frames = {"aliquots": df_aliquots, "boxes": df_boxes, "stats": stats.to_frame()}
+        if u_idx is not None:
             df_users.loc[u_idx, 'checkin_count'] += total_count
-            write_sheet_data("users", df_users)
+            frames["users"] = df_users
+        write_sheets(frames, inv.revisions, appends={"events": df_events})
             
     return all_allocated
 
-def toggle_aliquot_status(location_id, user_email, sent_to=""):
-    df = get_sheet_data("aliquots")
-    if df.empty:
-        return False, "Aliquot not found.", None
-        
-    matches = df[df['location_id'] == location_id]
-    if matches.empty:
-        return False, "Aliquot not found.", None
-        
-    # Get highest ID index for this location
-    matches['id'] = pd.to_numeric(matches['id'])
-    latest_idx = matches['id'].idxmax()
-    
-    curr_status = df.loc[latest_idx, 'status']
-    new_status = 'Checked Out' if curr_status == 'Stored' else 'Stored'
-    
-    curr_time = get_current_cst_time().strftime("%Y-%m-%d %H:%M:%S")
-    
-    df_users = get_sheet_data("users")
-    u_idx = df_users[df_users['email'] == user_email].index
-    if not u_idx.empty:
-        if 'checkin_count' not in df_users.columns:
-            df_users['checkin_count'] = 0
-        if 'checkout_count' not in df_users.columns:
-            df_users['checkout_count'] = 0
-        df_users['checkin_count'] = pd.to_numeric(df_users['checkin_count'], errors='coerce').fillna(0)
-        df_users['checkout_count'] = pd.to_numeric(df_users['checkout_count'], errors='coerce').fillna(0)
-
+def _apply_status(inv, df, df_users, grid, latest_idx, new_status, user_email, sent_to, curr_time):
+    """
+    Moves one tube to new_status in the working copies and bumps the user's counter.
+    Returns (box_id or None, user row or None) so the caller knows what to write back.
+    """
+    u_idx = inv.find_user(user_email)
     if new_status == 'Checked Out':
         df.loc[latest_idx, 'checkout_time'] = curr_time
         df.loc[latest_idx, 'checkout_user_id'] = user_email
         df.loc[latest_idx, 'sent_to'] = sent_to
-        if not u_idx.empty:
+        if u_idx is not None:
             df_users.loc[u_idx, 'checkout_count'] += 1
-    else:
+    elif new_status == 'Stored':
         df.loc[latest_idx, 'stored_time'] = curr_time
         df.loc[latest_idx, 'checkin_user_id'] = user_email
         df.loc[latest_idx, 'checkout_time'] = ""
         df.loc[latest_idx, 'checkout_user_id'] = ""
         df.loc[latest_idx, 'sent_to'] = ""
-        if not u_idx.empty:
+        if u_idx is not None:
             df_users.loc[u_idx, 'checkin_count'] += 1
-            
+    elif df.loc[latest_idx, 'status'] == 'Stored':
+        # Used up straight from the freezer: record when it left, as a check-out would
+        df.loc[latest_idx, 'checkout_time'] = curr_time
+        df.loc[latest_idx, 'checkout_user_id'] = user_email
+
     df.loc[latest_idx, 'status'] = new_status
-    write_sheet_data("aliquots", df)
-    if not u_idx.empty:
-        write_sheet_data("users", df_users)
-    
-    return True, f"Aliquot toggled successfully. New Status: **{new_status}**", new_status
 
-def get_freezer_stats():
-    df_boxes = get_sheet_data("boxes")
-    df_aliquots = get_sheet_data("aliquots")
+    # Keep the box's occupancy (and the spots_used derived from it) in step with the tube
+    b_id = df.loc[latest_idx, 'box_id']
+    x, y = (pd.to_numeric(df.loc[latest_idx, col], errors='coerce') for col in ('x_coord', 'y_coord'))
+    if inv.find_box(b_id) is None or not (1 <= x <= GRID_SIZE and 1 <= y <= GRID_SIZE):
+        return None, u_idx
+    if holds_slot(new_status):
+        grid.occupy(b_id, int(x), int(y))
+    else:
+        grid.release(b_id, int(x), int(y))
+    return b_id, u_idx
+
+def _commit_status_changes(inv, changes, journal=None):
+    """
+    journal, if given, is (journal key, seq): the highest journaled scan in `changes`, recorded
+    in the stats sheet in the same commit (see apply_journal). It's written even when every
+    change turns out to be a no-op.
+    """
+    df = inv.aliquots.copy()
+    df_users = inv.users.copy()
+    for col in ['checkin_count', 'checkout_count']:
+        if col not in df_users.columns:
+            df_users[col] = 0
+    grid = inv.grid.copy()
+    stats = inv.stats.copy()
+    log = events.EventBatch()
+
+    boxes_touched = set()
+    users_touched = False
+    applied = 0
+    for location_id, new_status, user_email, sent_to, curr_time in changes:
+        latest_idx = inv.latest_aliquot(location_id)
+        # Already in the requested state (e.g. a change being replayed): nothing to do.
+        # A consumed tube's slot may already hold another tube, so it can't come back.
+        if latest_idx is None:
+            continue
+        curr_status = df.loc[latest_idx, 'status']
+        if curr_status == new_status or curr_status in RELEASED_STATUSES:
+            continue
+        stats.change_status(df.loc[latest_idx, 'specimen_type'], df.loc[latest_idx, 'status'], new_status)
+        b_id, u_idx = _apply_status(inv, df, df_users, grid, latest_idx, new_status, user_email, sent_to, curr_time)
+        log.add(curr_time, events.status_event(new_status), df.loc[latest_idx], user_email,
+                sent_to if new_status == 'Checked Out' else "")
+        if b_id is not None:
+            boxes_touched.add(b_id)
+        users_touched = users_touched or u_idx is not None
+        applied += 1
+
+    if journal is not None:
+        stats.set_sequence(*journal)
+    elif applied == 0:
+        return 0
+    stats.set_active_boxes(grid)
+    df_events = log.to_frame(_reserve_event_ids(stats, len(log)))
+    frames = {"aliquots": df, "stats": stats.to_frame()}
+    if boxes_touched:
+        df_boxes = inv.boxes.copy()
+        for b_id in boxes_touched:
+            df_boxes.loc[inv.find_box(b_id), 'spots_used'] = grid.spots_used(b_id)
+        frames["boxes"] = df_boxes
+    if users_touched:
+        frames["users"] = df_users
+    write_sheets(frames, inv.revisions, appends={"events": df_events})
+    return applied
+
+@serialized_write
+def set_aliquot_statuses(changes):
+    """
+    Applies many check-outs/check-ins with one write per sheet.
+    changes should be a list of tuples, applied in order:
+    [(location_id, new_status, user_email, sent_to, time_str), ...]
+    A change that finds the tube already in new_status is skipped. Returns how many were applied.
+    """
+    return _commit_status_changes(get_inventory(), changes)
+
+@serialized_write
+def apply_journal(journal_key, records):
+    """
+    Applies journaled scans, each (seq, location_id, new_status, user_email, sent_to, time_str),
+    like set_aliquot_statuses, and records the highest seq under journal_key in the same commit.
+    Scans at or below the recorded seq were already applied by an earlier flush (one that
+    stopped before trimming its journal) and are skipped. With no records, this just rewrites
+    the stats sheet. Returns how many were applied.
+    """
+    inv = get_inventory()
+    done = inv.stats.sequence(journal_key)
+    records = [r for r in records if r[0] > done]
+    last_seq = max([done] + [r[0] for r in records])
+    return _commit_status_changes(inv, [r[1:] for r in records], (journal_key, last_seq))
+
+def get_journal_seq(journal_key):
+    """Highest journaled scan applied so far under journal_key (0 if none)."""
+    return get_inventory().stats.sequence(journal_key)
+
+@serialized_write
+def toggle_aliquot_status(location_id, user_email, sent_to=""):
+    inv = get_inventory()
+    # Row currently occupying this location (highest id), straight from the index
+    latest_idx = inv.latest_aliquot(location_id)
+    if latest_idx is None:
+        return False, "Aliquot not found.", None
     
-    if df_boxes.empty:
-        return {
-            'total_boxes': 0, 'active_boxes': 0, 'empty_boxes': 0,
-            'total_aliquots_stored': 0, 'total_aliquots_checked_out': 0, 'type_counts_stored': {}
-        }
+    curr_status = inv.aliquots.loc[latest_idx, 'status']
+    if curr_status in RELEASED_STATUSES:
+        return False, f"This tube was marked {curr_status} and its slot released; it can't be checked back in.", None
+    new_status = 'Checked Out' if curr_status == 'Stored' else 'Stored'
     
-    df_boxes['spots_used'] = pd.to_numeric(df_boxes['spots_used'], errors='coerce').fillna(0)
-    active_boxes = len(df_boxes[df_boxes['spots_used'] > 0])
-    total_boxes = len(df_boxes)
+    curr_time = get_current_cst_time().strftime("%Y-%m-%d %H:%M:%S")
+    _commit_status_changes(inv, [(location_id, new_status, user_email, sent_to, curr_time)])
     
-    if df_aliquots.empty:
-        total_stored = 0
-        total_checked_out = 0
-        type_counts = {}
-    else:
-        total_stored = len(df_aliquots[df_aliquots['status'] == 'Stored'])
-        total_checked_out = len(df_aliquots[df_aliquots['status'] == 'Checked Out'])
-        stored_df = df_aliquots[df_aliquots['status'] == 'Stored']
-        type_counts = stored_df['specimen_type'].value_counts().to_dict()
-        
-    return {
-        'total_boxes': total_boxes,
-        'active_boxes': active_boxes,
-        'empty_boxes': total_boxes - active_boxes,
-        'total_aliquots_stored': total_stored,
-        'total_aliquots_checked_out': total_checked_out,
-        'type_counts_stored': type_counts
-    }
+    return True, f"Aliquot toggled successfully. New Status: **{new_status}**", new_status
 
-def get_recent_aliquots(user_email, limit=50):
-    df = get_sheet_data("aliquots")
-    if df.empty:
-        return pd.DataFrame()
-    
+@serialized_write
+def bulk_toggle_aliquot_status(location_ids, user_email, sent_to="", new_status="Checked Out"):
+    """
+    Bulk version of toggle_aliquot_status for scan sessions: moves every listed tube to
+    new_status with one write per sheet, however many tubes there are.
+    Returns (applied, not_found, unchanged) lists of location IDs; unchanged tubes were
+    already in new_status, or consumed.
+    """
+    inv = get_inventory()
+    curr_time = get_current_cst_time().strftime("%Y-%m-%d %H:%M:%S")
+    applied, not_found, unchanged = [], [], []
+    changes = []
+    for location_id in dict.fromkeys(location_ids):
+        latest_idx = inv.latest_aliquot(location_id)
+        if latest_idx is None:
+            not_found.append(location_id)
+        elif inv.aliquots.loc[latest_idx, 'status'] in (new_status,) + RELEASED_STATUSES:
+            unchanged.append(location_id)
+        else:
+            applied.append(location_id)
+            changes.append((location_id, new_status, user_email, sent_to, curr_time))
+    if changes:
+        _commit_status_changes(inv, changes)
+    return applied, not_found, unchanged
+
+def _resolve_box(inv, box_ref):
+    # box_ref is either the numeric box id or a box position such as D1R2L3B4; None if no such box
+    box_ref = str(box_ref).strip().upper()
+    m = re.fullmatch(r"D(\d+)R(\d+)L(\d+)B(\d+)", box_ref)
+    if m:
+        d, r, l, b = [int(v) for v in m.groups()]
+        df_b = inv.boxes
+        hit = df_b[(df_b['door_num'] == d) & (df_b['rack_num'] == r) & (df_b['level_num'] == l) & (df_b['box_num'] == b)]
+        if not hit.empty:
+            return hit['id'].iloc[0]
+    elif box_ref.isdigit() and inv.find_box(int(box_ref)) is not None:
+        return int(box_ref)
+    return None
+
+def get_box_location_ids(box_ref, status="Stored"):
+    """
+    Location IDs of the tubes currently in a box with the given status.
+    box_ref is either the numeric box id or a box position such as D1R2L3B4.
+    Returns None if there is no such box.
+    """
+    inv = get_inventory()
+    box_id = _resolve_box(inv, box_ref)
+    if box_id is None:
+        return None
+
+    df = inv.aliquots.loc[inv.aliquots_in_box(box_id)]
+    # Only the tube currently occupying each slot counts
+    current = [loc for loc, idx in zip(df['location_id'], df.index) if inv.latest_aliquot(loc) == idx]
+    df = df[df['location_id'].isin(current) & (df['status'] == status)]
+    return df.sort_values(['x_coord', 'y_coord'])['location_id'].tolist()
+
+def get_aliquot_statuses(location_ids):
+    """Looks up a list of scanned location IDs; unknown IDs get the status 'Not found'."""
+    inv = get_inventory()
+    rows = []
+    for location_id in location_ids:
+        latest_idx = inv.latest_aliquot(location_id)
+        if latest_idx is None:
+            rows.append({"Location ID": location_id, "Patient-Visit ID": "", "Specimen Type": "", "Status": "Not found"})
+        else:
+            row = inv.aliquots.loc[latest_idx]
+            rows.append({"Location ID": location_id, "Patient-Visit ID": row['patientvisit_id'],
+                         "Specimen Type": row['specimen_type'], "Status": row['status']})
+    return pd.DataFrame(rows, columns=["Location ID", "Patient-Visit ID", "Specimen Type", "Status"])
+
+def get_all_location_ids():
+    """Every location ID the freezer's boxes provide, whether or not a tube is there."""
+    inv = get_inventory()
+    ids = []
+    for d, r, l, b in inv.boxes[BOX_KEYS].dropna().astype(int).itertuples(index=False, name=None):
+        ids.extend(f"D{d}R{r}L{l}B{b}X{x}Y{y}" for x in range(1, GRID_SIZE + 1) for y in range(1, GRID_SIZE + 1))
+    return ids
+
+def get_box_position(box_ref):
+    """Position of a box (e.g. 'D1R2L3B4') from its numeric id or position, or None if there is no such box."""
+    inv = get_inventory()
+    box_id = _resolve_box(inv, box_ref)
+    if box_id is None:
+        return None
+    d, r, l, b = inv.boxes.loc[inv.find_box(box_id), BOX_KEYS].astype(int)
+    return f"D{d}R{r}L{l}B{b}"
+
+def get_current_aliquots(location_ids):
+    """The current aliquot row at each location that has one, e.g. to check a box photo against."""
+    inv = get_inventory()
+    rows = [inv.latest_aliquot(str(loc).strip().upper()) for loc in dict.fromkeys(location_ids)]
+    return inv.aliquots.loc[[idx for idx in rows if idx is not None]]
+
+def get_aliquot_history(location_id):
+    """Chain of custody for a location: every logged event there, oldest first."""
+    return events.history(get_sheet_data("events"), str(location_id).strip().upper())
+
+def verify_event_log():
+    """
+    Replays the event log to the state each aliquot was last left in and compares it with
+    the aliquots sheet. Returns a DataFrame of the aliquots that disagree (empty if none).
+    Aliquots that predate the log have no events and aren't checked.
+    """
+    inv = get_inventory()
+    state = events.current_state(get_sheet_data("events"))
+    columns = ["Location ID", "Logged Status", "Current Status"]
+    if state.empty or inv.aliquots.empty:
+        return pd.DataFrame(columns=columns)
+    current = inv.aliquots.dropna(subset=['id']).set_index('id')
+    state = state[state.index.isin(current.index)]
+    actual = current.loc[state.index, 'status']
+    bad = state['status'].values != actual.values
+    return pd.DataFrame({
+        "Location ID": state['location_id'].values[bad],
+        "Logged Status": state['status'].values[bad],
+        "Current Status": actual.values[bad],
+    }, columns=columns)
+
+def get_freezer_stats():
+    # Read straight from the persisted counters: a handful of rows, whatever the inventory size
+    stats = FreezerStats.from_sheet(get_sheet_data("stats"))
+    if stats is None:
+        stats = get_inventory().stats
+    return stats.as_dict()
+
+@serialized_write
+def verify_freezer_stats(repair=False):
+    """
+    Recomputes the dashboard counters from the boxes and aliquots sheets and compares them
+    with the persisted ones. With repair=True the recomputed counters are written back.
+    Returns {counter: (persisted, recomputed)} for every counter that was off.
+    """
+    inv = get_inventory()
+    persisted = FreezerStats.from_sheet(get_sheet_data("stats")) or FreezerStats()
+    recomputed = FreezerStats.from_frames(inv.boxes, inv.aliquots, inv.grid)
+    recomputed.carry_sequences(persisted)
+    diffs = persisted.diff(recomputed)
+    if repair and diffs:
+        write_sheets({"stats": recomputed.to_frame()}, inv.revisions)
+    return diffs
+
+def _activity_positions(inv):
+    # Row positions newest activity first, the order cached on the snapshot's browse index
+    return inventory_query.get_browse_index(inv).order("Latest Activity")
+
+def _recent_from_inventory(inv, user_email, limit):
+    positions = _activity_positions(inv)
     if user_email != ADMIN_USER:
         # Filter to only show activity for this user
-        df = df[(df['checkin_user_id'] == user_email) | (df['checkout_user_id'] == user_email)]
-        if df.empty:
+        df = inv.aliquots
+        mine = np.zeros(len(df), dtype=bool)
+        for col in ['checkin_user_id', 'checkout_user_id']:
+            if col in df.columns:
+                mine |= (df[col] == user_email).values
+        positions = positions[mine[positions]]
+        if len(positions) == 0:
             return pd.DataFrame()
-            
-    cols_to_check = [c for c in ['stored_time', 'checkout_time'] if c in df.columns]
-    if cols_to_check:
-        temp_df = df[cols_to_check].apply(pd.to_datetime, errors='coerce')
-        df['latest_activity'] = temp_df.max(axis=1)
-        df = df.sort_values(by=['latest_activity', 'id'], ascending=[False, False]).head(limit)
-    else:
-        df['id'] = pd.to_numeric(df['id'], errors='coerce').fillna(0)
-        df = df.sort_values(by='id', ascending=False).head(limit)
-    
-    # Calculate days since stored dynamically
-    now = get_current_cst_time()
-    if 'stored_time' in df.columns:
-        df['days_since_stored'] = pd.to_datetime(df['stored_time'], errors='coerce').apply(lambda x: (now - x).days if pd.notnull(x) else 0)
-        
-    cols = [c for c in ['location_id', 'patientvisit_id', 'specimen_type', 'stored_time', 'checkin_user_id', 'days_since_stored','status',  'sent_to', 'checkout_time', 'checkout_user_id'] if c in df.columns]
-    res = df[cols].copy()
-    
-    # rename for display
-    rename_map = {
-        "location_id": "Location ID",
-        "patientvisit_id": "Patient-Visit ID",
-        "specimen_type": "Specimen Type",
-        "status": "Status",
-        "sent_to": "Sent To",
-        "stored_time": "Stored Time",
-        "days_since_stored": "Days Stored",
-        "checkout_time": "Checkout Time",
-        "checkin_user_id": "Check-in User",
-        "checkout_user_id": "Check-out User"
-    }
-    res.rename(columns=rename_map, inplace=True)
-    return res
+    return inventory_query.format_page(inv, positions[:limit], get_current_cst_time())
+
+def get_recent_aliquots(user_email, limit=50):
+    """
+    The user's `limit` most recent check-ins/check-outs (everyone's for the admin), newest first.
+    Answered from the activity index without touching the inventory unless the aliquots
+    snapshot changed under it.
+    """
+    snapshot = get_sheet_data("aliquots")
+    if snapshot.empty:
+        return pd.DataFrame()
+    key = ALL_USERS if user_email == ADMIN_USER else user_email
+    rows = _activity.recent(key, limit, snapshot.attrs.get("snapshot_version"))
+    if rows is None:
+        inv = get_inventory()
+        _activity.rebuild(inv)
+        rows = _activity.recent(key, limit, inv.aliquots.attrs.get("snapshot_version"))
+        if rows is None:
+            # More rows asked for than the index keeps
+            return _recent_from_inventory(inv, user_email, limit)
+    if not rows:
+        return pd.DataFrame()
+    return _activity.to_frame(rows, get_current_cst_time())
 
 def get_all_aliquots_df():
-    df = get_sheet_data("aliquots")
-    if df.empty:
+    inv = get_inventory()
+    if inv.aliquots.empty:
         return pd.DataFrame()
-    
-    cols_to_check = [c for c in ['stored_time', 'checkout_time'] if c in df.columns]
-    if cols_to_check:
-        temp_df = df[cols_to_check].apply(pd.to_datetime, errors='coerce')
-        df['latest_activity'] = temp_df.max(axis=1)
-        df = df.sort_values(by=['latest_activity', 'id'], ascending=[False, False])
-    else:
-        df['id'] = pd.to_numeric(df['id'], errors='coerce').fillna(0)
-        df = df.sort_values(by='id', ascending=False)
-    
-    now = get_current_cst_time()
-    if 'stored_time' in df.columns:
-        df['days_since_stored'] = pd.to_datetime(df['stored_time'], errors='coerce').apply(lambda x: (now - x).days if pd.notnull(x) else 0)
-    
-    cols = [c for c in ['location_id', 'patientvisit_id', 'specimen_type', 'stored_time', 'checkin_user_id',  'days_since_stored', 'status', 'sent_to', 'checkout_time', 'checkout_user_id'] if c in df.columns]
-    res = df[cols].copy()
-    
-    # rename for display
-    rename_map = {
-        "location_id": "Location ID",
-        "patientvisit_id": "Patient-Visit ID",
-        "specimen_type": "Specimen Type",
-        "status": "Status",
-        "sent_to": "Sent To",
-        "stored_time": "Stored Time",
-        "days_since_stored": "Days Stored",
-        "checkout_time": "Checkout Time",
-        "checkin_user_id": "Check-in User",
-        "checkout_user_id": "Check-out User"
+    return inventory_query.format_page(inv, _activity_positions(inv), get_current_cst_time())
+
+def query_aliquots(status=None, specimen_type=None, patient_id=None, rack=None, stored_from=None, stored_to=None,
+                   sort_key="Latest Activity", descending=True, page=1, page_size=50):
+    """
+    One page of the inventory browser, filtered and sorted through the snapshot's indexes.
+    Only the rows on the page are materialized. Returns (page DataFrame, total matching rows).
+    """
+    inv = get_inventory()
+    if inv.aliquots.empty:
+        return pd.DataFrame(), 0
+    index = inventory_query.get_browse_index(inv)
+    positions, total = index.query(
+        sort_key=sort_key, descending=descending, page=page, page_size=page_size,
+        status=status, specimen_type=specimen_type, patient_id=patient_id, rack=rack,
+        stored_from=stored_from, stored_to=stored_to
+    )
+    return inventory_query.format_page(inv, positions, get_current_cst_time()), total
+
+def get_browse_options():
+    """Values for the inventory browser's filter dropdowns."""
+    inv = get_inventory()
+    if inv.aliquots.empty:
+        return {"status": [], "specimen_type": [], "rack": []}
+    index = inventory_query.get_browse_index(inv)
+    return {
+        "status": sorted(k for k in index.by_status if k),
+        "specimen_type": sorted(k for k in index.by_type if k),
+        "rack": sorted(index.by_rack),
     }
-    res.rename(columns=rename_map, inplace=True)
-    return res
 
-def upload_aliquots_data(df_up):
-    # This Google Sheets version of upload simply reads the entire aliquots sheet, merges in pandas, and pushes back
+def export_aliquots(fmt, columns=None, filters=None):
+    """Bytes of an inventory export; see exporter.export_aliquots for the options."""
+    return exporter.export_aliquots(get_inventory(), fmt, get_current_cst_time(), columns, filters)
+
+# Prefix match, like the re.match() the upload has always used
+LOCATION_PATTERN = r"^D(\d+)R(\d+)L(\d+)B(\d+)X(\d+)Y(\d+)"
+BOX_KEYS = ['door_num', 'rack_num', 'level_num', 'box_num']
+UPLOAD_COLUMNS = ['patientvisit_id', 'specimen_type', 'status', 'box_id', 'x_coord', 'y_coord']
+
+def upload_aliquots_data(df_up, user_email=""):
+    """
+    Merges an uploaded inventory CSV into the aliquots sheet: rows whose Location ID already
+    exists overwrite those records, new locations are inserted. If a location is listed
+    more than once, its last row wins.
+    Returns (success, message, rejects) where rejects is a DataFrame of skipped rows and why.
+    """
     required = ["Location ID", "Patient-Visit ID", "Specimen Type", "Status"]
     for col in required:
         if col not in df_up.columns:
-            return False, f"Missing required column: {col}"
-            
-    df_aliquots = get_sheet_data("aliquots")
+            return False, f"Missing required column: {col}", None
+
+    inserts, updates, rejects = upsert_aliquots(df_up, user_email)
+    msg = f"Successfully processed spreadsheet! Inserted: {inserts}, Updated: {updates}"
+    if not rejects.empty:
+        msg += f", Rejected: {len(rejects)}"
+    return True, msg, rejects
+
+@serialized_write
+def upsert_aliquots(df_up, user_email=""):
+    """
+    Commits the rows of an upload frame (validated columns); returns (inserts, updates, rejects).
+    Each inserted row, and each existing row whose values the upload changed, is logged as an event.
+    """
+    inv = get_inventory()
+    df_aliquots = inv.aliquots
     if df_aliquots.empty:
         df_aliquots = pd.DataFrame(columns=[
             "id", "location_id", "box_id", "x_coord", "y_coord", 
             "patientvisit_id", "specimen_type", "stored_time", "checkin_user_id",
             "days_since_stored", "status", "sent_to", "checkout_time", "checkout_user_id"
         ])
-    
-    df_boxes = get_sheet_data("boxes")
-    df_boxes['id'] = pd.to_numeric(df_boxes['id'])
-    
-    updates = 0
-    inserts = 0
-    
-    next_id = 1
-    if not df_aliquots.empty:
-        df_aliquots['id'] = pd.to_numeric(df_aliquots['id'])
-        next_id = int(df_aliquots['id'].max()) + 1
-        
-    for idx, row in df_up.iterrows():
-        loc_id = str(row["Location ID"]).strip()
-        pv_id = str(row["Patient-Visit ID"]).strip()
-        s_type = str(row["Specimen Type"]).strip()
-        status = str(row["Status"]).strip()
-        
-        m = re.match(r"D(\d+)R(\d+)L(\d+)B(\d+)X(\d+)Y(\d+)", loc_id)
-        if not m:
-            continue
-        d, r, l, b, x, y = [int(v) for v in m.groups()]
-        
-        box_match = df_boxes[
-            (df_boxes['door_num'] == str(d)) | (df_boxes['door_num'] == d) & 
-            (df_boxes['rack_num'] == str(r)) | (df_boxes['rack_num'] == r) &
-            (df_boxes['level_num'] == str(l)) | (df_boxes['level_num'] == l) &
-            (df_boxes['box_num'] == str(b)) | (df_boxes['box_num'] == b)
-        ]
-        
-        if box_match.empty:
-            continue
-            
-        box_id = int(box_match.iloc[0]['id'])
-        
-        existing_idx = df_aliquots[df_aliquots['location_id'] == loc_id].index
-        
-        if not existing_idx.empty:
-            df_aliquots.loc[existing_idx, ['patientvisit_id', 'specimen_type', 'status', 'box_id', 'x_coord', 'y_coord']] = \
-                [pv_id, s_type, status, box_id, x, y]
-            updates += 1
-        else:
-            new_row = pd.DataFrame([{
-                "id": next_id,
-                "location_id": loc_id,
-                "box_id": box_id,
-                "x_coord": x,
-                "y_coord": y,
-                "patientvisit_id": pv_id,
-                "specimen_type": s_type,
-                "stored_time": "",
-                "checkin_user_id": "",
-                "days_since_stored": 0,
-                "status": status,
-                "sent_to": "",
-                "checkout_time": "",
-                "checkout_user_id": ""
-            }])
-            df_aliquots = pd.concat([df_aliquots, new_row], ignore_index=True)
-            next_id += 1
-            inserts += 1
-
-    write_sheet_data("aliquots", df_aliquots)
-    
-    # Recalculate boxes
-    # This would usually be heavy on GSheets, but we only do this once on upload
-    for b_idx, b_row in df_boxes.iterrows():
-        b_id = b_row['id']
-        b_aliq = df_aliquots[df_aliquots['box_id'] == b_id]
-        if not b_aliq.empty:
-            count = len(b_aliq)
-            # Find most common type or max type
-            sp_type = b_aliq['specimen_type'].max()
-            df_boxes.loc[b_idx, 'spots_used'] = count
-            df_boxes.loc[b_idx, 'specimen_type'] = sp_type
-        else:
-            df_boxes.loc[b_idx, 'spots_used'] = 0
-            df_boxes.loc[b_idx, 'specimen_type'] = ""
-            
-    write_sheet_data("boxes", df_boxes)
-    
-    return True, f"Successfully processed spreadsheet! Inserted: {inserts}, Updated: {updates}"
+    df_boxes = inv.boxes.copy()
+
+    up = pd.DataFrame({
+        "row": range(1, len(df_up) + 1),
+        "location_id": df_up["Location ID"].astype(str).str.strip().values,
+        "patientvisit_id": df_up["Patient-Visit ID"].astype(str).str.strip().values,
+        "specimen_type": df_up["Specimen Type"].astype(str).str.strip().values,
+        "status": df_up["Status"].astype(str).str.strip().values,
+    })
+
+    # 1. Parse every Location ID at once and join to the box table on its position
+    parts = up['location_id'].str.extract(LOCATION_PATTERN).astype(float)
+    parts.columns = BOX_KEYS + ['x_coord', 'y_coord']
+    up = pd.concat([up, parts], axis=1)
+    box_lookup = df_boxes.drop_duplicates(BOX_KEYS)[BOX_KEYS + ['id']].rename(columns={'id': 'box_id'})
+    up = up.merge(box_lookup, on=BOX_KEYS, how='left')
+
+    bad_format = up['door_num'].isna()
+    no_box = ~bad_format & up['box_id'].isna()
+    rejected = bad_format | no_box
+    rejects = pd.DataFrame({
+        "Row": up.loc[rejected, 'row'],
+        "Location ID": up.loc[rejected, 'location_id'],
+        "Reason": ["Invalid Location ID format" if bad else "No box at that door/rack/level/box"
+                   for bad in bad_format[rejected]],
+    }).reset_index(drop=True)
+
+    valid = up[~rejected]
+    for col in ['box_id', 'x_coord', 'y_coord']:
+        valid = valid.assign(**{col: valid[col].astype(int)})
+    # One record per location: values from its last row, in order of its first appearance
+    first_seen = valid.drop_duplicates('location_id', keep='first')['location_id']
+    latest = valid.drop_duplicates('location_id', keep='last').set_index('location_id').loc[first_seen].reset_index()
+
+    # 2. Upsert: only the current row at a location is overwritten; older rows there are the
+    # history of tubes that used to hold the slot and stay as they were
+    df_all = df_aliquots.copy()
+    current = latest['location_id'].map(inv.latest_aliquot)
+    existing = current.notna().values
+    rows = df_all.index.get_indexer(current[existing].astype(int))
+    incoming = latest.loc[existing, UPLOAD_COLUMNS]
+    # Existing rows the upload actually changes, for the event log
+    overridden = np.zeros(len(df_all), dtype=bool)
+    for col in UPLOAD_COLUMNS:
+        before = storage.normalize_column(df_all[col].iloc[rows]).values
+        after = storage.normalize_column(incoming[col]).values
+        overridden[rows] |= before != after
+    changed_rows = np.flatnonzero(overridden)
+    if len(rows):
+        for col in UPLOAD_COLUMNS:
+            if df_all[col].dtype != incoming[col].dtype:
+                df_all[col] = df_all[col].astype(object)
+            df_all.iloc[rows, df_all.columns.get_loc(col)] = incoming[col].values
+
+    new = latest[~existing]
+    if not new.empty:
+        new_rows = pd.DataFrame({
+            "id": range(inv.next_aliquot_id, inv.next_aliquot_id + len(new)),
+            "location_id": new['location_id'].values,
+            "box_id": new['box_id'].values,
+            "x_coord": new['x_coord'].values,
+            "y_coord": new['y_coord'].values,
+            "patientvisit_id": new['patientvisit_id'].values,
+            "specimen_type": new['specimen_type'].values,
+            "stored_time": "",
+            "checkin_user_id": "",
+            "days_since_stored": 0,
+            "status": new['status'].values,
+            "sent_to": "",
+            "checkout_time": "",
+            "checkout_user_id": ""
+        })
+        df_all = pd.concat([df_all, new_rows], ignore_index=True) if not df_all.empty else new_rows
+    inserts = len(new)
+    updates = len(valid) - inserts
+
+    # 3. Recalculate boxes in one groupby: the "largest" specimen type present, as before
+    box_types = df_all['specimen_type'].fillna('').astype(str).groupby(pd.to_numeric(df_all['box_id'], errors='coerce')).max()
+    df_boxes['specimen_type'] = df_boxes['id'].map(box_types).fillna('')
+    # Spots used = taken cells per box, read off the occupancy grid of the merged data
+    grid = OccupancyGrid.from_frames(df_boxes, df_all)
+    df_boxes['spots_used'] = grid.counts()
+    # Counters move by the rows the upload changed: out with their old values, in with the new
+    stats = inv.stats.copy()
+    changed = df_all.iloc[changed_rows]
+    added = df_all.iloc[len(df_aliquots):]
+    stats.add_rows(df_aliquots.iloc[changed_rows], -1)
+    stats.add_rows(changed)
+    stats.add_rows(added)
+    stats.set_active_boxes(grid)
+
+    curr_time = get_current_cst_time().strftime("%Y-%m-%d %H:%M:%S")
+    first_id = _reserve_event_ids(stats, len(changed) + len(added))
+    df_events = pd.concat([
+        events.frame_from_aliquots(changed, first_id, curr_time, events.UPLOAD_OVERRIDE, user_email),
+        events.frame_from_aliquots(added, first_id + len(changed), curr_time, events.UPLOADED, user_email),
+    ], ignore_index=True)
+
+    write_sheets({"aliquots": df_all, "boxes": df_boxes, "stats": stats.to_frame()}, inv.revisions,
+                 appends={"events": df_events})
+    return inserts, updates, rejects
+
+# Every public function above is timed (see metrics.py and the admin panel's Performance section)
+metrics.instrument_module(globals(), "database", skip=("serialized_write", "get_current_cst_time"))
@@ -0,0 +1,100 @@
+import pandas as pd
+import storage
+
+# What happened to a tube. Every change to the aliquots sheet appends one of these,
+# in the same commit, so the log and the current state can't drift apart.
+STORED = "stored"
+CHECKED_OUT = "checked_out"
+RETURNED = "returned"
+CONSUMED = "consumed"
+UPLOADED = "uploaded"
+UPLOAD_OVERRIDE = "upload_override"
+
+EVENT_COLUMNS = storage.SHEET_COLUMNS["events"]
+
+HISTORY_COLUMNS = {
+    "time": "Time",
+    "event": "Event",
+    "status": "Status",
+    "user_id": "User",
+    "sent_to": "Sent To",
+    "patientvisit_id": "Patient-Visit ID",
+    "specimen_type": "Specimen Type",
+}
+
+EVENT_LABELS = {
+    STORED: "Stored",
+    CHECKED_OUT: "Checked out",
+    RETURNED: "Returned",
+    CONSUMED: "Consumed (slot released)",
+    UPLOADED: "Uploaded",
+    UPLOAD_OVERRIDE: "Overwritten by upload",
+}
+
+def status_event(new_status):
+    if new_status == 'Checked Out':
+        return CHECKED_OUT
+    return RETURNED if new_status == 'Stored' else CONSUMED
+
+class EventBatch:
+    """Events collected while a write is planned, numbered from the id reserved for them."""
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, time, event, row, user_id, sent_to=""):
+        # row is the aliquot's state after the event
+        self.rows.append({
+            "time": time,
+            "event": event,
+            "aliquot_id": row["id"],
+            "location_id": row["location_id"],
+            "patientvisit_id": row["patientvisit_id"],
+            "specimen_type": row["specimen_type"],
+            "status": row["status"],
+            "user_id": user_id,
+            "sent_to": sent_to,
+        })
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_frame(self, first_id):
+        df = pd.DataFrame(self.rows, columns=EVENT_COLUMNS[1:])
+        df.insert(0, "id", range(first_id, first_id + len(df)))
+        df["aliquot_id"] = pd.to_numeric(df["aliquot_id"], errors='coerce').astype("Int64")
+        return df
+
+def frame_from_aliquots(df, first_id, time, event, user_id):
+    """Events for many aliquot rows at once (e.g. an upload), in row order."""
+    return pd.DataFrame({
+        "id": range(first_id, first_id + len(df)),
+        "time": time,
+        "event": event,
+        "aliquot_id": pd.to_numeric(df["id"], errors='coerce').astype("Int64").values,
+        "location_id": df["location_id"].values,
+        "patientvisit_id": df["patientvisit_id"].values,
+        "specimen_type": df["specimen_type"].values,
+        "status": df["status"].values,
+        "user_id": user_id,
+        "sent_to": df["sent_to"].fillna("").values if "sent_to" in df.columns else "",
+    }, columns=EVENT_COLUMNS)
+
+def _ordered(df_events):
+    return df_events.assign(id=pd.to_numeric(df_events["id"], errors='coerce')).sort_values("id", kind="stable")
+
+def history(df_events, location_id):
+    """Every event recorded at a location, oldest first, for display."""
+    if df_events.empty or "location_id" not in df_events.columns:
+        return pd.DataFrame(columns=list(HISTORY_COLUMNS.values()))
+    df = _ordered(df_events[df_events["location_id"] == location_id])
+    df = df.assign(event=df["event"].map(EVENT_LABELS).fillna(df["event"]))
+    return df[list(HISTORY_COLUMNS)].rename(columns=HISTORY_COLUMNS).reset_index(drop=True)
+
+def current_state(df_events):
+    """Status each aliquot was left in by its most recent event, indexed by aliquot id."""
+    if df_events.empty or "aliquot_id" not in df_events.columns:
+        return pd.DataFrame(columns=["location_id", "status", "time"])
+    df = _ordered(df_events)
+    df = df.assign(aliquot_id=pd.to_numeric(df["aliquot_id"], errors='coerce'))
+    return df.drop_duplicates("aliquot_id", keep="last").set_index("aliquot_id")[["location_id", "status", "time"]]
@@ -0,0 +1,110 @@
+import io
+import threading
+from collections import OrderedDict
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import inventory_query
+
+try:
+    import xlsxwriter
+except ImportError:  # optional: Excel export is only offered when it's installed
+    xlsxwriter = None
+
+BATCH_ROWS = 50000
+# Finished exports kept per inventory snapshot
+MAX_CACHED_EXPORTS = 4
+
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+_cache_lock = threading.Lock()
+
+def available_formats():
+    return [f for f in EXPORT_FORMATS if f != "Excel" or xlsxwriter is not None]
+
+def export_columns():
+    return list(inventory_query.DISPLAY_COLUMNS.values())
+
+def _batches(inv, columns, filters, now, batch_rows):
+    # Rows in the browser's default order, materialized batch_rows at a time
+    index = inventory_query.get_browse_index(inv)
+    positions = index.candidates(**filters)
+    order = index.order("Latest Activity")
+    if positions is not None:
+        positions = positions[np.argsort(index.rank("Latest Activity")[positions], kind='stable')]
+    else:
+        positions = order
+    for start in range(0, max(len(positions), 1), batch_rows):
+        batch = inventory_query.format_page(inv, positions[start:start + batch_rows], now)
+        yield batch[[c for c in columns if c in batch.columns]]
+
+def _write_csv(batches):
+    out = io.BytesIO()
+    for i, batch in enumerate(batches):
+        out.write(batch.to_csv(index=False, header=(i == 0)).encode('utf-8'))
+    return out.getvalue()
+
+def _write_parquet(batches):
+    out = io.BytesIO()
+    writer = None
+    for batch in batches:
+        # Text columns as plain strings so every batch has the same schema
+        text_cols = [col for col in batch.columns if col != "Days Stored"]
+        batch = batch.assign(**{col: batch[col].fillna('').astype(str) for col in text_cols})
+        table = pa.Table.from_pandas(batch, preserve_index=False, schema=writer.schema if writer else None)
+        if writer is None:
+            writer = pq.ParquetWriter(out, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+    return out.getvalue()
+
+def _write_xlsx(batches):
+    out = io.BytesIO()
+    # constant_memory flushes each row to disk as it's written instead of holding the sheet
+    workbook = xlsxwriter.Workbook(out, {'constant_memory': True, 'in_memory': False})
+    sheet = workbook.add_worksheet("Inventory")
+    row = 0
+    for batch in batches:
+        if row == 0:
+            sheet.write_row(0, 0, list(batch.columns))
+            row = 1
+        for values in batch.itertuples(index=False, name=None):
+            sheet.write_row(row, 0, values)
+            row += 1
+    workbook.close()
+    return out.getvalue()
+
+WRITERS = {"CSV": _write_csv, "Parquet": _write_parquet, "Excel": _write_xlsx}
+
+def export_aliquots(inv, fmt, now, columns=None, filters=None, batch_rows=BATCH_ROWS):
+    """
+    Builds an export of the aliquots in `fmt` (a key of EXPORT_FORMATS), optionally limited to
+    some display columns and to the rows matching inventory-browser filters.
+    Rows are streamed into the writer in batches. Finished exports are cached on the inventory
+    snapshot, so downloading the same export of unchanged data again costs nothing.
+    """
+    if fmt not in available_formats():
+        raise ValueError(f"Export format not available: {fmt}")
+    columns = list(columns or export_columns())
+    filters = {k: v for k, v in (filters or {}).items() if v is not None}
+    # Days Stored changes with the date, so the date is part of what's cached
+    key = (fmt, tuple(columns), tuple(sorted((k, str(v)) for k, v in filters.items())), str(now.date()))
+
+    with _cache_lock:
+        if inv.exports is None:
+            inv.exports = OrderedDict()
+        if key in inv.exports:
+            inv.exports.move_to_end(key)
+            return inv.exports[key]
+
+    data = WRITERS[fmt](_batches(inv, columns, filters, now, batch_rows))
+    with _cache_lock:
+        inv.exports[key] = data
+        while len(inv.exports) > MAX_CACHED_EXPORTS:
+            inv.exports.popitem(last=False)
+    return data
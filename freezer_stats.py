@@ -0,0 +1,125 @@
+import pandas as pd
+from occupancy import OccupancyGrid
+
+STORED_TYPE_PREFIX = "stored:"
+# Id counters kept alongside the statistics (not derived from the inventory), e.g. "seq:events"
+SEQUENCE_PREFIX = "seq:"
+
+class FreezerStats:
+    """
+    Dashboard counters persisted as key/value rows in the `stats` sheet, so reading them
+    doesn't touch the boxes or aliquots sheets. Writers update a copy alongside their
+    data and commit it in the same write; from_frames() is the full recompute used to
+    seed, verify and repair them.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+
+    @classmethod
+    def from_frames(cls, df_boxes, df_aliquots, grid=None):
+        if grid is None:
+            grid = OccupancyGrid.from_frames(df_boxes, df_aliquots)
+        stats = cls({
+            "total_boxes": len(grid.box_ids),
+            "active_boxes": grid.active_boxes(),
+            "stored": 0,
+            "checked_out": 0,
+        })
+        if not df_aliquots.empty and 'status' in df_aliquots.columns:
+            stored = df_aliquots[df_aliquots['status'] == 'Stored']
+            stats.counts["stored"] = len(stored)
+            stats.counts["checked_out"] = int((df_aliquots['status'] == 'Checked Out').sum())
+            for s_type, n in stored['specimen_type'].value_counts().items():
+                stats.counts[STORED_TYPE_PREFIX + str(s_type)] = int(n)
+        return stats
+
+    @classmethod
+    def from_sheet(cls, df):
+        """None if the sheet is missing or was never seeded."""
+        if df.empty or 'key' not in df.columns or 'value' not in df.columns:
+            return None
+        values = pd.to_numeric(df['value'], errors='coerce').fillna(0).astype(int)
+        return cls(dict(zip(df['key'].astype(str), values.tolist())))
+
+    def to_frame(self):
+        # Types with nothing stored are dropped, like value_counts() would
+        items = [(k, int(v)) for k, v in self.counts.items() if not (k.startswith(STORED_TYPE_PREFIX) and v == 0)]
+        return pd.DataFrame(items, columns=["key", "value"])
+
+    def copy(self):
+        return FreezerStats(self.counts)
+
+    def _add(self, key, n):
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def _count_status(self, status, specimen_type, n):
+        if status == 'Stored':
+            self._add("stored", n)
+            if not pd.isna(specimen_type):
+                self._add(STORED_TYPE_PREFIX + str(specimen_type), n)
+        elif status == 'Checked Out':
+            self._add("checked_out", n)
+
+    def add_aliquots(self, status, specimen_type, n=1):
+        self._count_status(status, specimen_type, n)
+
+    def change_status(self, specimen_type, old_status, new_status):
+        self._count_status(old_status, specimen_type, -1)
+        self._count_status(new_status, specimen_type, 1)
+
+    def add_rows(self, df_aliquots, n=1):
+        """Counts every row of an aliquots frame n times (n=-1 takes them back out)."""
+        counts = df_aliquots.groupby(['status', 'specimen_type'], dropna=False).size()
+        for (status, specimen_type), rows in counts.items():
+            self._count_status(status, specimen_type, n * int(rows))
+
+    def reserve_ids(self, name, n, start=1):
+        """First of n consecutive ids from the `name` sequence; `start` if it has none yet."""
+        key = SEQUENCE_PREFIX + name
+        first = self.counts.get(key, start)
+        self.counts[key] = first + n
+        return first
+
+    def has_sequence(self, name):
+        return SEQUENCE_PREFIX + name in self.counts
+
+    def sequence(self, name, default=0):
+        return self.counts.get(SEQUENCE_PREFIX + name, default)
+
+    def set_sequence(self, name, value):
+        self.counts[SEQUENCE_PREFIX + name] = value
+
+    def carry_sequences(self, other):
+        # A recompute from the frames knows nothing about the id counters, so keep other's
+        for k, v in other.counts.items():
+            if k.startswith(SEQUENCE_PREFIX):
+                self.counts[k] = v
+
+    def set_active_boxes(self, grid):
+        self.counts["active_boxes"] = grid.active_boxes()
+        self.counts["total_boxes"] = len(grid.box_ids)
+
+    def as_dict(self):
+        """Same shape database.get_freezer_stats() has always returned."""
+        total_boxes = self.counts.get("total_boxes", 0)
+        active_boxes = self.counts.get("active_boxes", 0)
+        return {
+            'total_boxes': total_boxes,
+            'active_boxes': active_boxes,
+            'empty_boxes': total_boxes - active_boxes,
+            'total_aliquots_stored': self.counts.get("stored", 0),
+            'total_aliquots_checked_out': self.counts.get("checked_out", 0),
+            # Most common first, as value_counts() ordered them
+            'type_counts_stored': dict(sorted(
+                ((k[len(STORED_TYPE_PREFIX):], v) for k, v in self.counts.items()
+                 if k.startswith(STORED_TYPE_PREFIX) and v > 0),
+                key=lambda kv: -kv[1]
+            ))
+        }
+
+    def diff(self, other):
+        """{key: (self value, other value)} for every counter that differs (id sequences aside)."""
+        keys = {k for k in set(self.counts) | set(other.counts) if not k.startswith(SEQUENCE_PREFIX)}
+        return {k: (self.counts.get(k, 0), other.counts.get(k, 0)) for k in sorted(keys)
+                if self.counts.get(k, 0) != other.counts.get(k, 0)}
@@ -0,0 +1,281 @@
+import re
+import copy
+import numpy as np
+import pandas as pd
+from occupancy import OccupancyGrid
+from freezer_stats import FreezerStats
+
+def extract_patient_id(pv_id):
+    for delim in ['-', '_', ' ']:
+        if delim in pv_id:
+            return pv_id.rsplit(delim, 1)[0]
+    m = re.match(r"^(.*?)(\d+)$", pv_id)
+    if m:
+        return m.group(1)
+    return pv_id
+
+def _to_numeric(df, cols, fill=None):
+    for col in cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+            if fill is not None:
+                df[col] = df[col].fillna(fill)
+
+def _group_labels(df, series):
+    # key -> array of index labels, computed in one pass instead of a boolean mask per lookup
+    positions = series.groupby(series.values, sort=False).indices
+    labels = df.index.values
+    return {k: labels[v] for k, v in positions.items()}
+
+def parse_times(df, col):
+    # Timestamps are stored as text; parsed once per snapshot into datetime64 (NaT if blank)
+    if col not in df.columns:
+        return np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+    return pd.to_datetime(df[col], errors='coerce').values.astype('datetime64[ns]')
+
+def latest_times(stored_ts, checkout_ts):
+    # The later of the two, i.e. the row's most recent check-in or check-out
+    return np.where(
+        np.isnat(checkout_ts) | (~np.isnat(stored_ts) & (stored_ts >= checkout_ts)),
+        stored_ts, checkout_ts
+    )
+
+_EMPTY = np.array([], dtype=object)
+
+# Columns that place a tube and feed the indexes; an update touching them needs a full rebuild
+_PLACEMENT_COLUMNS = ['id', 'location_id', 'box_id', 'x_coord', 'y_coord', 'patientvisit_id', 'specimen_type']
+
+def _append_labels(index, groups):
+    # Copy of a key -> labels index with more labels added, leaving the original untouched
+    index = dict(index)
+    for key, labels in groups.items():
+        index[key] = np.concatenate([index[key], labels]) if key in index else labels
+    return index
+
+def _patch_times(old, df, col, rows, n_old):
+    # old parsed timestamps with rows re-parsed and the appended rows (from n_old on) added
+    out = np.concatenate([old, parse_times(df.iloc[n_old:], col)])
+    if len(rows):
+        out[rows] = parse_times(df.iloc[rows], col)
+    return out
+
+class Inventory:
+    """
+    Typed, indexed snapshot of the users, boxes and aliquots sheets.
+    Built once per cache refresh and shared by every session, so treat the frames
+    as read-only and .copy() them before making changes to write back.
+    """
+
+    def __init__(self, df_users, df_boxes, df_aliquots, df_stats=None):
+        self.users = df_users.copy()
+        self.boxes = df_boxes.copy()
+        self.aliquots = df_aliquots.copy()
+        # Storage revision of each sheet this snapshot was built from, for optimistic writes
+        self.revisions = {
+            "users": df_users.attrs.get("revision"),
+            "boxes": df_boxes.attrs.get("revision"),
+            "aliquots": df_aliquots.attrs.get("revision"),
+            "stats": df_stats.attrs.get("revision") if df_stats is not None else None,
+        }
+
+        _to_numeric(self.users, ['checkin_count', 'checkout_count'], fill=0)
+        _to_numeric(self.boxes, ['id', 'door_num', 'rack_num', 'level_num', 'box_num'])
+        _to_numeric(self.boxes, ['spots_used'], fill=0)
+        _to_numeric(self.aliquots, ['id', 'box_id', 'x_coord', 'y_coord'])
+
+        # email -> row label (first match wins, like the old .iloc[0] lookup)
+        self.user_index = {}
+        if 'email' in self.users.columns:
+            first = self.users.drop_duplicates('email', keep='first')
+            self.user_index = dict(zip(first['email'], first.index))
+
+        self.box_index = {}
+        if 'id' in self.boxes.columns:
+            self.box_index = dict(zip(self.boxes['id'], self.boxes.index))
+
+        self.location_index = {}
+        self.visit_index = {}
+        self.patient_index = {}
+        self.box_aliquots = {}
+        self.patient_ids = pd.Series(dtype=object)
+        # patient_id -> {patientvisit_id -> set(box_id)} and (patientvisit_id, type) -> first box used
+        self.patient_boxes = {}
+        self.visit_type_boxes = {}
+        # Allocation capacity structure, built lazily by allocation.get_capacity_index
+        self.capacity = None
+        # Inventory browser indexes, built lazily by inventory_query.get_browse_index
+        self.browse = None
+        # Finished exports of this snapshot, see exporter.export_aliquots
+        self.exports = None
+        self.next_aliquot_id = 1
+
+        df = self.aliquots
+        if not df.empty and 'location_id' in df.columns:
+            # location_id -> label of the row with the highest id, i.e. the tube currently in that slot
+            latest = df.sort_values('id', kind='stable', na_position='first').drop_duplicates('location_id', keep='last')
+            self.location_index = dict(zip(latest['location_id'], latest.index))
+
+            pv = df['patientvisit_id'].astype(str)
+            self.visit_index = _group_labels(df, pv)
+            # Patient-visit IDs repeat for every tube, so only parse each distinct one
+            uniques = pv.unique()
+            pat_map = dict(zip(uniques, [extract_patient_id(u) for u in uniques]))
+            self.patient_ids = pv.map(pat_map)
+            self.patient_index = _group_labels(df, self.patient_ids)
+            self.box_aliquots = _group_labels(df, df['box_id'])
+
+            triples = pd.DataFrame({'pat': self.patient_ids, 'pv': pv, 'box': df['box_id']}).drop_duplicates()
+            for pat, v, b in triples.itertuples(index=False, name=None):
+                self.patient_boxes.setdefault(pat, {}).setdefault(v, set()).add(b)
+            first = pd.DataFrame({'pv': pv, 'type': df['specimen_type'], 'box': df['box_id']}).drop_duplicates(['pv', 'type'], keep='first')
+            self.visit_type_boxes = dict(zip(zip(first['pv'], first['type']), first['box']))
+
+            if df['id'].notna().any():
+                self.next_aliquot_id = int(df['id'].max()) + 1
+
+        # Typed copies of the text timestamps, row-aligned with self.aliquots
+        self.stored_ts = parse_times(self.aliquots, 'stored_time')
+        self.checkout_ts = parse_times(self.aliquots, 'checkout_time')
+        self.latest_ts = latest_times(self.stored_ts, self.checkout_ts)
+
+        # Which X/Y cells are taken (see occupancy.holds_slot); boxes.spots_used is derived from it rather than trusted
+        self.grid = OccupancyGrid.from_frames(self.boxes, self.aliquots)
+        if 'spots_used' in self.boxes.columns:
+            self.boxes['spots_used'] = self.grid.counts()
+
+        # Persisted dashboard counters; recomputed here (and written back by the next write) if never seeded
+        self.stats = FreezerStats.from_sheet(df_stats) if df_stats is not None else None
+        if self.stats is None:
+            self.stats = FreezerStats.from_frames(self.boxes, self.aliquots, self.grid)
+
+    def updated(self, frames, aliquot_delta=None):
+        """
+        The Inventory after one of our own commits: frames ({sheet_name: committed snapshot})
+        replace those sheets, and only the aliquot rows in aliquot_delta (storage.compute_delta
+        against self.aliquots) are re-indexed; everything else is shared with self, which stays
+        as it was for sessions still using it. Returns None when the change can't be applied
+        row by row (whole-sheet write, deleted or reordered rows, moved tubes, different boxes),
+        and a fresh Inventory has to be built instead.
+        """
+        inv = copy.copy(self)
+        inv.revisions = dict(self.revisions)
+        for sheet_name, df in frames.items():
+            inv.revisions[sheet_name] = df.attrs.get("revision")
+
+        if 'users' in frames:
+            inv.users = frames['users'].copy()
+            _to_numeric(inv.users, ['checkin_count', 'checkout_count'], fill=0)
+            inv.user_index = {}
+            if 'email' in inv.users.columns:
+                first = inv.users.drop_duplicates('email', keep='first')
+                inv.user_index = dict(zip(first['email'], first.index))
+
+        if 'stats' in frames:
+            inv.stats = FreezerStats.from_sheet(frames['stats'])
+            if inv.stats is None:
+                return None
+
+        if 'aliquots' not in frames and 'boxes' not in frames:
+            return inv
+
+        boxes = frames.get('boxes', self.boxes).copy()
+        _to_numeric(boxes, ['id', 'door_num', 'rack_num', 'level_num', 'box_num'])
+        _to_numeric(boxes, ['spots_used'], fill=0)
+        if 'id' not in boxes.columns or boxes['id'].tolist() != self.grid.box_ids:
+            return None
+        inv.boxes = boxes
+        inv.box_index = dict(zip(boxes['id'], boxes.index))
+        inv.capacity = None
+        inv.browse = None
+        inv.exports = None
+        inv.grid = self.grid.copy()
+
+        if 'aliquots' in frames:
+            if not inv._apply_aliquot_delta(frames['aliquots'], aliquot_delta):
+                return None
+
+        if 'spots_used' in inv.boxes.columns:
+            inv.boxes['spots_used'] = inv.grid.counts()
+        return inv
+
+    def _apply_aliquot_delta(self, df, delta):
+        old = self.aliquots
+        n_old = len(old)
+        if delta is None or delta['deletes'] or old.empty or 'location_id' not in old.columns:
+            return False
+        if list(df.columns) != list(old.columns) or len(df) != n_old + len(delta['inserts']):
+            return False
+        if not old.index.equals(pd.RangeIndex(n_old)):
+            return False
+        # Shares the committed snapshot's columns; _to_numeric replaces rather than modifies them
+        df = df.reset_index(drop=True).copy(deep=False)
+        _to_numeric(df, ['id', 'box_id', 'x_coord', 'y_coord'])
+        if not df['id'].iloc[:n_old].equals(old['id']):
+            return False
+        rows = np.array(sorted(pos for pos, _ in delta['updates']), dtype=int)
+        if len(rows) and not df[_PLACEMENT_COLUMNS].iloc[rows].equals(old[_PLACEMENT_COLUMNS].iloc[rows]):
+            return False
+
+        self.aliquots = df
+        added = df.iloc[n_old:]
+        if not added.empty:
+            ids = df['id'].to_numpy()
+            self.location_index = dict(self.location_index)
+            for location_id, label in zip(added['location_id'], added.index):
+                # Same rule as the full build: the highest id wins, NaN ids lose
+                current = self.location_index.get(location_id)
+                if current is None or ids[current] != ids[current] or ids[label] >= ids[current]:
+                    self.location_index[location_id] = label
+
+            pv = added['patientvisit_id'].astype(str)
+            uniques = pv.unique()
+            pat_map = dict(zip(uniques, [extract_patient_id(u) for u in uniques]))
+            patient_ids = pv.map(pat_map)
+            self.visit_index = _append_labels(self.visit_index, _group_labels(added, pv))
+            self.patient_index = _append_labels(self.patient_index, _group_labels(added, patient_ids))
+            self.box_aliquots = _append_labels(self.box_aliquots, _group_labels(added, added['box_id']))
+            self.patient_ids = pd.concat([self.patient_ids, patient_ids])
+
+            self.patient_boxes = dict(self.patient_boxes)
+            copied = set()
+            triples = pd.DataFrame({'pat': patient_ids, 'pv': pv, 'box': added['box_id']}).drop_duplicates()
+            for pat, v, b in triples.itertuples(index=False, name=None):
+                if pat not in copied:
+                    self.patient_boxes[pat] = {k: set(s) for k, s in self.patient_boxes.get(pat, {}).items()}
+                    copied.add(pat)
+                self.patient_boxes[pat].setdefault(v, set()).add(b)
+            self.visit_type_boxes = dict(self.visit_type_boxes)
+            for key, b in zip(zip(pv, added['specimen_type']), added['box_id']):
+                self.visit_type_boxes.setdefault(key, b)
+
+            if added['id'].notna().any():
+                self.next_aliquot_id = max(self.next_aliquot_id, int(added['id'].max()) + 1)
+
+        self.stored_ts = _patch_times(self.stored_ts, df, 'stored_time', rows, n_old)
+        self.checkout_ts = _patch_times(self.checkout_ts, df, 'checkout_time', rows, n_old)
+        self.latest_ts = latest_times(self.stored_ts, self.checkout_ts)
+
+        # Only the boxes holding touched rows can have changed cells
+        touched = pd.concat([df['box_id'].iloc[rows], added['box_id']]).dropna().unique()
+        labels = [self.aliquots_in_box(b) for b in touched]
+        if labels:
+            self.grid.refresh(touched, df.loc[np.concatenate(labels)])
+        return True
+
+    def find_user(self, email):
+        return self.user_index.get(email)
+
+    def find_box(self, box_id):
+        return self.box_index.get(box_id)
+
+    def latest_aliquot(self, location_id):
+        return self.location_index.get(location_id)
+
+    def aliquots_for_visit(self, patientvisit_id):
+        return self.visit_index.get(patientvisit_id, _EMPTY)
+
+    def aliquots_for_patient(self, patient_id):
+        return self.patient_index.get(patient_id, _EMPTY)
+
+    def aliquots_in_box(self, box_id):
+        return self.box_aliquots.get(box_id, _EMPTY)
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+# Sort keys offered by the inventory browser
+SORT_KEYS = ["Latest Activity", "Stored Time", "Location ID", "Patient-Visit ID"]
+
+DISPLAY_COLUMNS = {
+    "location_id": "Location ID",
+    "patientvisit_id": "Patient-Visit ID",
+    "specimen_type": "Specimen Type",
+    "stored_time": "Stored Time",
+    "checkin_user_id": "Check-in User",
+    "days_since_stored": "Days Stored",
+    "status": "Status",
+    "sent_to": "Sent To",
+    "checkout_time": "Checkout Time",
+    "checkout_user_id": "Check-out User"
+}
+
+def _positions(series):
+    # value -> sorted row positions, one pass over the column
+    return {k: np.asarray(v) for k, v in series.groupby(series.values, sort=False).indices.items()}
+
+def days_stored(stored_ts, now):
+    """Whole days from each stored timestamp to now, 0 where there is none."""
+    days = (np.datetime64(now) - stored_ts).astype('timedelta64[D]').astype('float')
+    return np.where(np.isnat(stored_ts), 0, days).astype(int)
+
+class BrowseIndex:
+    """
+    Row-position indexes over one aliquots snapshot for the paginated inventory browser:
+    one per filterable column, stored times in sorted order for date ranges, and a
+    precomputed row order per sort key. A query only intersects position arrays and
+    materializes the rows of the page being shown.
+    """
+
+    def __init__(self, inv):
+        df = inv.aliquots
+        self.df = df
+        self.size = len(df)
+        self.by_status = _positions(df['status'].fillna('').astype(str)) if 'status' in df.columns else {}
+        self.by_type = _positions(df['specimen_type'].fillna('').astype(str)) if 'specimen_type' in df.columns else {}
+        self.by_patient = _positions(inv.patient_ids) if len(inv.patient_ids) else {}
+
+        self.by_rack = {}
+        if 'box_id' in df.columns and 'rack_num' in inv.boxes.columns:
+            racks = df['box_id'].map(dict(zip(inv.boxes['id'], inv.boxes['rack_num'])))
+            self.by_rack = _positions(racks.fillna(-1).astype(int))
+            self.by_rack.pop(-1, None)
+
+        self.stored_ts = inv.stored_ts
+        self.latest_ts = inv.latest_ts
+        # Dates in one sorted array so a date range is two binary searches
+        self.stored_order = np.argsort(self.stored_ts, kind='stable')
+        self.stored_sorted = self.stored_ts[self.stored_order]
+        self.orders = {}
+        self.ranks = {}
+
+    def order(self, sort_key, descending=True):
+        """
+        Row positions in sort_key order, empty values last either way round (like sort_values),
+        ties by id in the same direction.
+        """
+        key = (sort_key, descending)
+        if key not in self.orders:
+            ids = pd.to_numeric(self.df['id'], errors='coerce').fillna(0).values if 'id' in self.df.columns else np.zeros(self.size)
+            if sort_key == "Latest Activity":
+                values = self.latest_ts
+            elif sort_key == "Stored Time":
+                values = self.stored_ts
+            else:
+                col = "location_id" if sort_key == "Location ID" else "patientvisit_id"
+                values = self.df[col].fillna('').astype(str).values
+            sign = -1 if descending else 1
+            if np.issubdtype(np.asarray(values).dtype, np.datetime64):
+                missing = np.isnat(values)
+                order = np.lexsort((sign * ids, sign * values.astype('int64'), missing))
+            else:
+                missing = values == ''
+                ranks = pd.Series(values).rank(method='dense', ascending=not descending).values
+                order = np.lexsort((sign * ids, ranks, missing))
+            self.orders[key] = order
+            rank = np.empty(self.size, dtype=np.int64)
+            rank[order] = np.arange(self.size)
+            self.ranks[key] = rank
+        return self.orders[key]
+
+    def rank(self, sort_key, descending=True):
+        """Each row's place in order(sort_key, descending), by row position."""
+        self.order(sort_key, descending)
+        return self.ranks[(sort_key, descending)]
+
+    def candidates(self, status=None, specimen_type=None, patient_id=None, rack=None, stored_from=None, stored_to=None):
+        """Sorted row positions matching every given filter, or None when nothing is filtered."""
+        result = None
+
+        def narrow(current, positions):
+            if current is None:
+                return positions
+            return np.intersect1d(current, positions, assume_unique=True)
+
+        empty = np.array([], dtype=np.int64)
+        if status:
+            result = narrow(result, self.by_status.get(status, empty))
+        if specimen_type:
+            result = narrow(result, self.by_type.get(specimen_type, empty))
+        if patient_id:
+            result = narrow(result, self.by_patient.get(patient_id, empty))
+        if rack is not None:
+            result = narrow(result, self.by_rack.get(int(rack), empty))
+        if stored_from is not None or stored_to is not None:
+            lo = 0
+            hi = np.searchsorted(self.stored_sorted, np.datetime64('NaT'), side='left') if len(self.stored_sorted) else 0
+            if stored_from is not None:
+                lo = np.searchsorted(self.stored_sorted[:hi], np.datetime64(pd.Timestamp(stored_from)), side='left')
+            if stored_to is not None:
+                # The end date is inclusive of the whole day
+                end = np.datetime64(pd.Timestamp(stored_to) + pd.Timedelta(days=1))
+                hi = np.searchsorted(self.stored_sorted[:hi], end, side='left')
+            result = narrow(result, np.sort(self.stored_order[lo:hi]))
+        return result
+
+    def query(self, sort_key="Latest Activity", descending=True, page=1, page_size=50, **filters):
+        """Returns (row positions of the requested page, total matching rows)."""
+        start = (page - 1) * page_size
+        cand = self.candidates(**filters)
+        if cand is None:
+            return self.order(sort_key, descending)[start:start + page_size], self.size
+
+        ranked = cand[np.argsort(self.rank(sort_key, descending)[cand], kind='stable')]
+        return ranked[start:start + page_size], len(cand)
+
+def get_browse_index(inv):
+    # Built once per inventory snapshot, on first use, and shared by every session
+    if inv.browse is None:
+        inv.browse = BrowseIndex(inv)
+    return inv.browse
+
+def format_page(inv, positions, now):
+    """The display frame for the given row positions, with Days Stored computed just for them."""
+    df = inv.aliquots.iloc[positions]
+    if 'stored_time' in df.columns:
+        df = df.assign(days_since_stored=days_stored(inv.stored_ts[positions], now))
+    cols = [c for c in DISPLAY_COLUMNS if c in df.columns]
+    return df[cols].rename(columns=DISPLAY_COLUMNS)
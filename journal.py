@@ -0,0 +1,249 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime
+import database
+import storage
+from occupancy import RELEASED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 2.0
+MAX_BATCH = 200
+
+def dead_letter_path(path):
+    # scan_journal.jsonl -> scan_journal.dead.jsonl
+    root, ext = os.path.splitext(path)
+    return root + ".dead" + (ext or ".jsonl")
+
+class ScanJournal:
+    """
+    Append-only, fsync'd journal of check-in/checkout scans with a background flusher.
+    A scan is acknowledged as soon as its line is on disk; the flusher then applies every
+    queued scan with one write per sheet and drops the flushed lines from the file.
+    Lines left in the file when the server stops are replayed on the next start.
+
+    Every scan has a sequence number, and the highest one applied is recorded in the stats
+    sheet in the same commit as the scans, so a replay after a crash between that commit and
+    the trimming of the file skips what was already applied. A scan that can't be applied on
+    its own (e.g. its record is broken) is moved to the dead-letter file for an admin to
+    review, instead of holding up every scan queued after it.
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self.path = path
+        self.dead_path = dead_letter_path(path)
+        # Names this journal's sequence in the stats sheet; one journal per server and path
+        where = f"{socket.gethostname()}:{os.path.abspath(path)}"
+        self.key = "journal:" + hashlib.sha1(where.encode("utf-8")).hexdigest()[:12]
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = []
+        # location_id -> status of its latest queued scan, so repeated scans toggle correctly
+        self.latest_status = {}
+        self.seq = 0
+        self.thread = None
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-append; the scan was never acknowledged
+                        continue
+                    self.seq = max(self.seq, record["seq"])
+                    if "location_id" not in record:
+                        # Header kept by _rewrite so the numbering carries on past flushed scans
+                        continue
+                    self.pending.append(record)
+                    self.latest_status[record["location_id"]] = record["status"]
+        try:
+            # New scans must number above anything already applied, or a replay would skip them
+            self.seq = max(self.seq, database.get_journal_seq(self.key))
+        except Exception:
+            logger.exception("Could not read the applied scan sequence; numbering from the journal file")
+        if self.pending:
+            logger.info("Replaying %d journaled scans from %s", len(self.pending), self.path)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="scan-journal-flusher", daemon=True)
+            self.thread.start()
+            # Anything replayed from disk goes out straight away
+            if self.pending:
+                self.wake.set()
+
+    def _append(self, location_id, new_status, user_email, sent_to, curr_time):
+        # Caller holds self.lock
+        self.seq += 1
+        record = {
+            "seq": self.seq,
+            "location_id": location_id,
+            "status": new_status,
+            "user": user_email,
+            "sent_to": sent_to,
+            "time": curr_time,
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending.append(record)
+        self.latest_status[location_id] = new_status
+        if len(self.pending) >= self.max_batch:
+            self.wake.set()
+
+    def toggle(self, location_id, user_email, sent_to, curr_time):
+        """
+        Journals a toggle of the tube, starting from its latest queued scan or, if none is
+        queued, from its status in the inventory. Returns (success, message, new_status)
+        like database.toggle_aliquot_status.
+        """
+        with self.lock:
+            # Read under the lock: a flush clears latest_status only after its write has
+            # reached the inventory, so the scan sees one or the other, never neither
+            inv = database.get_inventory()
+            latest_idx = inv.latest_aliquot(location_id)
+            if latest_idx is None:
+                return False, "Aliquot not found.", None
+            stored_status = inv.aliquots.loc[latest_idx, 'status']
+            if stored_status in RELEASED_STATUSES:
+                return False, f"This tube was marked {stored_status} and its slot released; it can't be checked back in.", None
+            # Scans still in the journal take precedence over the (possibly older) inventory status
+            curr_status = self.latest_status.get(location_id, stored_status)
+            new_status = 'Checked Out' if curr_status == 'Stored' else 'Stored'
+            self._append(location_id, new_status, user_email, sent_to, curr_time)
+        return True, f"Aliquot toggled successfully. New Status: **{new_status}**", new_status
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
+
+    def _apply(self, batch):
+        """
+        Applies a batch in seq order, splitting it in halves when it fails so one bad scan
+        can't hold up the rest. Returns [(record, error)] for scans that fail on their own.
+        Raises, keeping the remaining scans queued, when the storage itself is failing.
+        """
+        try:
+            database.apply_journal(self.key, [
+                (r["seq"], r["location_id"], r["status"], r["user"], r["sent_to"], r["time"]) for r in batch
+            ])
+            return []
+        except storage.ConflictError:
+            # Still conflicting after the write retries: try again on the next tick
+            raise
+        except Exception as e:
+            if len(batch) > 1:
+                mid = len(batch) // 2
+                return self._apply(batch[:mid]) + self._apply(batch[mid:])
+            # The storage takes a write without this scan (or this raises), so the scan is the problem
+            database.apply_journal(self.key, [])
+            return [(batch[0], e)]
+
+    def flush(self):
+        """Applies every queued scan in one batch. Returns how many were flushed."""
+        with self.flush_lock:
+            with self.lock:
+                batch = list(self.pending)
+            if not batch:
+                return 0
+            failed = self._apply(batch)
+            last_seq = batch[-1]["seq"]
+            with self.lock:
+                if failed:
+                    logger.error("Moved %d journaled scan(s) that could not be applied to %s", len(failed), self.dead_path)
+                    self._dead_letter(failed)
+                self.pending = [r for r in self.pending if r["seq"] > last_seq]
+                # The sheets (and the caches cleared by the write) now hold the flushed statuses
+                self.latest_status = {}
+                for r in self.pending:
+                    self.latest_status[r["location_id"]] = r["status"]
+                self._rewrite()
+            return len(batch) - len(failed)
+
+    def _rewrite(self):
+        # Swap in a journal holding only the unflushed scans (caller holds self.lock),
+        # after a header carrying the sequence number on
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"seq": self.seq}) + "\n")
+            for r in self.pending:
+                f.write(json.dumps(r) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _dead_letter(self, failed):
+        # Caller holds self.lock
+        failed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with open(self.dead_path, "a", encoding="utf-8") as f:
+            for record, error in failed:
+                f.write(json.dumps(dict(record, error=f"{type(error).__name__}: {error}", failed_at=failed_at)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def dead_letters(self):
+        """Scans moved out of the journal because they couldn't be applied, oldest first."""
+        if not os.path.exists(self.dead_path):
+            return []
+        with open(self.dead_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def retry_dead_letters(self):
+        """Queues every dead-lettered scan again (with its original status and time). Returns how many."""
+        with self.lock:
+            records = self.dead_letters()
+            for r in records:
+                self._append(r["location_id"], r["status"], r["user"], r["sent_to"], r["time"])
+            self._remove_dead_letters()
+        self.wake.set()
+        return len(records)
+
+    def clear_dead_letters(self):
+        with self.lock:
+            self._remove_dead_letters()
+
+    def _remove_dead_letters(self):
+        # Caller holds self.lock
+        if os.path.exists(self.dead_path):
+            os.remove(self.dead_path)
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Scans stay in the journal and are retried on the next tick
+                logger.exception("Flushing the scan journal failed")
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_journal():
+    """Process-wide journal at JOURNAL_PATH in secrets.toml (default scan_journal.jsonl), flusher running."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = ScanJournal(storage.get_secret("JOURNAL_PATH", "scan_journal.jsonl"))
+            _journal.start()
+        return _journal
+
+def queue_toggle(location_id, user_email, sent_to=""):
+    """
+    Journaled version of database.toggle_aliquot_status: same return values, but the
+    sheets are updated by the flusher a moment later instead of before returning.
+    """
+    curr_time = database.get_current_cst_time().strftime("%Y-%m-%d %H:%M:%S")
+    return get_journal().toggle(location_id, user_email, sent_to, curr_time)
@@ -1,72 +1,129 @@
-from fpdf import FPDF
-import qrcode
 from io import BytesIO
-import tempfile
-import os
+from fpdf import FPDF
+import metrics
+import qr_service
+import storage
+
+# First line of every label, unless another header is given
+DEFAULT_HEADER = str(storage.get_secret("LABEL_HEADER", "160502"))
+
+# Layout of the original 1.69 x 0.75 inch roll label, in mm. Other stocks scale it to fit their labels.
+BASE_W, BASE_H = 42.93, 19.05
+QR_X, QR_Y, QR_SIZE = 1, 1, 17
+# Text starts at x=19 mm since the QR code takes up 1-18 mm; one 4 mm line each at these y positions
+TEXT_X = 19
+LINE_YS = (2, 6, 10, 14)
+LINE_H = 4
+HEADER_PT, BODY_PT = 8, 7
+# Left padding FPDF puts inside a cell (1 mm by default), kept so text sits where cell() drew it
+CELL_PAD = 1
+PT_TO_MM = 25.4 / 72
 
-def generate_pdf_labels(allocations):
+class LabelTemplate:
     """
-    Generates a PDF where each page is a 1.69x0.75 inch label.
-    allocations: list of dicts with 'location_id', 'patientvisit_id', 'specimen_type'
-    Returns: byte stream of the PDF file.
+    A label stock: pages of page_w x page_h mm holding a cols x rows grid of label_w x label_h mm
+    labels, the first one at (left, top), with gap_x/gap_y between neighbours.
+    A roll is a 1 x 1 grid whose page is the label itself.
     """
-    # 1.69 inches by 0.75 inches in millimeters: ~42.93 mm x 19.05 mm
-    pdf = FPDF(orientation='L', unit='mm', format=(19.05, 42.93))
-    pdf.set_auto_page_break(False)
-    
-    # Keep track of specimen numbering per patient-visit
+
+    def __init__(self, page_w, page_h, label_w, label_h, cols=1, rows=1, left=0, top=0, gap_x=0, gap_y=0):
+        self.page_w = page_w
+        self.page_h = page_h
+        self.label_w = label_w
+        self.label_h = label_h
+        self.cols = cols
+        self.rows = rows
+        self.left = left
+        self.top = top
+        self.gap_x = gap_x
+        self.gap_y = gap_y
+
+    @property
+    def per_page(self):
+        return self.cols * self.rows
+
+    @property
+    def scale(self):
+        return min(self.label_w / BASE_W, self.label_h / BASE_H)
+
+    def origin(self, slot):
+        """Top-left corner of the slot-th label on a page, filled row by row."""
+        row, col = divmod(slot, self.cols)
+        return self.left + col * (self.label_w + self.gap_x), self.top + row * (self.label_h + self.gap_y)
+
+INCH = 25.4
+LETTER = (8.5 * INCH, 11 * INCH)
+A4 = (210, 297)
+
+TEMPLATES = {
+    "Roll 1.69 x 0.75 in": LabelTemplate(BASE_W, BASE_H, BASE_W, BASE_H),
+    "Avery 5160 (30 per Letter sheet)": LabelTemplate(
+        *LETTER, 2.625 * INCH, 1 * INCH, cols=3, rows=10,
+        left=0.1875 * INCH, top=0.5 * INCH, gap_x=0.125 * INCH
+    ),
+    "Avery 5167 (80 per Letter sheet)": LabelTemplate(
+        *LETTER, 1.75 * INCH, 0.5 * INCH, cols=4, rows=20,
+        left=0.3 * INCH, top=0.5 * INCH, gap_x=0.3 * INCH
+    ),
+    "Avery L7651 (65 per A4 sheet)": LabelTemplate(
+        *A4, 38.1, 21.2, cols=5, rows=13, left=4.75, top=10.7, gap_x=2.5
+    ),
+}
+DEFAULT_TEMPLATE = "Roll 1.69 x 0.75 in"
+
+def label_lines(allocations):
+    """(location_id, patientvisit_id, 'Type N') per label, numbering specimens per patient-visit and type."""
     visit_specimen_counts = {}
-    
+    lines = []
     for alloc in allocations:
-        loc_id = alloc['location_id']
-        pv_id = alloc['patientvisit_id']
-        sp_type = alloc['specimen_type']
-        
-        # Increment counter for this patient-visit + specimen type
-        key = f"{pv_id}_{sp_type}"
+        key = f"{alloc['patientvisit_id']}_{alloc['specimen_type']}"
         visit_specimen_counts[key] = visit_specimen_counts.get(key, 0) + 1
-        sp_number = visit_specimen_counts[key]
-        
+        lines.append((alloc['location_id'], alloc['patientvisit_id'],
+                      f"{alloc['specimen_type']} {visit_specimen_counts[key]}"))
+    return lines
+
+@metrics.timed("labels.generate_pdf_labels")
+def generate_pdf_labels(allocations, template=DEFAULT_TEMPLATE, header=None):
+    """
+    Generates a PDF of labels on the given stock (a key of TEMPLATES): one label per page
+    on a roll, or as many per page as a sheet holds.
+    allocations: list of dicts with 'location_id', 'patientvisit_id', 'specimen_type'
+    Returns: byte stream of the PDF file.
+    """
+    tpl = TEMPLATES[template]
+    header = DEFAULT_HEADER if header is None else str(header)
+    s = tpl.scale
+    header_mm, body_mm = HEADER_PT * s * PT_TO_MM, BODY_PT * s * PT_TO_MM
+
+    pdf = FPDF(unit='mm', format=(tpl.page_w, tpl.page_h))
+    pdf.set_auto_page_break(False)
+    # 1-bit images stored with zlib rather than re-encoded as CCITT fax: lossless and much quicker
+    pdf.set_image_filter("FlateDecode")
+
+    lines = label_lines(allocations)
+    # Encode every QR code up front (in parallel for big batches); images never touch the disk
+    qr_service.render_matrices(loc_id for loc_id, _, _ in lines)
+
+    def baseline(y0, line):
+        # Where cell(h=LINE_H) puts the baseline: mid-line plus 0.3 of the font size
+        return y0 + (LINE_YS[line] + LINE_H / 2) * s + 0.3 * (header_mm if line == 0 else body_mm)
+
+    for start in range(0, len(lines), tpl.per_page):
+        page = [(tpl.origin(slot), label) for slot, label in enumerate(lines[start:start + tpl.per_page])]
         pdf.add_page()
-        
-        # 1. Generate QR code image temporarily to embed
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=1,
-        )
-        qr.add_data(loc_id)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Save temp image
-        temp_img_path = tempfile.mktemp(suffix=".png")
-        img.save(temp_img_path)
-        
-        # Draw QR Code on the left side
-        # Make the QR code 17x17 mm to fit inside the 19.05 mm height
-        pdf.image(temp_img_path, x=1, y=1, w=17, h=17)
-        
-        # 2. Draw Text next to the QR code
-        # We start X at 19 mm since QR takes up 1-18 mm
-        pdf.set_font("helvetica", style="B", size=8)
-        
-        # Start text at x=19 mm, y=2 mm
-        pdf.set_xy(19, 2)
-        pdf.cell(w=0, h=4, text="160502", new_x="LMARGIN", new_y="NEXT")
-        
-        pdf.set_font("helvetica", size=7)
-        pdf.set_xy(19, 6)
-        pdf.cell(w=0, h=4, text=pv_id, new_x="LMARGIN", new_y="NEXT")
-        
-        pdf.set_xy(19, 10)
-        pdf.cell(w=0, h=4, text=f"{sp_type} {sp_number}", new_x="LMARGIN", new_y="NEXT")
-        
-        pdf.set_xy(19, 14)
-        pdf.cell(w=0, h=4, text=loc_id, new_x="LMARGIN", new_y="NEXT")
-        
-        # Cleanup temp file
-        os.remove(temp_img_path)
-        
+        # Images first, then every label's header, then the body text, so the
+        # font changes once per page rather than twice per label
+        for (x0, y0), (loc_id, _, _) in page:
+            pdf.image(BytesIO(qr_service.qr_png(loc_id, box_size=10, border=1)),
+                      x=x0 + QR_X * s, y=y0 + QR_Y * s, w=QR_SIZE * s, h=QR_SIZE * s)
+        text_x = (TEXT_X + CELL_PAD) * s
+        pdf.set_font("helvetica", style="B", size=HEADER_PT * s)
+        for (x0, y0), _ in page:
+            pdf.text(x0 + text_x, baseline(y0, 0), header)
+        pdf.set_font("helvetica", size=BODY_PT * s)
+        for (x0, y0), label in page:
+            loc_id, pv_id, type_line = label
+            for line, text in ((1, pv_id), (2, type_line), (3, loc_id)):
+                pdf.text(x0 + text_x, baseline(y0, line), text)
+
     return bytes(pdf.output())
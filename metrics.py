@@ -0,0 +1,200 @@
+import functools
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+# Durations kept per operation for the percentiles; older calls still count in the totals
+WINDOW = 1024
+PERCENTILES = (50, 90, 99)
+PROMETHEUS_PREFIX = "freezer"
+
+class _Series:
+    __slots__ = ("calls", "errors", "seconds", "rows", "nbytes", "recent")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.nbytes = 0
+        self.recent = deque(maxlen=WINDOW)
+
+_lock = threading.Lock()
+_series = {}
+_caches = {}
+_server = None
+
+def observe(name, seconds, rows=None, nbytes=None, error=False):
+    """Records one call of an operation: how long it took and, where known, rows and bytes moved."""
+    with _lock:
+        series = _series.get(name)
+        if series is None:
+            series = _series[name] = _Series()
+        series.calls += 1
+        series.errors += bool(error)
+        series.seconds += seconds
+        series.rows += rows or 0
+        series.nbytes += nbytes or 0
+        series.recent.append(seconds)
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def _size(result):
+    # (rows, bytes) of whatever an operation returned, where that means something
+    if isinstance(result, pd.DataFrame):
+        return len(result), None
+    if isinstance(result, (bytes, bytearray)):
+        return None, len(result)
+    if isinstance(result, list):
+        return len(result), None
+    return None, None
+
+def timed(name):
+    """Decorator recording every call of a function under `name`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                observe(name, time.perf_counter() - start, error=True)
+                raise
+            rows, nbytes = _size(result)
+            observe(name, time.perf_counter() - start, rows, nbytes)
+            return result
+        wrapper.metrics_name = name
+        return wrapper
+    return decorate
+
+class timer:
+    """Context manager recording the time spent in its block, e.g. one page render."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Streamlit's rerun/stop signals aren't Exceptions and don't count as errors
+        observe(self.name, time.perf_counter() - self.start, error=exc_type is not None and issubclass(exc_type, Exception))
+        return False
+
+def instrument_module(namespace, prefix, skip=()):
+    """
+    Wraps every public function defined in a module (pass its globals()) with timed(),
+    as '<prefix>.<name>'. Callers in the module and outside it go through the wrapper.
+    Decorators and other functions that shouldn't be timed go in `skip`.
+    """
+    module = namespace["__name__"]
+    for attr, value in list(namespace.items()):
+        if attr.startswith("_") or attr in skip or not callable(value) or isinstance(value, type):
+            continue
+        if getattr(value, "__module__", None) != module or hasattr(value, "metrics_name"):
+            continue
+        namespace[attr] = timed(f"{prefix}.{attr}")(value)
+
+def register_cache(name, stats):
+    """stats() returns a (possibly nested) dict of counters, e.g. hits, misses and size."""
+    _caches[name] = stats
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else str(key), item, out)
+    elif isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+        out[prefix] = value
+
+def cache_stats():
+    """{cache name: {stat: number}} from every registered cache, nested dicts flattened with dots."""
+    out = {}
+    for name, stats in list(_caches.items()):
+        values = {}
+        try:
+            _flatten("", stats(), values)
+        except Exception:
+            continue
+        out[name] = values
+    return out
+
+def summary():
+    """One row per operation: calls, errors, percentiles over the recent calls, totals."""
+    with _lock:
+        items = [(name, s.calls, s.errors, s.seconds, s.rows, s.nbytes, np.array(s.recent))
+                 for name, s in sorted(_series.items())]
+    rows = []
+    for name, calls, errors, seconds, n_rows, nbytes, recent in items:
+        pct = np.percentile(recent, PERCENTILES) * 1000 if len(recent) else [np.nan] * len(PERCENTILES)
+        rows.append([name, calls, errors, *pct, recent.max() * 1000 if len(recent) else np.nan,
+                     seconds, n_rows, nbytes])
+    columns = (["Operation", "Calls", "Errors"] + [f"p{p} ms" for p in PERCENTILES]
+               + ["Max ms", "Total s", "Rows", "Bytes"])
+    return pd.DataFrame(rows, columns=columns)
+
+def reset():
+    with _lock:
+        _series.clear()
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def to_prometheus():
+    """Everything recorded, in the Prometheus text exposition format."""
+    p = PROMETHEUS_PREFIX
+    with _lock:
+        items = [(name, s.calls, s.errors, s.seconds, s.rows, s.nbytes, np.array(s.recent))
+                 for name, s in sorted(_series.items())]
+    lines = [f"# HELP {p}_operation_seconds Time spent per operation (quantiles over the last {WINDOW} calls).",
+             f"# TYPE {p}_operation_seconds summary"]
+    for name, calls, _, seconds, _, _, recent in items:
+        label = f'operation="{_label(name)}"'
+        if len(recent):
+            for q, value in zip(PERCENTILES, np.percentile(recent, PERCENTILES)):
+                lines.append(f'{p}_operation_seconds{{{label},quantile="{q / 100:g}"}} {value:.6f}')
+        lines.append(f"{p}_operation_seconds_sum{{{label}}} {seconds:.6f}")
+        lines.append(f"{p}_operation_seconds_count{{{label}}} {calls}")
+    for metric, column, help_text in [("errors", 2, "Calls that raised."), ("rows", 4, "Rows returned or written."),
+                                      ("bytes", 5, "Bytes read, written or rendered.")]:
+        lines.append(f"# HELP {p}_operation_{metric}_total {help_text}")
+        lines.append(f"# TYPE {p}_operation_{metric}_total counter")
+        for item in items:
+            lines.append(f'{p}_operation_{metric}_total{{operation="{_label(item[0])}"}} {item[column]}')
+    lines.append(f"# HELP {p}_cache Counters and sizes reported by the in-process caches.")
+    lines.append(f"# TYPE {p}_cache gauge")
+    for cache, values in cache_stats().items():
+        for stat, value in values.items():
+            lines.append(f'{p}_cache{{cache="{_label(cache)}",stat="{_label(stat)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_prometheus(port, host="127.0.0.1"):
+    """
+    Serves to_prometheus() at http://host:port/metrics from a background thread, once per process.
+    Only reachable from the machine itself unless host says otherwise (e.g. "0.0.0.0").
+    """
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+GRID_SIZE = 9
+BOX_CAPACITY = GRID_SIZE * GRID_SIZE
+# Statuses that give a tube's X/Y cell back for new tubes. A tube in any other status,
+# including Checked Out, keeps its cell so it can be checked back in by scanning its location.
+RELEASED_STATUSES = ("Consumed",)
+
+def holds_slot(status):
+    return status not in RELEASED_STATUSES
+
+def cell_index(x, y):
+    # Same x-major order the allocator has always filled spots in: X1Y1, X1Y2, ... X9Y9
+    return (x - 1) * GRID_SIZE + (y - 1)
+
+class OccupancyGrid:
+    """
+    81 cells per box for every box in the freezer, set while the newest tube recorded at
+    that X/Y position holds it (see holds_slot). spots_used is simply the number of set
+    cells, so it can't drift from the aliquot records.
+    """
+
+    def __init__(self, box_ids, cells=None, position=None):
+        self.box_ids = list(box_ids)
+        self.position = position if position is not None else {b: i for i, b in enumerate(self.box_ids)}
+        self.cells = cells if cells is not None else np.zeros((len(self.box_ids), BOX_CAPACITY), dtype=bool)
+
+    @classmethod
+    def from_frames(cls, df_boxes, df_aliquots):
+        grid = cls(df_boxes['id'] if 'id' in df_boxes.columns else [])
+        if df_aliquots.empty or 'status' not in df_aliquots.columns:
+            return grid
+        df = df_aliquots
+        pos = pd.to_numeric(df['box_id'], errors='coerce').map(grid.position)
+        x = pd.to_numeric(df['x_coord'], errors='coerce')
+        y = pd.to_numeric(df['y_coord'], errors='coerce')
+        valid = (pos.notna() & x.between(1, GRID_SIZE) & y.between(1, GRID_SIZE)).values
+        if not valid.any():
+            return grid
+        flat = (pos.values[valid].astype(int) * BOX_CAPACITY
+                + cell_index(x.values[valid], y.values[valid]).astype(int))
+        held = ~df['status'].isin(RELEASED_STATUSES).values[valid]
+        # Older rows at a reused position are history: only the newest (highest id) counts
+        ids = pd.to_numeric(df['id'], errors='coerce').fillna(-1).values[valid] if 'id' in df.columns else np.arange(len(flat))
+        order = np.argsort(ids, kind='stable')[::-1]
+        cells, newest = np.unique(flat[order], return_index=True)
+        grid.cells.reshape(-1)[cells[held[order][newest]]] = True
+        return grid
+
+    def refresh(self, box_ids, df_aliquots):
+        """Recomputes the cells of box_ids from df_aliquots, which must hold every row recorded in those boxes."""
+        box_ids = [b for b in box_ids if b in self.position]
+        part = OccupancyGrid.from_frames(pd.DataFrame({'id': box_ids}), df_aliquots)
+        for i, b in enumerate(box_ids):
+            self.cells[self.position[b]] = part.cells[i]
+
+    def copy(self):
+        return OccupancyGrid(self.box_ids, self.cells.copy(), self.position)
+
+    def occupy(self, box_id, x, y):
+        self.cells[self.position[box_id], cell_index(x, y)] = True
+
+    def release(self, box_id, x, y):
+        self.cells[self.position[box_id], cell_index(x, y)] = False
+
+    def free_spots(self, box_id, count=None):
+        free = np.flatnonzero(~self.cells[self.position[box_id]])[:count]
+        return [(int(c) // GRID_SIZE + 1, int(c) % GRID_SIZE + 1) for c in free]
+
+    def spots_used(self, box_id):
+        return int(self.cells[self.position[box_id]].sum())
+
+    def counts(self):
+        # spots_used for every box, in box order
+        return self.cells.sum(axis=1)
+
+    def active_boxes(self):
+        return int(self.cells.any(axis=1).sum())
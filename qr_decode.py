@@ -0,0 +1,171 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+import cv2
+import numpy as np
+from PIL import Image
+from pyzbar.pyzbar import decode, ZBarSymbol
+import metrics
+
+# Photos are read shrunk by the largest of 2, 4 or 8 that keeps at least this many pixels on
+# the longer side: a 12MP phone photo (4032 x 3024) is read at 1008 x 756, which still gives
+# every label in a photo of a box a few pixels per module
+MIN_SIDE = 1000
+# JPEGs are decoded straight at the reduced scale, skipping most of a full decode.
+# Whole-number factors only: zbar reads codes shrunk by 2 or 4 far better than ones resized by 0.8.
+_REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    1: cv2.IMREAD_GRAYSCALE,
+}
+# Streamlit hands the same photo back on every rerun, so results are kept per image
+RESULT_CACHE_SIZE = 256
+
+_results = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "retries": 0, "opencv": 0}
+_detector = threading.local()
+
+def _reduction(image_bytes):
+    # Only the header is read here
+    try:
+        side = max(Image.open(BytesIO(image_bytes)).size)
+    except Exception:
+        return 1
+    for factor in (8, 4, 2):
+        if side / factor >= MIN_SIDE:
+            return factor
+    return 1
+
+def _load(image_bytes, factor):
+    gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), _REDUCED_FLAGS[factor])
+    if gray is None:
+        raise ValueError("The file could not be read as an image.")
+    return gray
+
+def _zbar(gray):
+    # (text, centre x, centre y) per code, in the coordinates of gray
+    return [(obj.data.decode("utf-8", errors="replace"),
+             obj.rect.left + obj.rect.width / 2, obj.rect.top + obj.rect.height / 2)
+            for obj in decode(gray, symbols=[ZBarSymbol.QRCODE])]
+
+def _opencv(gray):
+    # QRCodeDetector isn't thread-safe; one per thread
+    detector = getattr(_detector, "value", None)
+    if detector is None:
+        detector = _detector.value = cv2.QRCodeDetector()
+    found, texts, points, _ = detector.detectAndDecodeMulti(gray)
+    if not found:
+        return []
+    centres = points.reshape(len(texts), -1, 2).mean(axis=1)
+    return [(text, float(x), float(y)) for text, (x, y) in zip(texts, centres)]
+
+def _unique(codes, scale=1, dx=0, dy=0):
+    # First sighting of each code, moved into full-size image pixels
+    found = {}
+    for text, x, y in codes:
+        text = text.strip()
+        if text and text not in found:
+            found[text] = (text, x * scale + dx, y * scale + dy)
+    return tuple(found.values())
+
+def _decode(image_bytes):
+    factor = _reduction(image_bytes)
+    small, small_factor = _load(image_bytes, factor), factor
+    codes = _zbar(small)
+    while not codes and factor > 1:
+        # Codes too small to survive the reduction: try again at twice the size, up to full resolution
+        factor //= 2
+        with _lock:
+            _stats["retries"] += 1
+        codes = _zbar(_load(image_bytes, factor))
+    if not codes:
+        # zbar misses some blurred or tilted codes that OpenCV's detector still reads
+        with _lock:
+            _stats["opencv"] += 1
+        factor = small_factor
+        codes = _opencv(small)
+    return _unique(codes, factor)
+
+def _decode_regions(image_bytes, regions):
+    gray = _load(image_bytes, 1)
+    h, w = gray.shape
+    codes = []
+    for x0, y0, x1, y1 in regions:
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1), w), min(int(y1), h)
+        if x1 > x0 and y1 > y0:
+            codes.extend(_unique(_zbar(gray[y0:y1, x0:x1]), 1, x0, y0))
+    return _unique(codes)
+
+def _decode_tiles(image_bytes, tiles):
+    factor = _reduction(image_bytes)
+    gray = _load(image_bytes, factor)
+    h, w = gray.shape
+    # Tiles two steps across, overlapping by one, so any code up to a step wide is whole in one of them
+    step = max(max(h, w) // tiles, 1)
+    codes = []
+    for y0 in range(0, max(h - step, 1), step):
+        for x0 in range(0, max(w - step, 1), step):
+            codes.extend(_unique(_zbar(gray[y0:y0 + 2 * step, x0:x0 + 2 * step]), 1, x0, y0))
+    return _unique(codes, factor)
+
+def _cached(key, compute):
+    with _lock:
+        codes = _results.get(key)
+        if codes is not None:
+            _results.move_to_end(key)
+            _stats["hits"] += 1
+            return codes
+        _stats["misses"] += 1
+    codes = compute()
+    with _lock:
+        _results[key] = codes
+        while len(_results) > RESULT_CACHE_SIZE:
+            _results.popitem(last=False)
+    return codes
+
+def decode_image(image_bytes):
+    """
+    Every QR code in a photo (PNG or JPEG bytes), in the order found, without repeats.
+    Large photos are read in grayscale at reduced size first, then at larger sizes up to full
+    resolution, then with OpenCV's detector, until something is found. Results are cached by
+    image hash.
+    """
+    return [text for text, _, _ in locate_codes(image_bytes)]
+
+@metrics.timed("qr.locate_codes")
+def locate_codes(image_bytes):
+    """decode_image() with where each code is: (text, x, y) of its centre, in full-size image pixels."""
+    image_bytes = bytes(image_bytes)
+    return list(_cached(hashlib.sha1(image_bytes).digest(), lambda: _decode(image_bytes)))
+
+@metrics.timed("qr.locate_codes_tiled")
+def locate_codes_tiled(image_bytes, tiles):
+    """
+    locate_codes() for photos full of codes, such as a whole box: the reduced photo is read in
+    overlapping tiles, about `tiles` along its longer side, since zbar slows down sharply with the
+    number of codes in one image. Codes wider than a tile are missed.
+    """
+    image_bytes = bytes(image_bytes)
+    key = (hashlib.sha1(image_bytes).digest(), "tiles", tiles)
+    return list(_cached(key, lambda: _decode_tiles(image_bytes, tiles)))
+
+@metrics.timed("qr.locate_codes_in")
+def locate_codes_in(image_bytes, regions):
+    """
+    Like locate_codes(), but reading each (x0, y0, x1, y1) region of the photo on its own at full
+    resolution: for small codes the whole-photo pass missed once it's known where to look.
+    """
+    image_bytes = bytes(image_bytes)
+    regions = tuple(tuple(int(v) for v in region) for region in regions)
+    key = (hashlib.sha1(image_bytes).digest(), regions)
+    return list(_cached(key, lambda: _decode_regions(image_bytes, regions)))
+
+def cache_info():
+    with _lock:
+        return dict(_stats, currsize=len(_results), maxsize=RESULT_CACHE_SIZE)
+
+metrics.register_cache("qr_decode", cache_info)
@@ -0,0 +1,126 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+import multiprocessing
+import numpy as np
+import qrcode
+import metrics
+from PIL import Image
+
+# Every location ID in the freezer (5 doors x 4 racks x 5 levels x 5 boxes x 81 spots = 40,500) fits
+MATRIX_CACHE_SIZE = 65536
+# Rendered images are much bigger than matrices, so fewer of them are kept
+IMAGE_CACHE_SIZE = 1024
+# 1-bit PNGs are ~450 bytes each, so whole label batches stay cached (~7 MB when full)
+PNG_CACHE_SIZE = 16384
+# Batches with at least this many uncached payloads are encoded in a process pool
+PARALLEL_MIN = 200
+
+_matrices = OrderedDict()
+_matrix_lock = threading.Lock()
+_matrix_stats = {"hits": 0, "misses": 0}
+_pool = None
+_precompute_lock = threading.Lock()
+_precompute_thread = None
+
+def _encode(payload):
+    # The bare symbol (no quiet zone) as packed bits: ~70 bytes for a location ID
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=1,
+        border=0,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    modules = np.array(qr.get_matrix(), dtype=bool)
+    return modules.shape[0], np.packbits(modules).tobytes()
+
+def _store(payload, packed):
+    with _matrix_lock:
+        _matrices[payload] = packed
+        _matrices.move_to_end(payload)
+        while len(_matrices) > MATRIX_CACHE_SIZE:
+            _matrices.popitem(last=False)
+
+def _packed_matrix(payload):
+    with _matrix_lock:
+        packed = _matrices.get(payload)
+        if packed is not None:
+            _matrices.move_to_end(payload)
+            _matrix_stats["hits"] += 1
+            return packed
+        _matrix_stats["misses"] += 1
+    packed = _encode(payload)
+    _store(payload, packed)
+    return packed
+
+def _get_pool():
+    # One pool per server process, started on first use. Spawned rather than forked,
+    # since the app process runs threads.
+    global _pool
+    with _matrix_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def render_matrices(payloads):
+    """
+    Makes sure every payload's matrix is cached, encoding the missing ones in a process
+    pool when there are many of them and more than one CPU to spread them over.
+    """
+    with _matrix_lock:
+        missing = [p for p in dict.fromkeys(str(p) for p in payloads) if p not in _matrices]
+    if len(missing) >= PARALLEL_MIN and (os.cpu_count() or 1) > 1:
+        results = _get_pool().map(_encode, missing, chunksize=64)
+    else:
+        results = map(_encode, missing)
+    for payload, packed in zip(missing, results):
+        _store(payload, packed)
+
+def qr_matrix(payload, border=4):
+    """QR modules for payload as a 2-D bool array (True = dark), with `border` quiet-zone modules."""
+    n, bits = _packed_matrix(str(payload))
+    modules = np.unpackbits(np.frombuffer(bits, dtype=np.uint8), count=n * n).reshape(n, n).astype(bool)
+    return np.pad(modules, border) if border else modules
+
+@lru_cache(maxsize=IMAGE_CACHE_SIZE)
+def qr_image(payload, box_size=10, border=4):
+    """
+    1-bit PIL image of the QR code, box_size pixels per module, the same pixels
+    qrcode's make_image() draws. Cached and shared, so don't modify it.
+    """
+    light = ~qr_matrix(payload, border)
+    return Image.fromarray(np.repeat(np.repeat(light, box_size, axis=0), box_size, axis=1))
+
+@lru_cache(maxsize=PNG_CACHE_SIZE)
+def qr_png(payload, box_size=10, border=4):
+    """qr_image() as 1-bit PNG bytes."""
+    buf = BytesIO()
+    qr_image(payload, box_size, border).save(buf, format="PNG")
+    return buf.getvalue()
+
+def precompute(payloads):
+    """Fills the matrix cache for every payload (e.g. every location ID in the freezer)."""
+    render_matrices(payloads)
+
+def precompute_in_background(payloads):
+    # Once per process; the app keeps serving while the cache fills
+    global _precompute_thread
+    with _precompute_lock:
+        if _precompute_thread is None:
+            _precompute_thread = threading.Thread(target=precompute, args=(list(payloads),), daemon=True)
+            _precompute_thread.start()
+        return _precompute_thread
+
+def cache_info():
+    return {
+        "matrices": dict(_matrix_stats, currsize=len(_matrices), maxsize=MATRIX_CACHE_SIZE),
+        "images": qr_image.cache_info()._asdict(),
+        "pngs": qr_png.cache_info()._asdict(),
+    }
+
+metrics.register_cache("qr_service", cache_info)
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+
+if int(pd.__version__.split(".")[0]) < 3:
+    # The views handed out below rely on copy-on-write (always on from pandas 3)
+    pd.set_option("mode.copy_on_write", True)
+
+class _Entry:
+    __slots__ = ("df", "revision", "version", "nbytes", "loaded_at")
+
+    def __init__(self, df, revision, version, nbytes, loaded_at):
+        self.df = df
+        self.revision = revision
+        self.version = version
+        self.nbytes = nbytes
+        self.loaded_at = loaded_at
+
+class SnapshotCache:
+    """
+    One snapshot per sheet for the whole server process, shared by every session.
+    get() hands out shallow copy-on-write views, so a caller that modifies its frame
+    gets its own copy of just the columns it touches and the snapshot stays intact.
+    Entries are replaced on our own writes, revalidated after max_age seconds (cheaply,
+    by revision, where the backend allows it) and evicted least-recently-used once the
+    cache holds more than max_bytes.
+    """
+
+    def __init__(self, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.load_locks = {}
+        self.next_version = 1
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def _view(self, entry):
+        view = entry.df.copy(deep=False)
+        view.attrs["snapshot_version"] = entry.version
+        return view
+
+    def _fresh(self, key):
+        # Caller holds self.lock
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry.loaded_at < self.max_age:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        return None
+
+    def get(self, key, load, current_revision=None):
+        """
+        Returns a view of the snapshot for key, calling load() on a miss.
+        current_revision(), if given, is a cheap way to check an expired entry is still
+        current before paying for a reload.
+        """
+        with self.lock:
+            entry = self._fresh(key)
+            if entry is not None:
+                return self._view(entry)
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+
+        # One loader per sheet; everyone else waiting on it reuses the result
+        with load_lock:
+            with self.lock:
+                entry = self._fresh(key)
+                if entry is not None:
+                    return self._view(entry)
+                stale = self.entries.get(key)
+            if stale is not None and current_revision is not None and stale.revision is not None:
+                if current_revision() == stale.revision:
+                    with self.lock:
+                        stale.loaded_at = time.monotonic()
+                        self.revalidations += 1
+                        return self._view(stale)
+            with self.lock:
+                self.misses += 1
+            df = load()
+            return self._view(self.put(key, df))
+
+    def put(self, key, df):
+        """Stores df (tagged with df.attrs["revision"]) as the current snapshot for key."""
+        df = df.copy(deep=False)
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        revision = df.attrs.get("revision")
+        with self.lock:
+            current = self.entries.get(key)
+            # A slow reader must not overwrite a newer snapshot stored by a write in the meantime
+            if current is not None and isinstance(current.revision, int) and isinstance(revision, int) \
+                    and revision < current.revision:
+                return current
+            entry = _Entry(df, revision, self.next_version, nbytes, time.monotonic())
+            self.next_version += 1
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            # Keep the newest entry even if it alone is over budget
+            while len(self.entries) > 1 and sum(e.nbytes for e in self.entries.values()) > self.max_bytes:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+    def version(self, key):
+        """Version of the current snapshot for key (whatever its age), or None if there isn't one."""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry.version if entry is not None else None
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+                "bytes": sum(e.nbytes for e in self.entries.values()),
+                "max_bytes": self.max_bytes,
+                "entries": {
+                    key: {"revision": e.revision, "rows": len(e.df), "bytes": e.nbytes, "age_s": round(now - e.loaded_at, 1)}
+                    for key, e in self.entries.items()
+                },
+            }
@@ -0,0 +1,546 @@
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+import gspread
+from streamlit_gsheets import GSheetsConnection
+
+# Column layout of every sheet/table the app works with. The Google Sheets backend
+# takes whatever columns the worksheet has; the SQLite backend creates real tables from this.
+SHEET_COLUMNS = {
+    "users": ["email", "password", "role", "status", "checkin_count", "checkout_count"],
+    "boxes": ["id", "door_num", "rack_num", "level_num", "box_num", "specimen_type", "spots_used"],
+    "aliquots": [
+        "id", "location_id", "box_id", "x_coord", "y_coord",
+        "patientvisit_id", "specimen_type", "stored_time", "checkin_user_id",
+        "days_since_stored", "status", "sent_to", "checkout_time", "checkout_user_id"
+    ],
+    "stats": ["key", "value"],
+    "events": [
+        "id", "time", "event", "aliquot_id", "location_id", "patientvisit_id",
+        "specimen_type", "status", "user_id", "sent_to"
+    ],
+}
+
+# Column that uniquely identifies a row in each sheet
+SHEET_KEYS = {
+    "users": "email",
+    "boxes": "id",
+    "aliquots": "id",
+    "stats": "key",
+    "events": "id",
+}
+
+def get_secret(key, default=None):
+    # st.secrets raises when no secrets.toml exists at all (e.g. local runs), so fall back quietly
+    try:
+        return st.secrets.get(key, default)
+    except Exception:
+        return default
+
+def to_db_rows(df):
+    # NaN -> NULL, numpy scalars -> plain python values that sqlite3/gspread can serialize
+    values = df.astype(object).where(df.notna(), None)
+    return list(values.itertuples(index=False, name=None))
+
+def _normalize_value(v):
+    if v is None or v is pd.NA or v is pd.NaT:
+        return ""
+    if isinstance(v, (float, np.floating)):
+        if v != v:
+            return ""
+        if float(v).is_integer():
+            return str(int(v))
+    if isinstance(v, np.integer):
+        return str(int(v))
+    return str(v)
+
+def normalize_column(col):
+    """
+    String form of a column used to compare two versions of a sheet.
+    1, 1.0 and "1" compare equal, and NaN/None/"" all compare equal, because the
+    same cell comes back with different types depending on who last touched the frame.
+    """
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        num = col.astype("float64")
+        out = pd.Series("", index=col.index, dtype=object)
+        present = num.notna()
+        integral = present & (num == np.floor(num))
+        out[integral] = num[integral].astype("int64").astype(str)
+        out[present & ~integral] = num[present & ~integral].astype(str)
+        return out
+    return col.map(_normalize_value).astype(object)
+
+def _key_index(col, other):
+    # Integer keys on both sides compare as they are; anything else goes through normalize_column
+    if pd.api.types.is_integer_dtype(col) and pd.api.types.is_integer_dtype(other):
+        return pd.Index(col.to_numpy())
+    return pd.Index(normalize_column(col))
+
+def _differs(a, b):
+    # Positions where two same-dtype columns differ, NaN matching NaN, without going through Python objects
+    equal = pd.array(a.array == b.array, dtype="boolean").fillna(False).to_numpy(dtype=bool)
+    return ~equal & ~(a.isna().to_numpy() & b.isna().to_numpy())
+
+def compute_delta(old, new, key):
+    """
+    Diffs `new` against the snapshot `old` by the key column.
+    Returns None when only a whole-sheet replacement makes sense (schema change, no
+    usable key, first write), otherwise a dict with:
+      updates: [(row position in `old`, row values)] for rows whose cells changed
+      inserts: [row values] for keys not present in `old`
+      deletes: [key] for keys that disappeared
+    """
+    if key is None or old is None or old.empty:
+        return None
+    columns = [str(c) for c in new.columns]
+    if columns != [str(c) for c in old.columns] or key not in columns:
+        return None
+
+    old_keys = _key_index(old[key], new[key])
+    new_keys = _key_index(new[key], old[key])
+    if old_keys.has_duplicates or new_keys.has_duplicates:
+        return None
+
+    # Row i of `new` pairs with row old_pos[i] of `old`, or -1 when its key is new
+    old_pos = old_keys.get_indexer(new_keys)
+    new_rows = np.flatnonzero(old_pos >= 0)
+    base_rows = old_pos[new_rows]
+    # Usual case: the first len(old) rows of `new` are the same rows in the same order
+    aligned = len(base_rows) == len(old) and np.array_equal(base_rows, new_rows)
+
+    changed = np.zeros(len(new_rows), dtype=bool)
+    for old_col, new_col in zip(old.columns, new.columns):
+        a, b = old[old_col], new[new_col]
+        a = a.iloc[:len(base_rows)] if aligned else a.iloc[base_rows]
+        b = b.iloc[:len(new_rows)] if aligned else b.iloc[new_rows]
+        # Cheap raw comparison first; only cells that differ by value/type get normalized
+        if a.dtype == b.dtype:
+            candidates = np.flatnonzero(_differs(a, b) & ~changed)
+            a = a.iloc[candidates].to_numpy(dtype=object)
+            b = b.iloc[candidates].to_numpy(dtype=object)
+        else:
+            a = a.to_numpy(dtype=object)
+            b = b.to_numpy(dtype=object)
+            a = np.where(pd.isna(a), None, a)
+            b = np.where(pd.isna(b), None, b)
+            candidates = np.flatnonzero(~(a == b) & ~changed)
+            a, b = a[candidates], b[candidates]
+        for i, x, y in zip(candidates, a, b):
+            if _normalize_value(x) != _normalize_value(y):
+                changed[i] = True
+
+    updated = new_rows[changed]
+    inserted = np.flatnonzero(old_pos < 0)
+    deleted = new_keys.get_indexer(old_keys) < 0
+
+    return {
+        "columns": columns,
+        "key": key,
+        "updates": list(zip(old_pos[updated].tolist(), to_db_rows(new.iloc[updated]))),
+        "inserts": to_db_rows(new.iloc[inserted]),
+        "deletes": old[key][deleted].tolist(),
+    }
+
+class ConflictError(Exception):
+    """A sheet changed after the snapshot a write was planned against was read."""
+
+class StorageBackend:
+    """
+    Reads and writes whole sheets as DataFrames.
+    read() tags every frame with df.attrs["revision"]; commit() only applies a set of
+    changes if every sheet is still at the revision it was planned against.
+    """
+
+    # True when revision() is cheap enough to poll instead of re-reading the sheet
+    cheap_revisions = False
+
+    def read(self, sheet_name):
+        raise NotImplementedError
+
+    def revision(self, sheet_name):
+        raise NotImplementedError
+
+    def write(self, sheet_name, df):
+        raise NotImplementedError
+
+    def apply_delta(self, sheet_name, delta):
+        """
+        Applies a compute_delta() change set in place.
+        Returns False when the backend can't express it, so the caller falls back to write().
+        """
+        return False
+
+    def commit(self, changes):
+        """
+        changes: [(sheet_name, df, delta or None, expected_revision or None), ...]
+        df is None for an append (a delta of inserts only), which never needs the full sheet.
+        Raises ConflictError, before writing anything, if any sheet has moved on.
+        Returns {sheet_name: new revision}, or None for a sheet whose new revision is only
+        known by reading it back.
+        """
+        for sheet_name, _, _, expected in changes:
+            if expected is not None and self.revision(sheet_name) != expected:
+                raise ConflictError(f"Sheet '{sheet_name}' was changed by someone else.")
+        for sheet_name, df, delta, _ in changes:
+            if delta is None or not self.apply_delta(sheet_name, delta):
+                self.write(sheet_name, df)
+        return {sheet_name: None for sheet_name, _, _, _ in changes}
+
+def _column_letter(n):
+    # 1 -> A, 26 -> Z, 27 -> AA
+    letters = ""
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+class GSheetsBackend(StorageBackend):
+    """
+    The original Google Sheets storage, one worksheet per sheet name.
+    Sheets have no revision counter of their own, so each sheet's revision is kept in the
+    small sheet_revisions worksheet and bumped on every commit; checking it costs one read
+    of that worksheet, not of the sheets themselves.
+    Limitation: Sheets has no transactions, so the check and the write aren't atomic. Two
+    servers committing to the same sheet at the same moment can both pass the check, and
+    the later write wins. Run a single server against a spreadsheet (the process write
+    lock covers everything inside it), or use the SQLite backend when that matters.
+    """
+
+    REVISIONS_SHEET = "sheet_revisions"
+    cheap_revisions = True
+
+    def get_connection(self):
+        return st.connection("gsheets", type=GSheetsConnection)
+
+    def _revisions(self):
+        try:
+            df = pd.DataFrame(self.get_connection().read(worksheet=self.REVISIONS_SHEET, ttl=0))
+        except gspread.exceptions.WorksheetNotFound:
+            # Spreadsheets from before revisions were tracked start at 0
+            return {}
+        if df.empty or "sheet" not in df.columns or "revision" not in df.columns:
+            return {}
+        values = pd.to_numeric(df["revision"], errors="coerce").fillna(0).astype(int)
+        return dict(zip(df["sheet"].astype(str), values.tolist()))
+
+    def read(self, sheet_name):
+        # Revision first: if a commit lands in between, the data is newer than its tag and the
+        # next write is rejected as a conflict, rather than overwriting a change it never saw
+        revision = self.revision(sheet_name)
+        # ttl=0 forces the GSheetsConnection to bypass its own cache,
+        # so that the caller's caching manages it completely.
+        df = pd.DataFrame(self.get_connection().read(worksheet=sheet_name, ttl=0))
+        df.attrs["revision"] = revision
+        return df
+
+    def revision(self, sheet_name):
+        return self._revisions().get(sheet_name, 0)
+
+    def commit(self, changes):
+        revisions = self._revisions()
+        for sheet_name, _, _, expected in changes:
+            if expected is not None and revisions.get(sheet_name, 0) != expected:
+                raise ConflictError(f"Sheet '{sheet_name}' was changed by someone else.")
+        for sheet_name, df, delta, _ in changes:
+            if delta is None or not self.apply_delta(sheet_name, delta):
+                self.write(sheet_name, df)
+            revisions[sheet_name] = revisions.get(sheet_name, 0) + 1
+        self.write(self.REVISIONS_SHEET, pd.DataFrame(list(revisions.items()), columns=["sheet", "revision"]))
+        return {sheet_name: revisions[sheet_name] for sheet_name, _, _, _ in changes}
+
+    def write(self, sheet_name, df):
+        # Write the dataframe back, completely replacing the current sheet data
+        conn = self.get_connection()
+        try:
+            conn.update(worksheet=sheet_name, data=df)
+        except gspread.exceptions.WorksheetNotFound:
+            # Sheets added after the original three (e.g. stats) are created on first write
+            conn.create(worksheet=sheet_name, data=df)
+
+    def apply_delta(self, sheet_name, delta):
+        # Removing rows shifts every row below them, so deletions keep using the full rewrite
+        if delta["deletes"]:
+            return False
+        conn = self.get_connection()
+        try:
+            worksheet = conn.client._select_worksheet(worksheet=sheet_name)
+        except gspread.exceptions.WorksheetNotFound:
+            if delta["updates"]:
+                raise
+            # First append to a sheet that doesn't exist yet (e.g. events)
+            conn.create(worksheet=sheet_name, data=pd.DataFrame(delta["inserts"], columns=delta["columns"]))
+            return True
+        last_col = _column_letter(len(delta["columns"]))
+
+        def cells(row):
+            return ["" if v is None else v for v in row]
+
+        if delta["updates"]:
+            # Row 1 holds the header, so snapshot position p lives on sheet row p + 2
+            worksheet.batch_update(
+                [{"range": f"A{pos + 2}:{last_col}{pos + 2}", "values": [cells(row)]} for pos, row in delta["updates"]],
+                value_input_option="USER_ENTERED"
+            )
+        if delta["inserts"]:
+            worksheet.append_rows(
+                [cells(row) for row in delta["inserts"]],
+                value_input_option="USER_ENTERED",
+                table_range="A1"
+            )
+        return True
+
+class MemoryBackend(StorageBackend):
+    """
+    In-process stand-in for a real backend, with revision counters and atomic commits.
+    Used by the stress/benchmark harnesses so they can run without Google Sheets.
+    """
+
+    cheap_revisions = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sheets = {}
+        self.revisions = {}
+
+    def read(self, sheet_name):
+        with self.lock:
+            df = self.sheets.get(sheet_name, pd.DataFrame()).copy()
+            df.attrs["revision"] = self.revisions.get(sheet_name, 0)
+            return df
+
+    def revision(self, sheet_name):
+        with self.lock:
+            return self.revisions.get(sheet_name, 0)
+
+    def write(self, sheet_name, df):
+        self.commit([(sheet_name, df, None, None)])
+
+    def commit(self, changes):
+        with self.lock:
+            for sheet_name, _, _, expected in changes:
+                if expected is not None and self.revisions.get(sheet_name, 0) != expected:
+                    raise ConflictError(f"Sheet '{sheet_name}' was changed by someone else.")
+            for sheet_name, df, delta, _ in changes:
+                if df is None:
+                    appended = pd.DataFrame(delta["inserts"], columns=delta["columns"])
+                    current = self.sheets.get(sheet_name)
+                    df = appended if current is None or current.empty else pd.concat([current, appended], ignore_index=True)
+                stored = df.reset_index(drop=True)
+                stored.attrs = {}
+                self.sheets[sheet_name] = stored
+                self.revisions[sheet_name] = self.revisions.get(sheet_name, 0) + 1
+            return {sheet_name: self.revisions[sheet_name] for sheet_name, _, _, _ in changes}
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet_revisions (
+    sheet TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    password TEXT,
+    role TEXT,
+    status TEXT,
+    checkin_count INTEGER DEFAULT 0,
+    checkout_count INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    id INTEGER PRIMARY KEY,
+    door_num INTEGER,
+    rack_num INTEGER,
+    level_num INTEGER,
+    box_num INTEGER,
+    specimen_type TEXT,
+    spots_used INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS aliquots (
+    id INTEGER PRIMARY KEY,
+    location_id TEXT,
+    box_id INTEGER,
+    x_coord INTEGER,
+    y_coord INTEGER,
+    patientvisit_id TEXT,
+    specimen_type TEXT,
+    stored_time TEXT,
+    checkin_user_id TEXT,
+    days_since_stored INTEGER,
+    status TEXT,
+    sent_to TEXT,
+    checkout_time TEXT,
+    checkout_user_id TEXT
+);
+CREATE TABLE IF NOT EXISTS stats (
+    key TEXT PRIMARY KEY,
+    value INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    time TEXT,
+    event TEXT,
+    aliquot_id INTEGER,
+    location_id TEXT,
+    patientvisit_id TEXT,
+    specimen_type TEXT,
+    status TEXT,
+    user_id TEXT,
+    sent_to TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_status ON users(status);
+CREATE INDEX IF NOT EXISTS idx_boxes_position ON boxes(door_num, rack_num, level_num, box_num);
+CREATE INDEX IF NOT EXISTS idx_boxes_rack ON boxes(rack_num, specimen_type);
+CREATE INDEX IF NOT EXISTS idx_aliquots_location ON aliquots(location_id);
+CREATE INDEX IF NOT EXISTS idx_aliquots_box ON aliquots(box_id);
+CREATE INDEX IF NOT EXISTS idx_aliquots_visit ON aliquots(patientvisit_id);
+CREATE INDEX IF NOT EXISTS idx_aliquots_status ON aliquots(status);
+CREATE INDEX IF NOT EXISTS idx_events_location ON events(location_id);
+CREATE INDEX IF NOT EXISTS idx_events_aliquot ON events(aliquot_id);
+"""
+
+class SQLiteBackend(StorageBackend):
+    """
+    Local SQLite file in WAL mode with real tables and indexes.
+    Every commit runs in one IMMEDIATE transaction and bumps the sheet's row in
+    sheet_revisions, so the revision check and the write are atomic across processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    def table_columns(self, sheet_name):
+        return [row[1] for row in self.conn.execute(f'PRAGMA table_info("{sheet_name}")')]
+
+    def ensure_columns(self, sheet_name, columns):
+        # Sheets can grow ad-hoc columns; mirror them as untyped columns instead of failing
+        existing = self.table_columns(sheet_name)
+        if not existing:
+            col_defs = ", ".join(f'"{c}"' for c in columns)
+            self.conn.execute(f'CREATE TABLE "{sheet_name}" ({col_defs})')
+            return
+        for col in columns:
+            if col not in existing:
+                self.conn.execute(f'ALTER TABLE "{sheet_name}" ADD COLUMN "{col}"')
+
+    def _revision(self, sheet_name):
+        row = self.conn.execute("SELECT revision FROM sheet_revisions WHERE sheet = ?", (sheet_name,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump_revision(self, sheet_name):
+        self.conn.execute(
+            "INSERT INTO sheet_revisions (sheet, revision) VALUES (?, 1) "
+            "ON CONFLICT(sheet) DO UPDATE SET revision = revision + 1",
+            (sheet_name,)
+        )
+
+    def read(self, sheet_name):
+        with self.lock:
+            # One read transaction so the rows and the revision come from the same snapshot
+            self.conn.execute("BEGIN")
+            try:
+                if not self.table_columns(sheet_name):
+                    df = pd.DataFrame()
+                else:
+                    df = pd.read_sql_query(f'SELECT * FROM "{sheet_name}" ORDER BY rowid', self.conn)
+                df.attrs["revision"] = self._revision(sheet_name)
+            finally:
+                self.conn.execute("COMMIT")
+            return df
+
+    def revision(self, sheet_name):
+        with self.lock:
+            return self._revision(sheet_name)
+
+    def _write(self, sheet_name, df):
+        cols = [str(c) for c in df.columns]
+        col_list = ", ".join(f'"{c}"' for c in cols)
+        placeholders = ", ".join("?" for _ in cols)
+        self.ensure_columns(sheet_name, cols)
+        self.conn.execute(f'DELETE FROM "{sheet_name}"')
+        if cols and not df.empty:
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO "{sheet_name}" ({col_list}) VALUES ({placeholders})',
+                to_db_rows(df)
+            )
+
+    def _apply_delta(self, sheet_name, delta):
+        cols = delta["columns"]
+        key = delta["key"]
+        col_list = ", ".join(f'"{c}"' for c in cols)
+        placeholders = ", ".join("?" for _ in cols)
+        assignments = ", ".join(f'"{c}" = ?' for c in cols)
+        key_pos = cols.index(key)
+        self.ensure_columns(sheet_name, cols)
+        if delta["updates"]:
+            self.conn.executemany(
+                f'UPDATE "{sheet_name}" SET {assignments} WHERE "{key}" = ?',
+                [tuple(row) + (row[key_pos],) for _, row in delta["updates"]]
+            )
+        if delta["inserts"]:
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO "{sheet_name}" ({col_list}) VALUES ({placeholders})',
+                delta["inserts"]
+            )
+        if delta["deletes"]:
+            self.conn.executemany(
+                f'DELETE FROM "{sheet_name}" WHERE "{key}" = ?',
+                [(k,) for k in delta["deletes"]]
+            )
+
+    def write(self, sheet_name, df):
+        self.commit([(sheet_name, df, None, None)])
+
+    def apply_delta(self, sheet_name, delta):
+        self.commit([(sheet_name, None, delta, None)])
+        return True
+
+    def commit(self, changes):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sheet_name, _, _, expected in changes:
+                    if expected is not None and self._revision(sheet_name) != expected:
+                        raise ConflictError(f"Sheet '{sheet_name}' was changed by someone else.")
+                for sheet_name, df, delta, _ in changes:
+                    if delta is not None:
+                        self._apply_delta(sheet_name, delta)
+                    else:
+                        self._write(sheet_name, df)
+                    self._bump_revision(sheet_name)
+                revisions = {sheet_name: self._revision(sheet_name) for sheet_name, _, _, _ in changes}
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            return revisions
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """
+    Returns the process-wide storage backend selected in secrets.toml:
+    STORAGE_BACKEND = "gsheets" (default) or "sqlite", with SQLITE_PATH for the local file.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            kind = str(get_secret("STORAGE_BACKEND", "gsheets")).lower()
+            if kind == "sqlite":
+                _backend = SQLiteBackend(get_secret("SQLITE_PATH", "freezer.db"))
+            elif kind == "memory":
+                _backend = MemoryBackend()
+            else:
+                _backend = GSheetsBackend()
+        return _backend
+
+def set_backend(backend):
+    """Swaps the process-wide backend, e.g. for a MemoryBackend in a test harness."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
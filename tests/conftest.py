@@ -0,0 +1,27 @@
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Streamlit warns about the missing script run context on every st.* call outside `streamlit run`
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import pytest
+import streamlit as st
+import storage
+import database
+
+@pytest.fixture
+def backend():
+    """A fresh, initialized in-memory freezer (users, 500 empty boxes, no aliquots) for one test."""
+    previous = storage.get_backend() if storage._backend is not None else None
+    backend = storage.MemoryBackend()
+    storage.set_backend(backend)
+    database._snapshots.invalidate()
+    database._inventory = None
+    st.session_state.pop("db_initialized", None)
+    database.init_db()
+    yield backend
+    database._snapshots.invalidate()
+    database._inventory = None
+    storage.set_backend(previous)
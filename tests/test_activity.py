@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+import database
+from activity import ActivityIndex
+
+ADMIN = database.ADMIN_USER
+TECH = "tech@example.com"
+
+@pytest.fixture
+def clock(backend, monkeypatch):
+    # A minute per call, so every write lands at its own time
+    now = [datetime(2026, 3, 1, 9, 0)]
+
+    def tick():
+        now[0] += timedelta(minutes=1)
+        return now[0]
+
+    monkeypatch.setattr(database, "get_current_cst_time", tick)
+    return now
+
+def _expected(user, limit):
+    return database._recent_from_inventory(database.get_inventory(), user, limit).reset_index(drop=True)
+
+def _same(a, b):
+    cols = [c for c in a.columns if c != "Days Stored"]
+    pd.testing.assert_frame_equal(a[cols].reset_index(drop=True), b[cols].reset_index(drop=True), check_dtype=False)
+
+def test_index_follows_our_writes_without_rebuilding(clock, monkeypatch):
+    tech = [a["location_id"] for a in database.allocate_multiple_aliquots("P1-V1", [("Plasma", 4)], TECH)]
+    mine = [a["location_id"] for a in database.allocate_multiple_aliquots("P2-V1", [("Serum", 3)], ADMIN)]
+    database.get_recent_aliquots(ADMIN, 20)
+
+    rebuilds = []
+    monkeypatch.setattr(database._activity, "rebuild", lambda inv: rebuilds.append(inv))
+    database.toggle_aliquot_status(mine[0], TECH, "Core Lab")
+    database.bulk_toggle_aliquot_status(tech[:2], ADMIN, "Biobank")
+    database.toggle_aliquot_status(tech[0], TECH)
+    for user in [ADMIN, TECH]:
+        _same(database.get_recent_aliquots(user, 20), _expected(user, 20))
+    assert rebuilds == []
+    assert database.get_recent_aliquots(TECH, 1)["Location ID"].tolist() == [tech[0]]
+
+def test_lists_cut_to_depth_fall_back_to_the_inventory(clock, monkeypatch):
+    monkeypatch.setattr(database, "_activity", ActivityIndex(depth=3))
+    locs = [a["location_id"] for a in database.allocate_multiple_aliquots("P1-V1", [("Plasma", 6)], TECH)]
+    database.get_recent_aliquots(TECH, 3)
+    database.toggle_aliquot_status(locs[0], ADMIN, "Core Lab")
+    assert database._activity.recent(TECH, 5, database._activity.version) is None
+    _same(database.get_recent_aliquots(TECH, 5), _expected(TECH, 5))
+    assert database.get_recent_aliquots(TECH, 1)["Location ID"].tolist() == [locs[0]]
@@ -0,0 +1,51 @@
+import re
+import pandas as pd
+import database
+from allocation import AllocationEngine
+from inventory import Inventory
+
+ADMIN = database.ADMIN_USER
+
+def _rack(location_id):
+    return int(re.match(r"D\d+R(\d+)", location_id).group(1))
+
+def _box(location_id):
+    return re.match(r"(D\d+R\d+L\d+B\d+)", location_id).group(1)
+
+def _inventory(boxes, aliquots):
+    users = pd.DataFrame({"email": [ADMIN]})
+    boxes = pd.DataFrame(boxes, columns=["id", "door_num", "rack_num", "level_num", "box_num", "specimen_type", "spots_used"])
+    aliquots = pd.DataFrame(aliquots, columns=["id", "location_id", "box_id", "x_coord", "y_coord",
+                                               "patientvisit_id", "specimen_type", "status"])
+    return Inventory(users, boxes, aliquots)
+
+def test_types_go_to_their_own_racks(backend):
+    placed = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 2), ("Serum", 2), ("Urine", 1), ("Saliva", 1)], ADMIN)
+    racks = {a["specimen_type"]: _rack(a["location_id"]) for a in placed}
+    assert racks == {"Plasma": 1, "Serum": 2, "Urine": 3, "Saliva": 4}
+
+def test_visits_of_one_patient_never_share_a_box(backend):
+    first = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 2)], ADMIN)
+    second = database.allocate_multiple_aliquots("P1-V2", [("Plasma", 2)], ADMIN)
+    other = database.allocate_multiple_aliquots("P2-V1", [("Plasma", 2)], ADMIN)
+    assert {_box(a["location_id"]) for a in first}.isdisjoint(_box(a["location_id"]) for a in second)
+    # Another patient is free to fill the first box up
+    assert {_box(a["location_id"]) for a in other} == {_box(a["location_id"]) for a in first}
+
+def test_a_visit_keeps_its_tubes_of_one_type_together(backend):
+    first = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 2)], ADMIN)
+    database.allocate_multiple_aliquots("P2-V1", [("Plasma", 2)], ADMIN)
+    again = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 1)], ADMIN)
+    assert _box(again[0]["location_id"]) == _box(first[0]["location_id"])
+
+def test_full_preferred_rack_overflows_to_rack_4():
+    full = [(i + 1, f"D1R1L1B1X{i // 9 + 1}Y{i % 9 + 1}", 1, i // 9 + 1, i % 9 + 1, f"P{i}-V1", "Plasma", "Stored")
+            for i in range(81)]
+    inv = _inventory([(1, 1, 1, 1, 1, "Plasma", 81), (2, 1, 2, 1, 1, "", 0), (3, 1, 4, 1, 1, "", 0)], full)
+    engine = AllocationEngine(inv)
+    assert engine.choose_box("Q1-V1", "Plasma", 2) == 3
+    engine.reserve("Q1-V1", "Plasma", 3, 79)
+    # Box 3 now has 2 spots left: too few for 3 more, so they go anywhere there's room
+    assert engine.choose_box("Q2-V1", "Plasma", 3) == 2
+    # The plan never touches the shared index
+    assert inv.capacity.state[3][2] == 81
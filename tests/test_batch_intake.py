@@ -0,0 +1,31 @@
+import io
+import pytest
+import csv_import
+
+def _parse(text):
+    return csv_import.parse_batch_intake(csv_import.read_batch_intake(io.StringIO(text)))
+
+def test_parses_visits_and_skips_zero_counts():
+    visits, err = _parse("Patient-Visit ID,Plasma,Serum,Urine\n P001-V1 ,3,,0\n007-V2,0,2,1\nP003-V1,0,0,0\n")
+    assert err is None
+    assert visits == [("P001-V1", [("Plasma", 3)]), ("007-V2", [("Serum", 2), ("Urine", 1)])]
+
+@pytest.mark.parametrize("pv_id", ["", "   ", "nan", "0", "NaN"])
+def test_blank_ids_are_rejected_with_their_row(pv_id):
+    visits, err = _parse(f"Patient-Visit ID,Plasma\nP001-V1,1\n{pv_id},2\n")
+    assert visits is None
+    assert err == "Row 2: missing Patient-Visit ID."
+
+def test_ids_stay_text():
+    visits, _ = _parse("Patient-Visit ID,Plasma\n00012_1,1\n")
+    assert visits == [("00012_1", [("Plasma", 1)])]
+
+@pytest.mark.parametrize("count, message", [("x", "must be a number"), ("11", "between 0 and 10"), ("-1", "between 0 and 10")])
+def test_bad_counts_are_rejected(count, message):
+    visits, err = _parse(f"Patient-Visit ID,Serum\nP001-V1,{count}\n")
+    assert visits is None and err.startswith("Row 1: Serum count") and message in err
+
+def test_missing_columns_and_empty_requests():
+    assert _parse("Visit,Plasma\nP1,1\n")[1] == "Missing required column: Patient-Visit ID"
+    assert _parse("Patient-Visit ID,Blood\nP1,1\n")[1].startswith("Provide at least one count column")
+    assert _parse("Patient-Visit ID,Plasma\nP1,0\n")[1] == "The file does not request any aliquots."
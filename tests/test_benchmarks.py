@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+import storage
+import database
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+sys.path.insert(0, BENCHMARKS)
+import datasets
+
+@pytest.mark.parametrize("layout", list(datasets.LAYOUTS))
+def test_datasets_are_consistent_freezers(layout, monkeypatch):
+    frames = datasets.make_dataset(8000, layout)
+    aliquots = frames["aliquots"]
+    # Only the newest row at a location is Stored
+    newest = aliquots.sort_values("id").drop_duplicates("location_id", keep="last")
+    stored = aliquots[aliquots["status"] == "Stored"]
+    assert set(stored["id"]) <= set(newest["id"])
+    assert len(stored) == min(8000, int(500 * 81 * datasets.LAYOUTS[layout]))
+
+    backend = storage.MemoryBackend()
+    datasets.load(backend, frames)
+    monkeypatch.setattr(storage, "_backend", backend)
+    database._snapshots.invalidate()
+    inv = database.get_inventory()
+    np.testing.assert_array_equal(inv.boxes["spots_used"].values, frames["boxes"]["spots_used"].values)
+    database._snapshots.invalidate()
+    database._inventory = None
+
+def test_every_benchmark_runs(tmp_path):
+    output = tmp_path / "results.json"
+    done = subprocess.run([sys.executable, os.path.join(BENCHMARKS, "run_benchmarks.py"), "--sizes", "2000",
+                           "--layouts", "fragmented", "--repeat", "1", "--warmup", "0", "--output", str(output)],
+                          capture_output=True, text=True, timeout=300)
+    assert done.returncode == 0, done.stdout + done.stderr
+    results = json.loads(output.read_text())["results"]
+    assert {r["operation"] for r in results} >= {"load_inventory", "allocate", "toggle", "upload", "labels"}
+    assert not any(r["error"] for r in results)
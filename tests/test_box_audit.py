@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyzbar.pyzbar", reason="needs the zbar shared library", exc_type=ImportError)
+import cv2
+import box_audit
+import qr_service
+
+BOX = "D1R2L3B4"
+# Photo pixels of slot (x, y): a slightly rotated, scaled and shifted grid
+TRANSFORM = np.array([[180.0, 12.0], [-10.0, 175.0], [90.0, 70.0]])
+
+def _centre(x, y):
+    return tuple(np.array([x, y], dtype=float) @ TRANSFORM[:2] + TRANSFORM[2])
+
+def _records(stored, status="Stored"):
+    return pd.DataFrame({"location_id": stored, "status": status, "patientvisit_id": "P1-V1", "specimen_type": "Plasma"})
+
+def test_fit_grid_recovers_the_grid_despite_misplaced_tubes():
+    slots = [(x, y) for x in range(1, 10) for y in range(1, 10, 2)]
+    centres = [_centre(*slot) for slot in slots]
+    # Two tubes put back in the wrong slots
+    centres[0], centres[7] = _centre(9, 9), _centre(5, 2)
+    transform, inliers = box_audit.fit_grid(slots, centres)
+    np.testing.assert_allclose(transform, TRANSFORM, atol=1e-6)
+    assert not inliers[0] and not inliers[7] and inliers.sum() == len(slots) - 2
+    assert box_audit.slots_at(transform, [_centre(4, 6), (-500, -500)]).tolist() == [[4, 6], [0, 0]]
+    assert box_audit.fit_grid(slots[:2], centres[:2]) == (None, None)
+
+def test_audit_sorts_out_ok_misplaced_unexpected_and_missing():
+    slots = [(1, 1), (5, 2), (3, 7), (8, 3), (2, 5), (7, 7), (9, 9), (6, 4)]
+    stored = [f"{BOX}X{x}Y{y}" for x, y in slots]
+    codes = [(loc, *_centre(*slot)) for loc, slot in zip(stored[:6], slots)]
+    codes.append((stored[6], *_centre(8, 8)))
+    codes.append(("D9R9L9B9X1Y1", *_centre(6, 6)))
+    report, fitted = box_audit.audit(BOX, codes, _records(stored))
+    assert fitted
+    results = dict(zip(report["Location ID"], zip(report["Result"], report["Found At"])))
+    assert results[stored[6]] == (box_audit.MISPLACED, "X8Y8")
+    assert results["D9R9L9B9X1Y1"] == (box_audit.UNEXPECTED, "X6Y6")
+    assert results[stored[7]] == (box_audit.MISSING, "")
+    assert [results[loc][0] for loc in stored[:6]] == [box_audit.OK] * 6
+    assert report["Result"].tolist()[0] == box_audit.MISPLACED
+
+def test_read_photo_finds_every_label_in_a_full_box():
+    canvas = np.full((1900, 1900), 255, dtype=np.uint8)
+    for loc in box_audit.box_location_ids(BOX):
+        _, x, y = box_audit.parse_location(loc)
+        img = np.array(qr_service.qr_image(loc, box_size=4, border=2), dtype=np.uint8) * 255
+        cx, cy = (int(v) for v in _centre(x, y))
+        h, w = img.shape
+        canvas[cy - h // 2:cy - h // 2 + h, cx - w // 2:cx - w // 2 + w] = img
+    photo = cv2.imencode(".png", canvas)[1].tobytes()
+    codes = box_audit.read_photo(photo, BOX)
+    assert sorted(text for text, _, _ in codes) == sorted(box_audit.box_location_ids(BOX))
+    report, fitted = box_audit.audit(BOX, codes, _records(box_audit.box_location_ids(BOX)))
+    assert fitted and set(report["Result"]) == {box_audit.OK}
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+import storage
+
+def _aliquots(n=6):
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "location_id": [f"D1R1L1B1X1Y{i}" for i in range(1, n + 1)],
+        "status": "Stored",
+        "sent_to": "",
+    })
+
+def _apply(old, delta):
+    # What a backend ends up with after applying the delta to `old`
+    rows = dict(zip(old[delta["key"]].tolist(), old.astype(object).itertuples(index=False, name=None)))
+    key_pos = delta["columns"].index(delta["key"])
+    for pos, row in delta["updates"]:
+        assert old[delta["key"]].iloc[pos] == row[key_pos]
+        rows[row[key_pos]] = row
+    for row in delta["inserts"]:
+        rows[row[key_pos]] = row
+    for key in delta["deletes"]:
+        del rows[key]
+    return pd.DataFrame(list(rows.values()), columns=delta["columns"])
+
+def _same(a, b):
+    a = a.sort_values("id").reset_index(drop=True)
+    b = b.sort_values("id").reset_index(drop=True)
+    return all(storage.normalize_column(a[c]).tolist() == storage.normalize_column(b[c]).tolist() for c in a.columns)
+
+def test_unchanged_frame_gives_empty_delta():
+    old = _aliquots()
+    delta = storage.compute_delta(old, old.copy(), "id")
+    assert delta["updates"] == [] and delta["inserts"] == [] and delta["deletes"] == []
+
+def test_updates_inserts_and_deletes_round_trip():
+    old = _aliquots()
+    new = old.copy()
+    new.loc[1, "status"] = "Checked Out"
+    new.loc[1, "sent_to"] = "Core Lab"
+    new = pd.concat([new.drop(index=4), pd.DataFrame({"id": [7], "location_id": ["D1R1L1B1X1Y7"],
+                                                      "status": ["Stored"], "sent_to": [""]})])
+    delta = storage.compute_delta(old, new, "id")
+    assert [pos for pos, _ in delta["updates"]] == [1]
+    assert [row[0] for row in delta["inserts"]] == [7]
+    assert delta["deletes"] == [5]
+    assert _same(_apply(old, delta), new)
+
+def test_random_edits_round_trip():
+    rng = np.random.default_rng(0)
+    old = _aliquots(200)
+    for _ in range(20):
+        new = old.sample(frac=0.9, random_state=int(rng.integers(1 << 30))).copy()
+        flip = rng.random(len(new)) < 0.1
+        new.loc[flip, "status"] = "Checked Out"
+        new = pd.concat([new, pd.DataFrame({"id": [old["id"].max() + 1], "location_id": ["D2R1L1B1X1Y1"],
+                                            "status": ["Stored"], "sent_to": [""]})])
+        delta = storage.compute_delta(old, new, "id")
+        assert _same(_apply(old, delta), new)
+        old = new.reset_index(drop=True)
+
+@pytest.mark.parametrize("old_value, new_value", [(1, 1.0), (1, "1"), (np.nan, ""), (None, np.nan), ("", None)])
+def test_type_only_differences_are_not_changes(old_value, new_value):
+    old = pd.DataFrame({"id": [1], "days_since_stored": [old_value]})
+    new = pd.DataFrame({"id": [1.0], "days_since_stored": [new_value]})
+    assert storage.compute_delta(old, new, "id")["updates"] == []
+
+def test_same_dtype_blank_cells_are_not_changes():
+    # NaN and "" in the same text column, compared without leaving the vectorized path
+    old = _aliquots().astype({"sent_to": "str"})
+    old.loc[2, "sent_to"] = np.nan
+    new = old.copy()
+    new.loc[2, "sent_to"] = ""
+    new.loc[3, "status"] = "Checked Out"
+    delta = storage.compute_delta(old, new, "id")
+    assert [pos for pos, _ in delta["updates"]] == [3]
+
+def test_string_keys_match_integer_keys():
+    old = _aliquots()
+    new = old.astype({"id": str}).iloc[::-1]
+    new.loc[0, "status"] = "Consumed"
+    delta = storage.compute_delta(old, new, "id")
+    assert [pos for pos, _ in delta["updates"]] == [0]
+    assert delta["inserts"] == [] and delta["deletes"] == []
+
+def test_whole_sheet_replacement_cases():
+    old = _aliquots()
+    assert storage.compute_delta(old, old.assign(extra=1), "id") is None
+    assert storage.compute_delta(old, old, None) is None
+    assert storage.compute_delta(pd.DataFrame(), old, "id") is None
+    assert storage.compute_delta(old, pd.concat([old, old.iloc[:1]]), "id") is None
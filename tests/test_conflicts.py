@@ -0,0 +1,97 @@
+import gspread
+import pandas as pd
+import pytest
+import database
+import storage
+
+class FakeConnection:
+    """Just enough of GSheetsConnection for full-sheet reads and writes."""
+
+    def __init__(self):
+        self.worksheets = {}
+        self.reads = []
+
+    def read(self, worksheet, ttl=None):
+        self.reads.append(worksheet)
+        if worksheet not in self.worksheets:
+            raise gspread.exceptions.WorksheetNotFound(worksheet)
+        return self.worksheets[worksheet].copy()
+
+    def update(self, worksheet, data):
+        if worksheet not in self.worksheets:
+            raise gspread.exceptions.WorksheetNotFound(worksheet)
+        self.worksheets[worksheet] = data.copy()
+
+    def create(self, worksheet, data):
+        self.worksheets[worksheet] = data.copy()
+
+class FakeGSheetsBackend(storage.GSheetsBackend):
+    def __init__(self):
+        self.conn = FakeConnection()
+
+    def get_connection(self):
+        return self.conn
+
+def _stats(n):
+    return pd.DataFrame({"key": ["stored"], "value": [n]})
+
+def test_gsheets_revisions_start_at_zero_and_bump_per_commit():
+    backend = FakeGSheetsBackend()
+    assert backend.revision("stats") == 0
+    assert backend.commit([("stats", _stats(1), None, 0)]) == {"stats": 1}
+    assert backend.commit([("stats", _stats(2), None, 1), ("users", pd.DataFrame({"email": ["a"]}), None, None)]) \
+        == {"stats": 2, "users": 1}
+    df = backend.read("stats")
+    assert df["value"].tolist() == [2] and df.attrs["revision"] == 2
+
+def test_gsheets_commit_checks_only_the_revisions_sheet():
+    backend = FakeGSheetsBackend()
+    backend.commit([("stats", _stats(1), None, None)])
+    backend.conn.reads.clear()
+    backend.commit([("stats", _stats(2), None, 1)])
+    assert backend.conn.reads == [storage.GSheetsBackend.REVISIONS_SHEET]
+
+def test_gsheets_stale_commit_raises_and_writes_nothing():
+    backend = FakeGSheetsBackend()
+    backend.commit([("stats", _stats(1), None, None)])
+    with pytest.raises(storage.ConflictError):
+        backend.commit([("users", pd.DataFrame({"email": ["a"]}), None, None), ("stats", _stats(5), None, 0)])
+    assert backend.read("stats")["value"].tolist() == [1]
+    assert "users" not in backend.conn.worksheets
+
+class RacingBackend(storage.MemoryBackend):
+    """Another server writes the users sheet just before each of our first `races` commits."""
+
+    def __init__(self, races):
+        super().__init__()
+        self.races = races
+
+    def commit(self, changes):
+        if self.races and any(sheet == "users" for sheet, _, _, _ in changes) and self.sheets.get("users") is not None:
+            self.races -= 1
+            users = self.sheets["users"]
+            other = users.iloc[:1].assign(email=f"other{self.races}@x.org", status="pending")
+            super().commit([("users", pd.concat([users, other], ignore_index=True), None, None)])
+        return super().commit(changes)
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(database.time, "sleep", lambda seconds: None)
+
+def test_conflicting_write_is_replanned_on_fresh_data(backend, no_backoff):
+    racing = RacingBackend(races=2)
+    racing.sheets, racing.revisions = backend.sheets, backend.revisions
+    storage.set_backend(racing)
+    ok, _ = database.add_pending_user("new@x.org")
+    assert ok
+    emails = racing.read("users")["email"].tolist()
+    # Both racing writes survive alongside ours
+    assert {"other1@x.org", "other0@x.org", "new@x.org"} <= set(emails)
+
+def test_conflicts_give_up_after_the_retry_limit(backend, no_backoff):
+    racing = RacingBackend(races=database.WRITE_RETRIES)
+    racing.sheets, racing.revisions = backend.sheets, backend.revisions
+    storage.set_backend(racing)
+    with pytest.raises(storage.ConflictError):
+        database.add_pending_user("new@x.org")
+    assert "new@x.org" not in racing.read("users")["email"].tolist()
@@ -0,0 +1,63 @@
+import io
+import csv_import
+import database
+
+CSV = (b"Location ID,Patient-Visit ID,Specimen Type,Status\n"
+       b"D1R4L1B1X1Y1,P1-V1,Serum,Stored\n"
+       b"D1R4L1B1X1Y2,P1-V1,Serum,Stored\n"
+       b"bad,P1-V1,Serum,Stored\n"
+       b"D1R4L1B1X1Y3,P1-V1,Serum,Stored\n"
+       b"D9R9L9B9X1Y1,P1-V1,Serum,Stored\n")
+
+def test_import_commits_chunk_by_chunk(backend, tmp_path):
+    done = []
+    ok, msg, rejects = csv_import.import_aliquots_csv(io.BytesIO(CSV), chunk_rows=2, checkpoint_dir=str(tmp_path),
+                                                     progress=lambda fraction, rows: done.append(rows))
+    assert ok and msg.endswith("Inserted: 3, Updated: 0, Rejected: 2")
+    assert done == [2, 4, 5]
+    # Row numbers count from the start of the file, not the chunk
+    assert rejects["Row"].tolist() == [3, 5]
+    assert list(tmp_path.iterdir()) == []
+
+def test_failed_import_resumes_after_the_last_committed_chunk(backend, tmp_path, monkeypatch):
+    upsert = database.upsert_aliquots
+    calls = []
+
+    def flaky(chunk, user_email=""):
+        calls.append(len(calls))
+        if len(calls) == 2:
+            raise RuntimeError("connection reset")
+        return upsert(chunk, user_email)
+
+    monkeypatch.setattr(database, "upsert_aliquots", flaky)
+    ok, msg, _ = csv_import.import_aliquots_csv(io.BytesIO(CSV), chunk_rows=2, checkpoint_dir=str(tmp_path))
+    assert not ok and "after row 2" in msg
+
+    ok, msg, rejects = csv_import.import_aliquots_csv(io.BytesIO(CSV), chunk_rows=2, checkpoint_dir=str(tmp_path))
+    assert ok and "Inserted: 3" in msg and "(resumed after row 2)" in msg
+    assert rejects["Row"].tolist() == [3, 5]
+    assert len(database.get_inventory().aliquots) == 3
+
+def test_resume_counts_records_not_lines(backend, tmp_path, monkeypatch):
+    # The first record spans two lines
+    multiline = CSV.replace(b"D1R4L1B1X1Y1,P1-V1,", b'D1R4L1B1X1Y1,"P1-V1\nsee note",')
+    upsert = database.upsert_aliquots
+
+    def fail_second_chunk(chunk, user_email=""):
+        if chunk["Location ID"].iloc[0] == "bad":
+            raise RuntimeError("connection reset")
+        return upsert(chunk, user_email)
+
+    monkeypatch.setattr(database, "upsert_aliquots", fail_second_chunk)
+    ok, msg, _ = csv_import.import_aliquots_csv(io.BytesIO(multiline), chunk_rows=2, checkpoint_dir=str(tmp_path))
+    assert not ok and "after row 2" in msg
+
+    monkeypatch.undo()
+    ok, msg, rejects = csv_import.import_aliquots_csv(io.BytesIO(multiline), chunk_rows=3, checkpoint_dir=str(tmp_path))
+    assert ok and msg.endswith("Inserted: 3, Updated: 0, Rejected: 2 (resumed after row 2)")
+    assert rejects["Row"].tolist() == [3, 5]
+    assert sorted(database.get_inventory().aliquots["location_id"]) == ["D1R4L1B1X1Y1", "D1R4L1B1X1Y2", "D1R4L1B1X1Y3"]
+
+def test_missing_column_stops_the_import(backend, tmp_path):
+    ok, msg, _ = csv_import.import_aliquots_csv(io.BytesIO(b"Location ID\nD1R1L1B1X1Y1\n"), checkpoint_dir=str(tmp_path))
+    assert not ok and msg == "Missing required column: Patient-Visit ID"
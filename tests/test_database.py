@@ -0,0 +1,22 @@
+import database
+
+def test_init_db_seeds_an_empty_freezer(backend):
+    assert database.get_user(database.ADMIN_USER)["role"] == "master"
+    assert len(backend.read("boxes")) == 500
+    stats = database.get_freezer_stats()
+    assert stats["total_boxes"] == 500
+    assert stats["empty_boxes"] == 500
+    assert stats["total_aliquots_stored"] == 0
+
+def test_bulk_checkout_sets_the_status_rather_than_toggling(backend):
+    admin = database.ADMIN_USER
+    locs = [a["location_id"] for a in database.allocate_multiple_aliquots("P1-V1", [("Serum", 3)], admin)]
+    database.toggle_aliquot_status(locs[0], admin, "Core Lab")
+
+    applied, not_found, unchanged = database.bulk_toggle_aliquot_status(locs + ["D9R9L9B9X1Y1"], admin)
+    assert applied == locs[1:] and unchanged == [locs[0]] and not_found == ["D9R9L9B9X1Y1"]
+    # Running it again changes nothing
+    applied, _, unchanged = database.bulk_toggle_aliquot_status(locs, admin)
+    assert applied == [] and unchanged == locs
+    assert set(database.get_current_aliquots(locs)["status"]) == {"Checked Out"}
+    assert database.get_freezer_stats()["total_aliquots_checked_out"] == 3
@@ -0,0 +1,35 @@
+import pandas as pd
+import database
+
+ADMIN = database.ADMIN_USER
+
+def test_every_change_is_logged_in_the_same_commit(backend):
+    locs = [a["location_id"] for a in database.allocate_multiple_aliquots("P1-V1", [("Plasma", 3)], ADMIN)]
+    database.toggle_aliquot_status(locs[0], ADMIN, "Core Lab")
+    database.toggle_aliquot_status(locs[0], ADMIN)
+    database.bulk_toggle_aliquot_status(locs[1:], ADMIN, "Biobank")
+
+    logged = backend.read("events")
+    assert logged["id"].tolist() == list(range(1, 8))
+    history = database.get_aliquot_history(locs[0])
+    assert history["Event"].tolist() == ["Stored", "Checked out", "Returned"]
+    assert database.get_aliquot_history(locs[1])["Sent To"].tolist() == ["", "Biobank"]
+    assert database.verify_event_log().empty
+
+def test_replay_flags_aliquots_that_disagree_with_their_log(backend):
+    locs = [a["location_id"] for a in database.allocate_multiple_aliquots("P1-V1", [("Plasma", 2)], ADMIN)]
+    df = backend.read("aliquots")
+    df.loc[df["location_id"] == locs[1], "status"] = "Checked Out"
+    backend.write("aliquots", df)
+    database._snapshots.invalidate("aliquots")
+    bad = database.verify_event_log()
+    assert bad.to_dict("records") == [{"Location ID": locs[1], "Logged Status": "Stored", "Current Status": "Checked Out"}]
+
+def test_event_ids_carry_on_after_an_unseeded_counter(backend):
+    backend.write("events", pd.DataFrame({"id": [41], "time": [""], "event": ["stored"], "aliquot_id": [1],
+                                          "location_id": ["X"], "patientvisit_id": [""], "specimen_type": [""],
+                                          "status": ["Stored"], "user_id": [""], "sent_to": [""]}))
+    backend.write("stats", backend.read("stats").query("key != 'seq:events'"))
+    database._snapshots.invalidate()
+    database.allocate_multiple_aliquots("P1-V1", [("Plasma", 2)], ADMIN)
+    assert backend.read("events")["id"].tolist() == [41, 42, 43]
@@ -0,0 +1,53 @@
+import io
+import zipfile
+from xml.etree import ElementTree
+from datetime import datetime
+import pandas as pd
+import pytest
+import database
+import exporter
+
+ADMIN = database.ADMIN_USER
+NOW = datetime(2026, 10, 1, 12, 0)
+
+@pytest.fixture
+def inv(backend):
+    database.allocate_multiple_aliquots("P1-V1", [("Plasma", 5), ("Serum", 2)], ADMIN)
+    return database.get_inventory()
+
+def test_batched_csv_equals_the_one_shot_export(inv):
+    whole = pd.read_csv(io.BytesIO(exporter.export_aliquots(inv, "CSV", NOW)), dtype=str, keep_default_na=False)
+    inv.exports = None
+    batched = exporter.export_aliquots(inv, "CSV", NOW, batch_rows=2)
+    assert len(whole) == 7 and list(whole.columns) == exporter.export_columns()
+    assert pd.read_csv(io.BytesIO(batched), dtype=str, keep_default_na=False).equals(whole)
+
+def test_parquet_keeps_columns_filters_and_row_order(inv):
+    columns = ["Location ID", "Specimen Type", "Days Stored"]
+    data = exporter.export_aliquots(inv, "Parquet", NOW, columns=columns, filters={"specimen_type": "Plasma"}, batch_rows=2)
+    df = pd.read_parquet(io.BytesIO(data))
+    assert list(df.columns) == columns and set(df["Specimen Type"]) == {"Plasma"} and len(df) == 5
+    csv = pd.read_csv(io.BytesIO(exporter.export_aliquots(inv, "CSV", NOW, filters={"specimen_type": "Plasma"})))
+    assert df["Location ID"].tolist() == csv["Location ID"].tolist()
+
+def test_exports_are_cached_per_snapshot_and_day(inv):
+    first = exporter.export_aliquots(inv, "CSV", NOW)
+    assert exporter.export_aliquots(inv, "CSV", NOW.replace(hour=18)) is first
+    assert exporter.export_aliquots(inv, "CSV", NOW.replace(day=2)) is not first
+    with pytest.raises(ValueError):
+        exporter.export_aliquots(inv, "PDF", NOW)
+
+def _xlsx_rows(data):
+    # Cell text per row, read straight off the sheet XML (the writer uses inline strings)
+    ns = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+    with zipfile.ZipFile(io.BytesIO(data)) as book:
+        sheet = ElementTree.fromstring(book.read("xl/worksheets/sheet1.xml"))
+    return [[cell.findtext(".//x:t", default=cell.findtext("x:v", default="", namespaces=ns), namespaces=ns)
+             for cell in row.findall("x:c", ns)] for row in sheet.iter(f"{{{ns['x']}}}row")]
+
+def test_excel_export(inv):
+    assert "Excel" in exporter.available_formats()
+    rows = _xlsx_rows(exporter.export_aliquots(inv, "Excel", NOW, batch_rows=3))
+    assert len(rows) == 8 and rows[0] == exporter.export_columns()
+    csv = pd.read_csv(io.BytesIO(exporter.export_aliquots(inv, "CSV", NOW)))
+    assert [row[0] for row in rows[1:]] == csv["Location ID"].tolist()
@@ -0,0 +1,37 @@
+import database
+from freezer_stats import FreezerStats
+
+ADMIN = database.ADMIN_USER
+
+def test_counters_follow_every_write(backend):
+    locs = [a["location_id"] for a in database.allocate_multiple_aliquots("P1-V1", [("Plasma", 3), ("Serum", 2)], ADMIN)]
+    database.toggle_aliquot_status(locs[0], ADMIN, "Core Lab")
+    database.bulk_toggle_aliquot_status([locs[1]], ADMIN, new_status="Consumed")
+    stats = database.get_freezer_stats()
+    assert stats["total_aliquots_stored"] == 3 and stats["total_aliquots_checked_out"] == 1
+    assert stats["type_counts_stored"] == {"Serum": 2, "Plasma": 1}
+    assert stats["active_boxes"] == 2 and stats["empty_boxes"] == 498
+    assert database.verify_freezer_stats() == {}
+
+def test_drifted_counters_are_reported_and_repaired(backend):
+    database.allocate_multiple_aliquots("P1-V1", [("Plasma", 2)], ADMIN)
+    stats = FreezerStats.from_sheet(backend.read("stats"))
+    stats.add_aliquots("Stored", "Plasma", 5)
+    backend.write("stats", stats.to_frame())
+    database._snapshots.invalidate("stats")
+
+    assert database.verify_freezer_stats() == {"stored": (7, 2), "stored:Plasma": (7, 2)}
+    database.verify_freezer_stats(repair=True)
+    assert database.verify_freezer_stats() == {}
+    # The id counters survive the repair
+    assert FreezerStats.from_sheet(backend.read("stats")).has_sequence("events")
+
+def test_sequences_are_kept_out_of_the_counters():
+    stats = FreezerStats({"stored": 1})
+    assert stats.reserve_ids("events", 3, start=10) == 10
+    assert stats.reserve_ids("events", 1) == 13
+    stats.set_sequence("journal:abc", 7)
+    other = FreezerStats({"stored": 1})
+    assert stats.diff(other) == {}
+    other.carry_sequences(stats)
+    assert other.sequence("journal:abc") == 7 and other.sequence("missing") == 0
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+import database
+from inventory import Inventory
+
+ADMIN = database.ADMIN_USER
+
+def _rebuilt():
+    return Inventory(*[database.get_sheet_data(sheet_name) for sheet_name in database.INVENTORY_SHEETS])
+
+def _labels(index):
+    return {key: sorted(labels.tolist()) for key, labels in index.items()}
+
+def _assert_same(inv, expected):
+    for name in ["users", "boxes", "aliquots"]:
+        pd.testing.assert_frame_equal(getattr(inv, name), getattr(expected, name))
+    for name in ["user_index", "box_index", "location_index", "patient_boxes", "visit_type_boxes",
+                 "next_aliquot_id", "revisions"]:
+        assert getattr(inv, name) == getattr(expected, name), name
+    for name in ["visit_index", "patient_index", "box_aliquots"]:
+        assert _labels(getattr(inv, name)) == _labels(getattr(expected, name)), name
+    assert inv.patient_ids.tolist() == expected.patient_ids.tolist()
+    for name in ["stored_ts", "checkout_ts", "latest_ts"]:
+        np.testing.assert_array_equal(getattr(inv, name), getattr(expected, name))
+    np.testing.assert_array_equal(inv.grid.cells, expected.grid.cells)
+    pd.testing.assert_frame_equal(inv.stats.to_frame(), expected.stats.to_frame())
+
+@pytest.fixture
+def builds(backend, monkeypatch):
+    """Counts full Inventory builds from here on, starting from one stored tube (an empty sheet is always built)."""
+    count = [0]
+
+    class CountingInventory(Inventory):
+        def __init__(self, *args):
+            count[0] += 1
+            super().__init__(*args)
+
+    monkeypatch.setattr(database, "Inventory", CountingInventory)
+    database.allocate_multiple_aliquots("P0-V1", [("Plasma", 1)], ADMIN)
+    database.get_inventory()
+    count[0] = 0
+    return count
+
+def test_own_writes_update_the_inventory_without_a_rebuild(builds):
+    located = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 3), ("Serum", 2)], ADMIN)
+    _assert_same(database.get_inventory(), _rebuilt())
+
+    first, second = located[0]["location_id"], located[1]["location_id"]
+    database.toggle_aliquot_status(first, ADMIN, "Core Lab")
+    database.bulk_toggle_aliquot_status([second], ADMIN, new_status="Consumed")
+    _assert_same(database.get_inventory(), _rebuilt())
+
+    # Reuses the released slot, so the location index has to follow the newer row
+    database.allocate_multiple_aliquots("P2-V1", [("Plasma", 2)], ADMIN)
+    database.toggle_aliquot_status(first, ADMIN)
+    _assert_same(database.get_inventory(), _rebuilt())
+    inv = database.get_inventory()
+    assert inv.aliquots.loc[inv.latest_aliquot(second), "patientvisit_id"] == "P2-V1"
+    assert builds[0] == 0
+
+def test_sessions_holding_the_old_inventory_keep_seeing_it(builds):
+    database.allocate_multiple_aliquots("P1-V1", [("Plasma", 2)], ADMIN)
+    before = database.get_inventory()
+    database.allocate_multiple_aliquots("P1-V2", [("Plasma", 2)], ADMIN)
+    after = database.get_inventory()
+    assert after is not before
+    assert len(before.aliquots) == 3 and len(after.aliquots) == 5
+    assert "P1-V2" not in before.visit_index
+    assert set(before.patient_boxes["P1"]) == {"P1-V1"}
+    assert before.grid.counts().sum() == 3 and after.grid.counts().sum() == 5
+    assert builds[0] == 0
+
+def test_external_change_is_picked_up_by_a_full_rebuild(builds, backend, monkeypatch):
+    location = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 1)], ADMIN)[0]["location_id"]
+    # Another server checks the tube out behind our cache's back
+    df = backend.read("aliquots")
+    df.loc[df["location_id"] == location, "status"] = "Checked Out"
+    backend.write("aliquots", df)
+    monkeypatch.setattr(database._snapshots, "max_age", 0)
+
+    inv = database.get_inventory()
+    assert builds[0] == 1
+    assert inv.aliquots.loc[inv.latest_aliquot(location), "status"] == "Checked Out"
+    ok, _, new_status = database.toggle_aliquot_status(location, ADMIN)
+    assert ok and new_status == "Stored"
+
+def test_upload_updates_only_the_current_row_in_place(builds):
+    slot = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 1)], ADMIN)[0]["location_id"]
+    database.bulk_toggle_aliquot_status([slot], ADMIN, new_status="Consumed")
+    database.allocate_multiple_aliquots("P2-V1", [("Plasma", 1)], ADMIN)
+    upload = pd.DataFrame([(slot, "P2-V1", "Plasma", "Checked Out")],
+                          columns=["Location ID", "Patient-Visit ID", "Specimen Type", "Status"])
+    ok, _, _ = database.upload_aliquots_data(upload, ADMIN)
+    assert ok
+    _assert_same(database.get_inventory(), _rebuilt())
+    assert builds[0] == 0
+    assert database.get_aliquot_history(slot)["Event"].tolist().count("Overwritten by upload") == 1
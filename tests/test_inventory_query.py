@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+import database
+from inventory import Inventory
+import inventory_query
+
+def _inventory(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    boxes = pd.DataFrame({"id": [1, 2, 3], "door_num": 1, "rack_num": [1, 2, 2], "level_num": 1,
+                          "box_num": [1, 1, 2], "specimen_type": "", "spots_used": 0})
+    stored = pd.Timestamp("2026-01-01") + pd.to_timedelta(rng.integers(0, 60 * 24, n), unit="h")
+    aliquots = pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "location_id": [f"D1R1L1B1X{i // 9 % 9 + 1}Y{i % 9 + 1}" for i in range(n)],
+        "box_id": rng.integers(1, 4, n),
+        "x_coord": 1, "y_coord": 1,
+        "patientvisit_id": [f"P{i % 7}-V{i % 2}" for i in range(n)],
+        "specimen_type": rng.choice(["Plasma", "Serum"], n),
+        "stored_time": stored.strftime("%Y-%m-%d %H:%M:%S"),
+        "status": rng.choice(["Stored", "Checked Out"], n),
+    })
+    # Some rows stored at the same moment as another, some without a stored time
+    aliquots.loc[rng.random(n) < 0.2, "stored_time"] = aliquots["stored_time"].iloc[0]
+    aliquots.loc[rng.random(n) < 0.1, "stored_time"] = ""
+    return Inventory(pd.DataFrame({"email": ["a@b.c"]}), boxes, aliquots)
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"status": "Stored"},
+    {"specimen_type": "Serum", "rack": 2},
+    {"patient_id": "P3"},
+    {"stored_from": "2026-01-10", "stored_to": "2026-01-20"},
+    {"status": "Checked Out", "stored_to": "2026-01-31"},
+])
+def test_query_matches_a_plain_filter_and_sort(filters):
+    inv = _inventory()
+    index = inventory_query.BrowseIndex(inv)
+    df = inv.aliquots.assign(stored=pd.to_datetime(inv.aliquots["stored_time"], errors="coerce"),
+                             rack=inv.aliquots["box_id"].map({1: 1, 2: 2, 3: 2}), patient=inv.patient_ids)
+    mask = pd.Series(True, index=df.index)
+    for key, column in [("status", "status"), ("specimen_type", "specimen_type"), ("rack", "rack"), ("patient_id", "patient")]:
+        if key in filters:
+            mask &= df[column] == filters[key]
+    if "stored_from" in filters:
+        mask &= df["stored"] >= pd.Timestamp(filters["stored_from"])
+    if "stored_to" in filters:
+        mask &= df["stored"] < pd.Timestamp(filters["stored_to"]) + pd.Timedelta(days=1)
+    expected = df[mask].sort_values(["stored", "id"], ascending=False, na_position="last")["id"].tolist()
+    oldest_first = df[mask].sort_values(["stored", "id"], na_position="last")["id"].tolist()
+
+    positions, total = index.query(sort_key="Stored Time", page=1, page_size=1000, **filters)
+    assert total == len(expected)
+    assert inv.aliquots["id"].iloc[positions].tolist() == expected
+    # Pages are slices of the same order, either way round
+    page, _ = index.query(sort_key="Stored Time", page=2, page_size=5, **filters)
+    assert inv.aliquots["id"].iloc[page].tolist() == expected[5:10]
+    ascending, _ = index.query(sort_key="Stored Time", descending=False, page=1, page_size=1000, **filters)
+    assert inv.aliquots["id"].iloc[ascending].tolist() == oldest_first
+    page, _ = index.query(sort_key="Stored Time", descending=False, page=2, page_size=5, **filters)
+    assert inv.aliquots["id"].iloc[page].tolist() == oldest_first[5:10]
+
+@pytest.mark.parametrize("sort_key, column", [("Stored Time", "stored_time"), ("Patient-Visit ID", "patientvisit_id")])
+def test_missing_values_go_last_either_way_round(sort_key, column):
+    inv = _inventory(n=12)
+    inv.aliquots.loc[[2, 7], column] = ""
+    index = inventory_query.BrowseIndex(Inventory(inv.users, inv.boxes, inv.aliquots))
+    for descending in (True, False):
+        positions, _ = index.query(sort_key=sort_key, descending=descending, page_size=100)
+        assert positions[-2:].tolist() == ([7, 2] if descending else [2, 7])
+
+def test_browser_pages_through_the_database(backend):
+    database.allocate_multiple_aliquots("P1-V1", [("Plasma", 4), ("Serum", 3)], database.ADMIN_USER)
+    page, total = database.query_aliquots(specimen_type="Plasma", sort_key="Location ID", descending=False, page_size=3)
+    assert total == 4 and len(page) == 3
+    assert page["Location ID"].tolist() == sorted(page["Location ID"])
+    assert database.get_browse_options() == {"status": ["Stored"], "specimen_type": ["Plasma", "Serum"], "rack": [1, 2]}
@@ -0,0 +1,136 @@
+import json
+import threading
+import pytest
+import database
+import journal
+
+NOW = "2026-01-05 10:00:00"
+
+@pytest.fixture
+def tubes(backend):
+    allocations = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 4)], database.ADMIN_USER)
+    return [a["location_id"] for a in allocations]
+
+@pytest.fixture
+def scans(tmp_path, backend):
+    return journal.ScanJournal(str(tmp_path / "scan_journal.jsonl"))
+
+def _toggle(j, location_id):
+    return j.toggle(location_id, database.ADMIN_USER, "Core Lab", NOW)[2]
+
+def _statuses(location_ids):
+    return database.get_current_aliquots(location_ids).set_index("location_id")["status"].to_dict()
+
+def _events(location_id):
+    return database.get_aliquot_history(location_id)["Event"].tolist()
+
+def test_flush_applies_scans_and_trims_the_journal(scans, tubes):
+    assert _toggle(scans, tubes[0]) == "Checked Out"
+    assert _toggle(scans, tubes[0]) == "Stored"
+    assert _toggle(scans, tubes[1]) == "Checked Out"
+    assert scans.flush() == 3
+    assert _statuses(tubes[:2]) == {tubes[0]: "Stored", tubes[1]: "Checked Out"}
+    assert _events(tubes[0]) == ["Stored", "Checked out", "Returned"]
+    assert scans.pending_count() == 0
+    with open(scans.path) as f:
+        assert [json.loads(line) for line in f] == [{"seq": 3}]
+    assert database.get_journal_seq(scans.key) == 3
+
+def test_replay_after_a_crash_before_trimming_applies_nothing_twice(scans, tubes, monkeypatch):
+    _toggle(scans, tubes[0])
+    _toggle(scans, tubes[0])
+
+    def crash():
+        raise SystemExit("server killed")
+    monkeypatch.setattr(scans, "_rewrite", crash)
+    with pytest.raises(SystemExit):
+        scans.flush()
+
+    # Next start: both scans are still in the file, but the stats sheet says they're applied
+    replayed = journal.ScanJournal(scans.path)
+    assert replayed.pending_count() == 2
+    replayed.flush()
+    assert _events(tubes[0]) == ["Stored", "Checked out", "Returned"]
+    assert database.get_freezer_stats()["total_aliquots_checked_out"] == 0
+    assert database.verify_freezer_stats() == {}
+
+def test_numbering_carries_on_after_restart(scans, tubes):
+    _toggle(scans, tubes[0])
+    scans.flush()
+    restarted = journal.ScanJournal(scans.path)
+    _toggle(restarted, tubes[1])
+    assert restarted.pending[0]["seq"] == 2
+    assert restarted.flush() == 1
+    assert _statuses([tubes[1]]) == {tubes[1]: "Checked Out"}
+
+def test_poison_scan_is_dead_lettered_and_the_rest_go_through(scans, tubes, monkeypatch):
+    apply_status = database._apply_status
+
+    def broken(inv, df, df_users, grid, latest_idx, *args):
+        if df.loc[latest_idx, "location_id"] == tubes[1]:
+            raise ValueError("cannot convert float NaN to integer")
+        return apply_status(inv, df, df_users, grid, latest_idx, *args)
+    monkeypatch.setattr(database, "_apply_status", broken)
+
+    for loc in tubes:
+        _toggle(scans, loc)
+    assert scans.flush() == 3
+    assert scans.pending_count() == 0
+    assert _statuses(tubes) == {tubes[0]: "Checked Out", tubes[1]: "Stored", tubes[2]: "Checked Out", tubes[3]: "Checked Out"}
+    dead = scans.dead_letters()
+    assert [d["location_id"] for d in dead] == [tubes[1]]
+    assert dead[0]["error"] == "ValueError: cannot convert float NaN to integer"
+    # Later flushes aren't held up by it
+    _toggle(scans, tubes[0])
+    assert scans.flush() == 1
+
+    monkeypatch.setattr(database, "_apply_status", apply_status)
+    assert scans.retry_dead_letters() == 1
+    assert scans.dead_letters() == []
+    assert scans.flush() == 1
+    assert _statuses([tubes[1]]) == {tubes[1]: "Checked Out"}
+
+def test_storage_outage_keeps_every_scan_queued(scans, tubes, backend, monkeypatch):
+    _toggle(scans, tubes[0])
+    _toggle(scans, tubes[1])
+
+    def down(changes):
+        raise OSError("network unreachable")
+    monkeypatch.setattr(backend, "commit", down)
+    with pytest.raises(OSError):
+        scans.flush()
+    assert scans.pending_count() == 2
+    assert scans.dead_letters() == []
+
+    monkeypatch.undo()
+    assert scans.flush() == 2
+    assert _statuses(tubes[:2]) == {tubes[0]: "Checked Out", tubes[1]: "Checked Out"}
+
+def test_a_flush_while_a_scan_reads_the_inventory_doesnt_lose_its_toggle(scans, tubes, monkeypatch):
+    _toggle(scans, tubes[0])
+    get_inventory = database.get_inventory
+    flushers = []
+
+    def flush_meanwhile():
+        inv = get_inventory()
+        if not flushers:
+            # The flush commits the queued checkout and would clear the journal's status for it
+            flushers.append(threading.Thread(target=scans.flush))
+            flushers[0].start()
+            flushers[0].join(timeout=0.5)
+        return inv
+    monkeypatch.setattr(database, "get_inventory", flush_meanwhile)
+    assert _toggle(scans, tubes[0]) == "Stored"
+    flushers[0].join()
+    monkeypatch.undo()
+
+    scans.flush()
+    assert _statuses([tubes[0]]) == {tubes[0]: "Stored"}
+    assert _events(tubes[0]) == ["Stored", "Checked out", "Returned"]
+
+def test_consumed_tube_cant_be_scanned(scans, tubes):
+    database.bulk_toggle_aliquot_status([tubes[0]], database.ADMIN_USER, new_status="Consumed")
+    ok, msg, new_status = scans.toggle(tubes[0], database.ADMIN_USER, "", NOW)
+    assert not ok and new_status is None and "Consumed" in msg
+    assert scans.toggle("D9R9L9B9X1Y1", database.ADMIN_USER, "", NOW) == (False, "Aliquot not found.", None)
+    assert scans.pending_count() == 0
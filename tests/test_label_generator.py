@@ -0,0 +1,42 @@
+import re
+import tempfile
+import label_generator
+
+def _allocations(n, pv="P1-V1"):
+    return [{"location_id": f"D1R1L1B1X{i // 9 + 1}Y{i % 9 + 1}", "patientvisit_id": pv,
+             "specimen_type": "Plasma" if i % 3 else "Serum"} for i in range(n)]
+
+def _pages(pdf):
+    return len(re.findall(rb"/Type\s*/Page\b", pdf))
+
+def test_label_lines_number_each_visit_and_type():
+    lines = label_generator.label_lines(_allocations(4) + _allocations(1, pv="P2-V1"))
+    assert [type_line for _, _, type_line in lines] == ["Serum 1", "Plasma 1", "Plasma 2", "Serum 2", "Serum 1"]
+    assert lines[0] == ("D1R1L1B1X1Y1", "P1-V1", "Serum 1")
+
+def test_roll_labels_are_one_per_page_without_temp_files(monkeypatch):
+    def no_temp_files(*args, **kwargs):
+        raise AssertionError("labels must be rendered in memory")
+
+    for name in ["NamedTemporaryFile", "mkstemp", "TemporaryFile"]:
+        monkeypatch.setattr(tempfile, name, no_temp_files)
+    pdf = label_generator.generate_pdf_labels(_allocations(5), header="TEST")
+    assert pdf.startswith(b"%PDF") and _pages(pdf) == 5
+    assert label_generator.generate_pdf_labels([]).startswith(b"%PDF")
+
+def test_sheet_templates_fit_their_pages():
+    for name, tpl in label_generator.TEMPLATES.items():
+        x, y = tpl.origin(tpl.per_page - 1)
+        assert 0 <= tpl.left and x + tpl.label_w <= tpl.page_w + 0.01, name
+        assert 0 <= tpl.top and y + tpl.label_h <= tpl.page_h + 0.01, name
+        # The scaled base layout fits inside one label
+        assert label_generator.BASE_W * tpl.scale <= tpl.label_w + 1e-9
+        assert label_generator.BASE_H * tpl.scale <= tpl.label_h + 1e-9
+
+def test_sheets_fill_every_slot_before_a_new_page():
+    template = "Avery 5160 (30 per Letter sheet)"
+    assert _pages(label_generator.generate_pdf_labels(_allocations(30), template)) == 1
+    assert _pages(label_generator.generate_pdf_labels(_allocations(61), template)) == 3
+    tpl = label_generator.TEMPLATES[template]
+    # Filled row by row
+    assert tpl.origin(1)[1] == tpl.origin(0)[1] and tpl.origin(3)[0] == tpl.origin(0)[0]
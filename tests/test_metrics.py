@@ -0,0 +1,59 @@
+import time
+import urllib.request
+import pytest
+import database
+import metrics
+
+@pytest.fixture(autouse=True)
+def clean():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def test_timed_records_calls_errors_and_rows():
+    @metrics.timed("test.op")
+    def op(fail=False):
+        if fail:
+            raise ValueError("boom")
+        return [1, 2, 3]
+
+    op()
+    op()
+    with pytest.raises(ValueError):
+        op(fail=True)
+    row = metrics.summary().set_index("Operation").loc["test.op"]
+    assert (row["Calls"], row["Errors"], row["Rows"]) == (3, 1, 6)
+    assert op.metrics_name == "test.op"
+
+def test_timer_counts_only_exceptions_as_errors():
+    class Rerun(BaseException):
+        pass
+
+    with metrics.timer("test.page"):
+        time.sleep(0.01)
+    with pytest.raises(Rerun):
+        with metrics.timer("test.page"):
+            raise Rerun()
+    row = metrics.summary().set_index("Operation").loc["test.page"]
+    assert row["Calls"] == 2 and row["Errors"] == 0 and row["Max ms"] >= 10
+
+def test_database_calls_and_storage_are_instrumented(backend):
+    database.allocate_multiple_aliquots("P1-V1", [("Plasma", 2)], database.ADMIN_USER)
+    database._snapshots.invalidate()
+    database.get_inventory()
+    ops = set(metrics.summary()["Operation"])
+    assert {"database.allocate_multiple_aliquots", "database.get_inventory", "storage.commit", "storage.read"} <= ops
+    assert not hasattr(database.serialized_write, "metrics_name")
+    assert "snapshots" in metrics.cache_stats()
+
+def test_prometheus_endpoint():
+    metrics.observe('test.quote"d', 0.5, rows=2)
+    text = metrics.to_prometheus()
+    assert 'freezer_operation_seconds_count{operation="test.quote\\"d"} 1' in text
+    assert 'freezer_operation_rows_total{operation="test.quote\\"d"} 2' in text
+    server = metrics.serve_prometheus(0)
+    assert metrics.serve_prometheus(0) is server
+    host, port = server.server_address[:2]
+    assert host == "127.0.0.1"
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        assert b"freezer_operation_seconds_sum" in response.read()
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pyzbar.pyzbar", reason="needs the zbar shared library", exc_type=ImportError)
+import cv2
+import qr_decode
+import qr_service
+
+def _photo(codes, size, box_size):
+    """JPEG of a white sheet with each (text, x, y) QR code centred at x, y."""
+    canvas = np.full((size[1], size[0]), 255, dtype=np.uint8)
+    for text, x, y in codes:
+        img = np.array(qr_service.qr_image(text, box_size=box_size), dtype=np.uint8) * 255
+        h, w = img.shape
+        canvas[y - h // 2:y - h // 2 + h, x - w // 2:x - w // 2 + w] = img
+    return cv2.imencode(".jpg", canvas, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+CODES = [("D1R1L1B1X1Y1", 600, 500), ("D1R1L1B1X1Y2", 2400, 500), ("D1R1L1B1X2Y1", 1500, 1700)]
+
+def test_reads_every_code_in_a_large_photo():
+    photo = _photo(CODES, (3000, 2200), box_size=12)
+    found = qr_decode.locate_codes(photo)
+    assert sorted(text for text, _, _ in found) == sorted(text for text, _, _ in CODES)
+    where = {text: (x, y) for text, x, y in found}
+    for text, x, y in CODES:
+        # Centres come back in full-size pixels, whatever size the photo was read at
+        assert np.hypot(where[text][0] - x, where[text][1] - y) < 30
+
+def test_results_are_cached_per_image():
+    photo = _photo(CODES[:1], (1200, 900), box_size=8)
+    first = qr_decode.decode_image(photo)
+    hits = qr_decode.cache_info()["hits"]
+    assert qr_decode.decode_image(bytearray(photo)) == first == ["D1R1L1B1X1Y1"]
+    assert qr_decode.cache_info()["hits"] == hits + 1
+
+def test_codes_too_small_for_the_reduced_photo_are_read_larger():
+    photo = _photo(CODES, (4200, 3000), box_size=3)
+    retries = qr_decode.cache_info()["retries"]
+    assert sorted(qr_decode.decode_image(photo)) == sorted(text for text, _, _ in CODES)
+    assert qr_decode.cache_info()["retries"] > retries
+
+def test_not_an_image():
+    with pytest.raises(ValueError):
+        qr_decode.decode_image(b"not an image")
@@ -0,0 +1,31 @@
+from io import BytesIO
+import numpy as np
+import qrcode
+from PIL import Image
+import qr_service
+
+def _reference(payload, box_size=10, border=4):
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=box_size, border=border)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return np.array(qr.make_image().get_image().convert("1"))
+
+def test_images_match_what_qrcode_draws():
+    for payload in ["D1R1L1B1X1Y1", "D5R4L5B5X9Y9", "a longer payload that needs a bigger symbol"]:
+        image = np.array(qr_service.qr_image(payload))
+        np.testing.assert_array_equal(image, _reference(payload))
+    small = np.array(qr_service.qr_image("D1R1L1B1X1Y1", box_size=3, border=1))
+    np.testing.assert_array_equal(small, _reference("D1R1L1B1X1Y1", 3, 1))
+
+def test_png_round_trips_and_is_cached():
+    png = qr_service.qr_png("D2R1L1B1X1Y1")
+    assert qr_service.qr_png("D2R1L1B1X1Y1") is png
+    np.testing.assert_array_equal(np.array(Image.open(BytesIO(png))), np.array(qr_service.qr_image("D2R1L1B1X1Y1")))
+
+def test_precomputed_matrices_are_served_from_the_cache():
+    payloads = [f"D3R2L1B1X{x}Y{y}" for x in range(1, 4) for y in range(1, 4)]
+    qr_service.render_matrices(payloads)
+    hits = qr_service.cache_info()["matrices"]["hits"]
+    for payload in payloads:
+        assert qr_service.qr_matrix(payload, border=0).shape == (21, 21)
+    assert qr_service.cache_info()["matrices"]["hits"] == hits + len(payloads)
@@ -0,0 +1,28 @@
+import database
+
+ADMIN = database.ADMIN_USER
+
+def _count_commits(backend, monkeypatch):
+    commits = []
+    commit = backend.commit
+    monkeypatch.setattr(backend, "commit", lambda changes: commits.append([c[0] for c in changes]) or commit(changes))
+    return commits
+
+def test_a_whole_session_is_one_commit(backend, monkeypatch):
+    locs = [a["location_id"] for a in database.allocate_multiple_aliquots("P1-V1", [("Plasma", 40)], ADMIN)]
+    commits = _count_commits(backend, monkeypatch)
+    # Scanned twice by accident: still one change per tube
+    applied, _, _ = database.bulk_toggle_aliquot_status(locs + locs[:5], ADMIN, "Core Lab")
+    assert applied == locs
+    assert len(commits) == 1 and {"aliquots", "events", "stats"} <= set(commits[0])
+    assert database.get_inventory().users.set_index("email").loc[ADMIN, "checkout_count"] == 40
+
+def test_box_scan_checks_a_box_back_in(backend):
+    locs = [a["location_id"] for a in database.allocate_multiple_aliquots("P1-V1", [("Plasma", 3)], ADMIN)]
+    database.bulk_toggle_aliquot_status(locs, ADMIN, "Core Lab")
+    box = locs[0].split("X")[0]
+    assert sorted(database.get_box_location_ids(box, status="Checked Out")) == sorted(locs)
+    applied, _, _ = database.bulk_toggle_aliquot_status(locs, ADMIN, new_status="Stored")
+    assert applied == locs
+    assert database.get_box_location_ids(box, status="Checked Out") == []
+    assert database.get_box_location_ids("D9R9L9B9") is None
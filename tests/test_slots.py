@@ -0,0 +1,65 @@
+import pandas as pd
+import database
+from occupancy import OccupancyGrid
+
+def _rows(*rows):
+    return pd.DataFrame(rows, columns=["id", "box_id", "x_coord", "y_coord", "status"])
+
+def test_grid_keeps_checked_out_cells_and_frees_consumed_ones():
+    boxes = pd.DataFrame({"id": [1, 2]})
+    grid = OccupancyGrid.from_frames(boxes, _rows(
+        (1, 1, 1, 1, "Stored"),
+        (2, 1, 1, 2, "Checked Out"),
+        (3, 1, 1, 3, "Consumed"),
+        (4, 2, 9, 9, "Stored"),
+    ))
+    assert grid.free_spots(1, 2) == [(1, 3), (1, 4)]
+    assert grid.spots_used(1) == 2 and grid.spots_used(2) == 1
+
+def test_grid_reads_only_the_newest_row_at_a_reused_position():
+    boxes = pd.DataFrame({"id": [1]})
+    # Rows out of id order, as an upload can leave them
+    grid = OccupancyGrid.from_frames(boxes, _rows(
+        (5, 1, 1, 1, "Consumed"), (2, 1, 1, 1, "Checked Out"),
+        (3, 1, 1, 2, "Consumed"), (6, 1, 1, 2, "Stored"),
+    ))
+    assert grid.free_spots(1, 1) == [(1, 1)]
+    assert grid.spots_used(1) == 1
+
+def test_grid_ignores_rows_outside_the_boxes():
+    boxes = pd.DataFrame({"id": [1]})
+    grid = OccupancyGrid.from_frames(boxes, _rows((1, 7, 1, 1, "Stored"), (2, 1, None, 1, "Stored"), (3, 1, 10, 1, "Stored")))
+    assert grid.spots_used(1) == 0
+
+def test_checked_out_slot_is_not_reallocated(backend):
+    admin = database.ADMIN_USER
+    first = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 1)], admin)[0]["location_id"]
+    database.toggle_aliquot_status(first, admin, "Core Lab")
+    second = database.allocate_multiple_aliquots("P2-V1", [("Plasma", 1)], admin)[0]["location_id"]
+    assert second != first
+
+    # Scanning the returned tube checks in P1's tube, not P2's
+    ok, _, new_status = database.toggle_aliquot_status(first, admin)
+    assert ok and new_status == "Stored"
+    current = database.get_current_aliquots([first, second]).set_index("location_id")
+    assert current.loc[first, "patientvisit_id"] == "P1-V1"
+    assert current.loc[second, "status"] == "Stored"
+
+def test_consumed_tube_releases_its_slot_and_stays_out(backend):
+    admin = database.ADMIN_USER
+    first = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 1)], admin)[0]["location_id"]
+    database.toggle_aliquot_status(first, admin, "Core Lab")
+    applied, _, _ = database.bulk_toggle_aliquot_status([first], admin, new_status="Consumed")
+    assert applied == [first]
+    assert database.get_freezer_stats()["total_aliquots_checked_out"] == 0
+
+    ok, _, _ = database.toggle_aliquot_status(first, admin)
+    assert not ok
+    _, _, unchanged = database.bulk_toggle_aliquot_status([first], admin, new_status="Stored")
+    assert unchanged == [first]
+
+    # The released slot is the first free one again
+    assert database.allocate_multiple_aliquots("P2-V1", [("Plasma", 1)], admin)[0]["location_id"] == first
+    assert database.verify_freezer_stats() == {}
+    assert database.get_aliquot_history(first)["Event"].tolist() == [
+        "Stored", "Checked out", "Consumed (slot released)", "Stored"]
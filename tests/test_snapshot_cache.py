@@ -0,0 +1,53 @@
+import pandas as pd
+from snapshot_cache import SnapshotCache
+
+def _frame(revision, n=3):
+    df = pd.DataFrame({"id": range(n), "status": "Stored"})
+    df.attrs["revision"] = revision
+    return df
+
+def test_loads_once_and_hands_out_independent_views():
+    cache = SnapshotCache(max_bytes=1 << 20, max_age=60)
+    loads = []
+    load = lambda: loads.append(1) or _frame(1)
+    view = cache.get("aliquots", load)
+    view.loc[0, "status"] = "Checked Out"
+    again = cache.get("aliquots", load)
+    assert len(loads) == 1
+    assert again.loc[0, "status"] == "Stored"
+    assert again.attrs["snapshot_version"] == view.attrs["snapshot_version"] == cache.version("aliquots")
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_expired_entries_are_revalidated_by_revision():
+    cache = SnapshotCache(max_bytes=1 << 20, max_age=0)
+    revision = [1]
+    loads = []
+    load = lambda: loads.append(1) or _frame(revision[0])
+    first = cache.get("aliquots", load, lambda: revision[0])
+    same = cache.get("aliquots", load, lambda: revision[0])
+    assert len(loads) == 1 and same.attrs["snapshot_version"] == first.attrs["snapshot_version"]
+    revision[0] = 2
+    newer = cache.get("aliquots", load, lambda: revision[0])
+    assert len(loads) == 2 and newer.attrs["revision"] == 2
+    assert newer.attrs["snapshot_version"] != first.attrs["snapshot_version"]
+    assert cache.stats()["revalidations"] == 1
+
+def test_a_slow_reader_never_replaces_a_newer_write():
+    cache = SnapshotCache(max_bytes=1 << 20, max_age=60)
+    cache.put("aliquots", _frame(5))
+    entry = cache.put("aliquots", _frame(4))
+    assert entry.revision == 5
+    assert cache.get("aliquots", lambda: _frame(0)).attrs["revision"] == 5
+
+def test_least_recently_used_sheets_are_evicted_over_budget():
+    size = int(_frame(1).memory_usage(index=True, deep=True).sum())
+    cache = SnapshotCache(max_bytes=size * 2, max_age=60)
+    cache.put("users", _frame(1))
+    cache.put("boxes", _frame(1))
+    cache.get("users", lambda: _frame(1))
+    cache.put("aliquots", _frame(1))
+    assert list(cache.stats()["entries"]) == ["users", "aliquots"]
+    # The newest entry stays even though it alone is over budget
+    cache.put("stats", _frame(1, n=1000))
+    assert list(cache.stats()["entries"]) == ["stats"]
+    assert cache.stats()["evictions"] == 3
@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+import storage
+
+def _users(*emails):
+    return pd.DataFrame({"email": list(emails), "password": "", "role": "user", "status": "approved",
+                         "checkin_count": 0, "checkout_count": 0})
+
+@pytest.fixture(params=["memory", "sqlite"])
+def local_backend(request, tmp_path):
+    if request.param == "sqlite":
+        backend = storage.SQLiteBackend(str(tmp_path / "freezer.db"))
+        yield backend
+        backend.conn.close()
+    else:
+        yield storage.MemoryBackend()
+
+def test_write_then_read_round_trips(local_backend):
+    local_backend.write("users", _users("a@x.org", "b@x.org"))
+    df = local_backend.read("users")
+    assert df["email"].tolist() == ["a@x.org", "b@x.org"]
+    assert df.attrs["revision"] == local_backend.revision("users") == 1
+
+def test_commit_bumps_revision_of_each_sheet_written(local_backend):
+    local_backend.write("users", _users("a@x.org"))
+    revisions = local_backend.commit([("users", _users("a@x.org", "b@x.org"), None, 1)])
+    assert revisions == {"users": 2}
+    assert local_backend.revision("stats") == 0
+
+def test_commit_against_stale_revision_raises_and_writes_nothing(local_backend):
+    local_backend.write("users", _users("a@x.org"))
+    local_backend.write("users", _users("a@x.org", "b@x.org"))
+    stats = pd.DataFrame({"key": ["stored"], "value": [1]})
+    with pytest.raises(storage.ConflictError):
+        local_backend.commit([("stats", stats, None, 0), ("users", _users("c@x.org"), None, 1)])
+    assert local_backend.read("users")["email"].tolist() == ["a@x.org", "b@x.org"]
+    assert local_backend.read("stats").empty
+
+def test_sqlite_applies_deltas_in_place(tmp_path):
+    backend = storage.SQLiteBackend(str(tmp_path / "freezer.db"))
+    old = _users("a@x.org", "b@x.org", "c@x.org")
+    backend.write("users", old)
+    new = _users("a@x.org", "c@x.org", "d@x.org")
+    new.loc[0, "status"] = "pending"
+    delta = storage.compute_delta(backend.read("users"), new, "email")
+    backend.commit([("users", new, delta, 1)])
+    df = backend.read("users").sort_values("email")
+    assert df["email"].tolist() == ["a@x.org", "c@x.org", "d@x.org"]
+    assert df["status"].tolist() == ["pending", "approved", "approved"]
+    backend.conn.close()
+
+def test_sqlite_mirrors_ad_hoc_columns(tmp_path):
+    backend = storage.SQLiteBackend(str(tmp_path / "freezer.db"))
+    backend.write("users", _users("a@x.org").assign(notes="freezer 2"))
+    assert backend.read("users")["notes"].tolist() == ["freezer 2"]
+    backend.conn.close()
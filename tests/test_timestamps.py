@@ -0,0 +1,29 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import database
+from inventory import parse_times, latest_times
+from inventory_query import days_stored
+
+def test_blank_and_bad_timestamps_parse_to_nat():
+    df = pd.DataFrame({"stored_time": ["2026-01-01 08:00:00", "", None, "not a time"]})
+    ts = parse_times(df, "stored_time")
+    assert ts.dtype == np.dtype("datetime64[ns]")
+    assert ts[0] == np.datetime64("2026-01-01T08:00:00") and np.isnat(ts[1:]).all()
+    assert np.isnat(parse_times(df, "checkout_time")).all()
+
+def test_latest_time_is_the_later_of_check_in_and_check_out():
+    stored = np.array(["2026-01-02", "2026-01-01", "NaT", "NaT"], dtype="datetime64[ns]")
+    checkout = np.array(["2026-01-01", "2026-01-03", "2026-01-04", "NaT"], dtype="datetime64[ns]")
+    expected = np.array(["2026-01-02", "2026-01-03", "2026-01-04", "NaT"], dtype="datetime64[ns]")
+    np.testing.assert_array_equal(latest_times(stored, checkout), expected)
+
+def test_days_stored_counts_whole_days_and_zero_for_blanks():
+    stored = np.array(["2026-01-01T20:00", "2026-01-10T07:00", "NaT"], dtype="datetime64[ns]")
+    assert days_stored(stored, datetime(2026, 1, 10, 8, 0)).tolist() == [8, 0, 0]
+
+def test_displayed_days_stored_come_from_the_stored_time(backend, monkeypatch):
+    database.allocate_multiple_aliquots("P1-V1", [("Plasma", 1)], database.ADMIN_USER)
+    later = database.get_current_cst_time() + pd.Timedelta(days=3, hours=1)
+    monkeypatch.setattr(database, "get_current_cst_time", lambda: later)
+    assert database.get_all_aliquots_df()["Days Stored"].tolist() == [3]
@@ -0,0 +1,51 @@
+import pandas as pd
+import database
+
+ADMIN = database.ADMIN_USER
+
+def _upload(*rows):
+    return pd.DataFrame(rows, columns=["Location ID", "Patient-Visit ID", "Specimen Type", "Status"])
+
+def test_upload_updates_inserts_and_rejects(backend):
+    existing = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 2)], ADMIN)[0]["location_id"]
+    ok, msg, rejects = database.upload_aliquots_data(_upload(
+        (existing, "P1-V1", "Plasma", "Checked Out"),
+        ("D1R4L1B1X1Y1", "P2-V1", "Serum", "Stored"),
+        ("d1r4l1b1x1y1 ", "P2-V1", "Serum", "Stored"),
+        ("D1R4L1B1X1Y2", "P2-V1", "Serum", "Stored"),
+        ("D1R4L1B1X1Y2", "P2-V1", "Urine", "Stored"),
+        ("not a location", "P3-V1", "Serum", "Stored"),
+        ("D9R9L9B9X1Y1", "P3-V1", "Serum", "Stored"),
+    ), ADMIN)
+    assert ok and "Inserted: 2, Updated: 2" in msg
+    assert rejects["Row"].tolist() == [3, 6, 7]
+    assert rejects["Reason"].tolist()[1:] == ["Invalid Location ID format", "No box at that door/rack/level/box"]
+
+    current = database.get_current_aliquots([existing, "D1R4L1B1X1Y1", "D1R4L1B1X1Y2"]).set_index("location_id")
+    assert current["status"].tolist() == ["Checked Out", "Stored", "Stored"]
+    # A location listed twice takes its last row
+    assert current.loc["D1R4L1B1X1Y2", "specimen_type"] == "Urine"
+    assert database.get_aliquot_history(existing)["Event"].tolist() == ["Stored", "Overwritten by upload"]
+    assert database.verify_freezer_stats() == {}
+
+def test_upload_with_a_missing_column_is_refused(backend):
+    ok, msg, _ = database.upload_aliquots_data(pd.DataFrame({"Location ID": ["D1R1L1B1X1Y1"]}))
+    assert not ok and msg == "Missing required column: Patient-Visit ID"
+
+def test_upload_to_a_reused_slot_leaves_its_history_alone(backend):
+    slot = database.allocate_multiple_aliquots("P1-V1", [("Plasma", 1)], ADMIN)[0]["location_id"]
+    database.bulk_toggle_aliquot_status([slot], ADMIN, new_status="Consumed")
+    assert database.allocate_multiple_aliquots("P2-V1", [("Plasma", 1)], ADMIN)[0]["location_id"] == slot
+
+    ok, msg, _ = database.upload_aliquots_data(_upload((slot, "P2-V1", "Plasma", "Checked Out")), ADMIN)
+    assert ok and "Inserted: 0, Updated: 1" in msg
+    rows = database.get_inventory().aliquots.sort_values("id")
+    assert rows[["patientvisit_id", "status"]].values.tolist() == [["P1-V1", "Consumed"], ["P2-V1", "Checked Out"]]
+    assert database.verify_freezer_stats() == {}
+    stats = database.get_freezer_stats()
+    assert stats["total_aliquots_stored"] == 0
+
+    # Re-importing the current tube as it is changes nothing
+    database.upload_aliquots_data(_upload((slot, "P2-V1", "Plasma", "Checked Out")), ADMIN)
+    assert database.get_inventory().aliquots.sort_values("id")["status"].tolist() == ["Consumed", "Checked Out"]
+    assert database.verify_freezer_stats() == {}